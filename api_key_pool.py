@@ -0,0 +1,141 @@
+import threading
+import time
+
+import register_model as rm
+from llm_pool import key_fingerprint
+
+# How long a key sits out after the provider rejects it
+RATE_LIMITED_COOLDOWN_SECONDS = 30.0
+UNAUTHORIZED_COOLDOWN_SECONDS = 600.0
+# How often a pool re-reads its keys from the registry
+REFRESH_SECONDS = 5.0
+
+
+class KeyPool:
+    """
+    Spreads one provider's calls over its API keys. ``checkout`` picks the
+    enabled key with the fewest calls in flight, rotating between keys that
+    are tied, so light traffic is dealt out round-robin. A key the provider
+    answered with 429 or 401 is disabled for a cooldown; when every key is
+    disabled, the one coming back soonest is used anyway.
+    """
+    def __init__(self, provider, keys=()):
+        self.provider = provider
+        self._keys = {}
+        # key_id -> usage counters, kept across key refreshes
+        self._usage = {}
+        self._turn = 0
+        self._lock = threading.Lock()
+        self.update(keys)
+
+    def update(self, keys):
+        """Replace the pool's (key_id, api_key) pairs"""
+        with self._lock:
+            self._keys = dict(keys)
+            for key_id, api_key in self._keys.items():
+                usage = self._usage.get(key_id)
+                if usage is None or usage["fingerprint"] != key_fingerprint(api_key):
+                    self._usage[key_id] = {"fingerprint": key_fingerprint(api_key), "in_flight": 0,
+                                           "requests": 0, "rate_limited": 0, "unauthorized": 0,
+                                           "disabled_until": 0.0}
+            for key_id in set(self._usage) - set(self._keys):
+                del self._usage[key_id]
+
+    def checkout(self):
+        """Pick a key for one call; returns (key_id, api_key), or None for an empty pool"""
+        with self._lock:
+            if not self._keys:
+                return None
+            now = time.monotonic()
+            enabled = [key_id for key_id in self._keys if self._usage[key_id]["disabled_until"] <= now]
+            if enabled:
+                start = self._turn % len(enabled)
+                self._turn += 1
+                # Rotating the candidates makes min() break ties round-robin
+                key_id = min(enabled[start:] + enabled[:start], key=lambda k: self._usage[k]["in_flight"])
+            else:
+                key_id = min(self._keys, key=lambda k: self._usage[k]["disabled_until"])
+            usage = self._usage[key_id]
+            usage["in_flight"] += 1
+            usage["requests"] += 1
+            return key_id, self._keys[key_id]
+
+    def checkin(self, key_id, rate_limited=False, unauthorized=False, retry_after=None):
+        """Return a key after its call, disabling it if the provider rejected it"""
+        with self._lock:
+            usage = self._usage.get(key_id)
+            if usage is None:
+                return
+            usage["in_flight"] = max(0, usage["in_flight"] - 1)
+            if rate_limited:
+                usage["rate_limited"] += 1
+                cooldown = retry_after if retry_after is not None else RATE_LIMITED_COOLDOWN_SECONDS
+                usage["disabled_until"] = time.monotonic() + cooldown
+            elif unauthorized:
+                usage["unauthorized"] += 1
+                usage["disabled_until"] = time.monotonic() + UNAUTHORIZED_COOLDOWN_SECONDS
+
+    def available(self):
+        """Number of keys not sitting out a cooldown"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for usage in self._usage.values() if usage["disabled_until"] <= now)
+
+    def stats(self):
+        """Per-key usage keyed by key id; keys are identified by fingerprint only"""
+        now = time.monotonic()
+        with self._lock:
+            return {key_id: {"fingerprint": usage["fingerprint"], "in_flight": usage["in_flight"],
+                             "requests": usage["requests"], "rate_limited": usage["rate_limited"],
+                             "unauthorized": usage["unauthorized"],
+                             "disabled_seconds": max(0.0, usage["disabled_until"] - now)}
+                    for key_id, usage in self._usage.items()}
+
+
+def _registry_keys(provider):
+    try:
+        return rm.get_registry().get_api_key_pool(provider)
+    except ValueError:
+        return ()
+
+
+class KeyPools:
+    """
+    One KeyPool per provider, filled from the registry's config and api_keys
+    tables and re-read every ``refresh_seconds``. Keys stay in memory; nothing
+    is written to the environment.
+    """
+    def __init__(self, keys=_registry_keys, refresh_seconds=REFRESH_SECONDS):
+        self._keys = keys
+        self.refresh_seconds = refresh_seconds
+        # provider -> (pool, refreshed at)
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider):
+        now = time.monotonic()
+        with self._lock:
+            pool, refreshed = self._pools.get(provider, (None, None))
+            if pool is not None and now - refreshed < self.refresh_seconds:
+                return pool
+            if pool is not None:
+                # Marked fresh before reading, so concurrent callers don't all hit the registry
+                self._pools[provider] = (pool, now)
+        keys = self._keys(provider) or ()
+        with self._lock:
+            pool, _ = self._pools.get(provider, (None, None))
+            if pool is None:
+                pool = KeyPool(provider, keys)
+            else:
+                pool.update(keys)
+            self._pools[provider] = (pool, now)
+            return pool
+
+    def stats(self):
+        with self._lock:
+            pools = [pool for pool, _ in self._pools.values()]
+        return {pool.provider: pool.stats() for pool in pools}
+
+
+# Key pools shared by every graph in the process
+shared_key_pools = KeyPools()
@@ -0,0 +1,107 @@
+import asyncio
+import queue
+import threading
+
+
+class AsyncServingLoop:
+    """
+    Event loop on a daemon thread that runs graph generations for synchronous
+    callers such as Streamlit script threads.
+
+    Each generation is a task on the loop, so while the models are waiting on
+    the network hundreds of them can be in flight without a thread apiece.
+    ``max_concurrency`` caps how many run at once; the rest wait their turn.
+    """
+    def __init__(self, max_concurrency=512):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.peak = 0
+        self.completed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread = threading.Thread(target=self._run_loop, name="async-serving", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _guarded(self, coro):
+        async with self._semaphore:
+            with self._lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                result = await coro
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            else:
+                with self._lock:
+                    self.completed += 1
+                return result
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro), self.loop)
+
+    def iterate(self, aiterable):
+        """
+        Consume an async iterable on the loop and yield its items in the calling thread.
+        Errors raised by the iterable are re-raised here; closing the generator early
+        cancels the task on the loop.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in aiterable:
+                    items.put(item)
+            finally:
+                items.put(done)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    break
+                yield item
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "peak": self.peak,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_concurrency": self.max_concurrency,
+            }
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+_serving_loop = None
+_serving_loop_lock = threading.Lock()
+
+
+def get_serving_loop(max_concurrency=512):
+    """Process-wide serving loop, started on first use"""
+    global _serving_loop
+    with _serving_loop_lock:
+        if _serving_loop is None:
+            _serving_loop = AsyncServingLoop(max_concurrency)
+        return _serving_loop
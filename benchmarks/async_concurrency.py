@@ -0,0 +1,98 @@
+"""
+Concurrency scaling of the chatbot graphs: thread-per-request graph.invoke versus
+graph.ainvoke tasks on one event loop, against a local fake model with fixed latency.
+
+Run from the repository root:
+
+    python -m benchmarks.async_concurrency --concurrency 1 10 100 500 --latency 0.2
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import InMemorySaver
+
+import lg_cp_bend
+import lg_sc_bend
+
+
+class LatencyFakeChatModel(BaseChatModel):
+    """Answers with a fixed text after ``latency`` seconds, blocking in invoke and awaiting in ainvoke"""
+    latency: float = 0.2
+    answer: str = "This is a canned answer from the fake model."
+
+    @property
+    def _llm_type(self):
+        return "latency-fake"
+
+    def _result(self):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._result()
+
+
+def build_graph(backend, latency):
+    llm = LatencyFakeChatModel(latency=latency)
+    if backend == "cp":
+        # No bypass, so every follow-up pays for reformulation plus the answer
+        return lg_cp_bend.build_chatbot_graph(llm, llm, checkpointer=InMemorySaver(),
+                                              self_containment_detector=None)
+    return lg_sc_bend.build_chatbot_graph(llm, checkpointer=InMemorySaver())
+
+
+def request_inputs():
+    # A unique follow-up turn, so the cp graph runs its reformulation step and caches don't hit
+    return {"messages": [HumanMessage("Tell me about Paris."), AIMessage("Paris is the capital of France."),
+                         HumanMessage(f"How many people live there? ({uuid.uuid4().hex[:8]})")]}
+
+
+def request_config():
+    return {"configurable": {"thread_id": str(uuid.uuid4())}}
+
+
+def run_threaded(graph, concurrency, max_workers):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(graph.invoke, request_inputs(), request_config()) for _ in range(concurrency)]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - started
+
+
+async def run_async(graph, concurrency):
+    started = time.perf_counter()
+    await asyncio.gather(*(graph.ainvoke(request_inputs(), request_config()) for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["cp", "sc"], default="cp")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per fake model call")
+    parser.add_argument("--threads", type=int, default=32, help="Worker threads for the threaded runs")
+    args = parser.parse_args()
+
+    graph = build_graph(args.backend, args.latency)
+    print(f"backend={args.backend} latency={args.latency}s threads={args.threads}")
+    print(f"{'concurrency':>11} {'threaded s':>11} {'req/s':>8} {'async s':>9} {'req/s':>8}")
+    for concurrency in args.concurrency:
+        threaded = run_threaded(graph, concurrency, args.threads)
+        asynchronous = asyncio.run(run_async(graph, concurrency))
+        print(f"{concurrency:>11} {threaded:>11.2f} {concurrency / threaded:>8.1f} "
+              f"{asynchronous:>9.2f} {concurrency / asynchronous:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict, defaultdict
+from functools import partial
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+# Default budget for all threads' checkpoints held in memory
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver with bounded memory use.
+
+    Only the newest ``keep_last`` checkpoints of each thread are kept, along
+    with the pending writes and channel blobs they still reference. Threads are
+    tracked in LRU order with their serialized size; when the total exceeds
+    ``max_bytes``, the least recently used threads are evicted. With
+    ``spill_dir`` set, an evicted thread is pickled there and loaded back the
+    next time it is read or written; without it, the thread is dropped.
+    ``list(None)`` only sees threads currently in memory. With a spill
+    directory, the async API runs in the default executor so spill and
+    rehydrate I/O stays off the event loop.
+    """
+    def __init__(self, keep_last=20, max_bytes=DEFAULT_MAX_BYTES, spill_dir=None, serde=None):
+        super().__init__(serde=serde)
+        if keep_last < 1:
+            raise ValueError("keep_last must be at least 1.")
+        self.keep_last = keep_last
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.evictions = 0
+        self.rehydrations = 0
+        # thread_id -> serialized bytes held, least recently used first
+        self._threads = OrderedDict()
+        # Sum of self._threads, kept up to date instead of re-summed on every write
+        self._bytes = 0
+        # Per-thread indexes into the parent's flat writes/blobs dicts
+        self._thread_writes = defaultdict(set)
+        self._thread_blobs = defaultdict(set)
+        # thread_id -> {(checkpoint_ns, checkpoint_id): channel_versions}
+        self._versions = defaultdict(dict)
+        self._lock = threading.RLock()
+
+    def _spill_path(self, thread_id):
+        digest = hashlib.sha256(str(thread_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.pkl")
+
+    def _touch(self, thread_id):
+        if thread_id not in self._threads:
+            self._rehydrate(thread_id)
+            # New entries go to the most recently used end
+            self._set_size(thread_id, self._measure(thread_id))
+            self._enforce_budget(keep=thread_id)
+        else:
+            self._threads.move_to_end(thread_id)
+
+    def _set_size(self, thread_id, size):
+        self._bytes += size - self._threads.get(thread_id, 0)
+        self._threads[thread_id] = size
+
+    def _measure(self, thread_id):
+        size = 0
+        for checkpoints in self.storage.get(thread_id, {}).values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                size += len(checkpoint[1]) + len(metadata[1])
+        for key in self._thread_writes.get(thread_id, ()):
+            size += sum(len(value[1]) for _, _, value, _ in self.writes.get(key, {}).values())
+        for key in self._thread_blobs.get(thread_id, ()):
+            blob = self.blobs.get(key)
+            if blob is not None:
+                size += len(blob[1])
+        return size
+
+    def _prune(self, thread_id, checkpoint_ns):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        versions = self._versions[thread_id]
+        # Checkpoint ids sort by creation time
+        for checkpoint_id in sorted(checkpoints)[:-self.keep_last]:
+            del checkpoints[checkpoint_id]
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes.pop(key, None)
+            self._thread_writes[thread_id].discard(key)
+            versions.pop((checkpoint_ns, checkpoint_id), None)
+        referenced = {(thread_id, checkpoint_ns, channel, version)
+                      for checkpoint_id in checkpoints
+                      for channel, version in versions.get((checkpoint_ns, checkpoint_id), {}).items()}
+        blobs = self._thread_blobs[thread_id]
+        for key in [k for k in blobs if k[1] == checkpoint_ns and k not in referenced]:
+            self.blobs.pop(key, None)
+            blobs.discard(key)
+
+    def _enforce_budget(self, keep):
+        # Evict from the least recently used end; ``keep`` was just touched, so it is last
+        while self._bytes > self.max_bytes:
+            thread_id = next(iter(self._threads))
+            if thread_id == keep:
+                break
+            self._evict(thread_id)
+
+    def _take(self, thread_id):
+        """Remove a thread from memory and return its data"""
+        data = {
+            "storage": dict(self.storage.pop(thread_id, {})),
+            "writes": {key: self.writes.pop(key) for key in self._thread_writes.pop(thread_id, ())
+                       if key in self.writes},
+            "blobs": {key: self.blobs.pop(key) for key in self._thread_blobs.pop(thread_id, ())
+                      if key in self.blobs},
+            "versions": self._versions.pop(thread_id, {}),
+        }
+        self._bytes -= self._threads.pop(thread_id, 0)
+        return data
+
+    def _evict(self, thread_id):
+        data = self._take(thread_id)
+        if self.spill_dir and data["storage"]:
+            with open(self._spill_path(thread_id), "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.evictions += 1
+
+    def _rehydrate(self, thread_id):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(thread_id)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        os.remove(path)
+        for checkpoint_ns, checkpoints in data["storage"].items():
+            self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        self.writes.update(data["writes"])
+        self._thread_writes[thread_id].update(data["writes"])
+        self.blobs.update(data["blobs"])
+        self._thread_blobs[thread_id].update(data["blobs"])
+        self._versions[thread_id].update(data["versions"])
+        self.rehydrations += 1
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            results = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from results
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._touch(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._versions[thread_id][(checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+            self._thread_blobs[thread_id].update((thread_id, checkpoint_ns, channel, version)
+                                                 for channel, version in new_versions.items())
+            self._prune(thread_id, checkpoint_ns)
+            self._set_size(thread_id, self._measure(thread_id))
+            self._enforce_budget(keep=thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            self._thread_writes[thread_id].add(
+                (thread_id, configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"]))
+            self._set_size(thread_id, self._measure(thread_id))
+            self._enforce_budget(keep=thread_id)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._take(thread_id)
+            if self.spill_dir and os.path.exists(self._spill_path(thread_id)):
+                os.remove(self._spill_path(thread_id))
+
+    def thread_memory(self):
+        """Gauge of serialized bytes held in memory per thread"""
+        with self._lock:
+            return dict(self._threads)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threads": len(self._threads),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "rehydrations": self.rehydrations,
+            }
+
+    # Without a spill directory everything stays in memory and runs inline on the loop
+
+    async def _run(self, func, *args, **kwargs):
+        if not self.spill_dir:
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def aget_tuple(self, config):
+        return await self._run(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        results = await self._run(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in results:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await self._run(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await self._run(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await self._run(self.delete_thread, thread_id)
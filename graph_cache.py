@@ -0,0 +1,84 @@
+import threading
+import time
+
+from lru_cache import LRUCache
+
+
+class GraphCache:
+    """
+    Bounded cache of compiled graphs keyed by model configuration.
+
+    Sessions acquire the graph for their current configuration, and each graph
+    key counts the sessions using it. When a session moves to another
+    configuration, the graph it left behind is evicted once no other session
+    uses it. Browser sessions end without notice, so sessions are themselves
+    kept in an LRU bounded by ``max_sessions`` and forgotten after
+    ``session_ttl`` idle seconds (default: ``ttl``), which releases their
+    graphs. Idle graphs also age out through the LRU bound and TTL.
+    Conversation history lives in the backend's shared checkpointer, so
+    evicting a graph never loses it. ``on_evict(key, graph)`` is called
+    whenever a graph leaves the cache.
+    """
+    def __init__(self, maxsize=8, ttl=3600, on_evict=None, max_sessions=10000, session_ttl=None):
+        self._graphs = LRUCache(maxsize=maxsize, ttl=ttl, on_evict=on_evict)
+        self.session_ttl = session_ttl if session_ttl is not None else ttl
+        self._sessions = LRUCache(maxsize=max_sessions, ttl=self.session_ttl, on_evict=self._session_dropped)
+        # graph key -> number of sessions using it
+        self._refs = {}
+        self._next_expiry = 0.0
+        # Reentrant: session evictions call back into _session_dropped under the lock
+        self._lock = threading.RLock()
+
+    def _session_dropped(self, session_id, key):
+        # Called by the session LRU with self._lock held
+        refs = self._refs.get(key, 0) - 1
+        if refs > 0:
+            self._refs[key] = refs
+            return
+        self._refs.pop(key, None)
+        self._graphs.discard(key)
+
+    def _expire_sessions(self):
+        # A full scan, so only every tenth of the session TTL
+        if self.session_ttl is None:
+            return
+        now = time.monotonic()
+        if now >= self._next_expiry:
+            self._next_expiry = now + self.session_ttl / 10
+            self._sessions.expire()
+
+    def acquire(self, session_id, key, factory):
+        """Return the graph for ``key`` on behalf of a session, building it on a miss"""
+        with self._lock:
+            self._expire_sessions()
+            if self._sessions.get(session_id) != key:
+                self._refs[key] = self._refs.get(key, 0) + 1
+                # Replacing the session's previous key releases that graph
+                self._sessions.put(session_id, key)
+        return self._graphs.get_or_create(key, factory)
+
+    def release(self, session_id):
+        """Forget a session, evicting its graph if nobody else uses it"""
+        with self._lock:
+            self._sessions.discard(session_id)
+
+    def get_or_create(self, key, factory):
+        return self._graphs.get_or_create(key, factory)
+
+    def discard(self, key):
+        self._graphs.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._refs.clear()
+        self._graphs.clear()
+
+    def __len__(self):
+        return len(self._graphs)
+
+    def stats(self):
+        stats = self._graphs.stats()
+        with self._lock:
+            stats["sessions"] = len(self._sessions)
+        return stats
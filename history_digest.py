@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import rate_limiter
+from reasoning import strip_reasoning, was_truncated
+
+SUMMARY_PROMPT = """Summarize the conversation below in a few sentences. Keep the facts, names,
+numbers and open questions someone would need to understand follow-up questions.
+
+Summary of the conversation so far:
+{summary}
+
+Newer conversation lines:
+{lines}
+
+Updated summary:"""
+
+
+def format_turn(message):
+    """Render one message as a history line, or None for system messages"""
+    if isinstance(message, SystemMessage):
+        return None
+    role = "User" if isinstance(message, HumanMessage) else "Assistant"
+    return f"{role}: {message.content}"
+
+
+def render_history(summary, turns):
+    """Build the history text for the reformulation prompt"""
+    parts = []
+    if summary:
+        parts.append(f"Summary of earlier conversation: {summary}")
+    parts.extend(turns)
+    return "\n".join(parts)
+
+
+class HistoryCompactor:
+    """
+    Keeps the per-thread history digest bounded.
+
+    Once a thread holds more than ``max_lines`` history lines, the oldest lines
+    (all but the newest ``keep_lines``) are handed to a background worker that
+    folds them into the rolling summary. The next turn of that thread picks up
+    the finished summary, so no request waits for the summarization call. A
+    finished summary nobody picks up within ``pending_ttl`` seconds, e.g. of an
+    abandoned session, is dropped.
+    """
+    def __init__(self, max_lines=12, keep_lines=6, max_workers=2, pending_ttl=3600):
+        if keep_lines >= max_lines:
+            raise ValueError("keep_lines must be smaller than max_lines.")
+        self.max_lines = max_lines
+        self.keep_lines = keep_lines
+        self.pending_ttl = pending_ttl
+        self.compactions = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="history-compactor")
+        # thread_id -> (future resolving to the new summary, number of lines it covers)
+        self._pending = {}
+        # (finished at, thread_id, future) in completion order, for expiring unclaimed summaries
+        self._finished = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        # Called with self._lock held
+        cutoff = time.monotonic() - self.pending_ttl
+        while self._finished and self._finished[0][0] < cutoff:
+            _, thread_id, future = self._finished.popleft()
+            pending = self._pending.get(thread_id)
+            if pending is not None and pending[0] is future:
+                del self._pending[thread_id]
+
+    def _finish(self, thread_id, future):
+        with self._lock:
+            self._finished.append((time.monotonic(), thread_id, future))
+            self._expire()
+
+    def fold(self, thread_id, summary, turns):
+        """Apply a finished background summary; returns (summary, turns, changed)"""
+        with self._lock:
+            self._expire()
+            pending = self._pending.get(thread_id)
+            if pending is None or not pending[0].done():
+                return summary, turns, False
+            del self._pending[thread_id]
+        future, covered = pending
+        try:
+            new_summary = future.result()
+        except Exception:
+            # Summarization failed; keep the lines and try again on a later turn
+            return summary, turns, False
+        if not isinstance(new_summary, str) or not new_summary.strip():
+            return summary, turns, False
+        self.compactions += 1
+        return new_summary, turns[covered:], True
+
+    def schedule(self, thread_id, summary, turns, summarize):
+        """Start summarizing the oldest lines in the background if the window is full"""
+        if len(turns) <= self.max_lines:
+            return
+        with self._lock:
+            if thread_id in self._pending:
+                return
+            covered = len(turns) - self.keep_lines
+            old_lines = list(turns[:covered])
+            future = self._executor.submit(summarize, summary, old_lines)
+            self._pending[thread_id] = (future, covered)
+        # Outside the lock: the callback runs right away if the future is already done
+        future.add_done_callback(lambda done: self._finish(thread_id, done))
+
+    def summarize_with(self, llm, config=None):
+        """
+        Summarization function that asks ``llm`` to extend the rolling summary.
+        Reasoning blocks are stripped from the output. Empty or truncated output
+        (including an unclosed reasoning block) raises ValueError, so ``fold``
+        keeps the original lines instead of replacing them with it.
+        """
+        def summarize(summary, lines):
+            prompt = SUMMARY_PROMPT.format(summary=summary or "Nothing yet.", lines="\n".join(lines))
+            response = rate_limiter.invoke(llm, [HumanMessage(content=prompt)], config=config)
+            if was_truncated(response):
+                raise ValueError("History summary was cut off at the token limit.")
+            message, _ = strip_reasoning(response)
+            text = message.content.strip() if isinstance(message.content, str) else ""
+            if not text:
+                raise ValueError("History summary came back empty.")
+            return text
+        return summarize
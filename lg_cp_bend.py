@@ -1,12 +1,30 @@
+import asyncio
+import dataclasses
+import re
+import time
 from typing import Annotated
 
 from typing_extensions import TypedDict
 
 from langgraph.graph import StateGraph, START, END
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import InMemorySaver
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 import register_model as rm
+from graph_cache import GraphCache
+from llm_pool import ModelSpec, attach_pooled_models, llm_pool, release_pooled_models
+from bounded_checkpointer import DEFAULT_MAX_BYTES, BoundedMemorySaver
+from sqlite_checkpointer import SQLiteCheckpointer, checkpointer_from_env
+import rate_limiter
+import response_cache
+from reasoning import split_reasoning, strip_reasoning, was_truncated
+import semantic_cache
+from self_containment import BypassStats, HeuristicSelfContainmentDetector
+from history_digest import HistoryCompactor, format_turn, render_history
+from speculation import SpeculationStats, SpeculativeResponder
+from token_budget import resolve_token_budget, token_counter, trim_lines_to_budget, trim_messages_to_budget
+from tiered_cache import SQLiteCacheTier, TieredCache, cache_key, model_fingerprint, normalize_text
 
 class State(TypedDict):
     # Messages have the type "list". The `add_messages` function
@@ -14,29 +32,167 @@ class State(TypedDict):
     # (in this case, it appends messages to the list, rather than overwriting them)
     messages: Annotated[list, add_messages]
     reformulated_question: str = ""  # Add field to store reformulated question
+    # Incrementally maintained history digest for the reformulation prompt:
+    # recent "User: ..."/"Assistant: ..." lines plus a rolling summary of older ones
+    history_turns: list
+    history_summary: str
+    # Answer computed speculatively alongside the reformulation, consumed by the chatbot node
+    speculative_answer: str
+    # Reasoning of the latest answer, kept out of the messages and the history digest
+    reasoning: str
 
-# Initialize the chat models
-response_llm = None  # Model for generating responses
-reformulate_llm = None  # Model for reformulating questions
+# Compiled graphs keyed by model configuration; personalities share a graph.
+# Evicted graphs hand their pooled model instances back to the LLM pool.
+graph_cache = GraphCache(maxsize=8, ttl=3600, on_evict=release_pooled_models)
 
-def create_context_processor():
+# Conversation history is shared by every graph, so it outlives graph eviction.
+# In bounded memory by default; set CHATBOT_CHECKPOINT_DB to keep it in SQLite across restarts.
+shared_checkpointer = checkpointer_from_env(BoundedMemorySaver)
+
+def configure_checkpointer(db_path=None, keep_last=20, max_idle_seconds=None,
+                           max_bytes=DEFAULT_MAX_BYTES, spill_dir=None):
+    """
+    Switches the shared checkpointer to SQLite at db_path, or with None to the bounded
+    in-memory store (idle threads spill to spill_dir once max_bytes is exceeded).
+    Cached graphs are dropped so graphs built from now on use the new checkpointer.
+    """
+    global shared_checkpointer
+    if db_path:
+        shared_checkpointer = SQLiteCheckpointer(db_path, keep_last=keep_last, max_idle_seconds=max_idle_seconds)
+    else:
+        shared_checkpointer = BoundedMemorySaver(keep_last=keep_last, max_bytes=max_bytes, spill_dir=spill_dir)
+    graph_cache.clear()
+    return shared_checkpointer
+
+# Opt-in check for questions that need no reformulation, and how often it fires
+default_self_containment_detector = HeuristicSelfContainmentDetector()
+bypass_stats = BypassStats()
+
+# Folds old history lines into the rolling summary in the background
+history_compactor = HistoryCompactor(max_lines=12, keep_lines=6)
+
+# Wins, losses and latency saved by speculative responses across all graphs
+speculation_stats = SpeculationStats()
+
+# Memoized reformulations, keyed on model, template, normalized history and question
+reformulation_cache = TieredCache(maxsize=2048, ttl=3600)
+
+def configure_reformulation_cache(maxsize=2048, ttl=3600, db_path=None):
+    """
+    Replaces the reformulation cache. With db_path set, reformulations are also kept
+    in a SQLite table there, so they survive restarts and are shared between processes.
+    """
+    global reformulation_cache
+    persistent = SQLiteCacheTier(db_path, table="reformulation_cache", ttl=ttl) if db_path else None
+    reformulation_cache = TieredCache(maxsize=maxsize, ttl=ttl, persistent=persistent)
+    return reformulation_cache
+
+# Output shaping for the reformulation call: a generation cap, the default stop sequences
+# that end an echo of the prompt (build_chatbot_graph's reformulation_stop overrides them,
+# e.g. with None for models that reject stop sequences), and the longest reformulated
+# question handed on to the response model
+REFORMULATION_MAX_TOKENS = 512
+REFORMULATION_STOP = ["\nChat history:", "\nLatest user question:"]
+REFORMULATED_QUESTION_MAX_TOKENS = 256
+
+# "Reformulated question:", "Here is the self-contained question with context:" and the like
+_PREAMBLE_RE = re.compile(r"^(?:here is |here's )?(?:the |a )?(?:reformulated |rewritten |self-contained |clear )*"
+                          r"question(?: with (?:the )?(?:necessary )?context)?\s*:\s*", re.IGNORECASE)
+
+def reformulation_model_kwargs(provider, max_tokens=REFORMULATION_MAX_TOKENS):
+    """init_chat_model kwargs that cap the reformulation model's output for a provider"""
+    if (provider or "").lower() == "ollama":
+        return {"num_predict": max_tokens}
+    return {"max_tokens": max_tokens}
+
+def _shaped_reformulation(text, max_tokens=REFORMULATED_QUESTION_MAX_TOKENS):
+    """The usable question in raw reformulation output, or None"""
+    _, answer = split_reasoning(text)
+    answer = answer if isinstance(answer, str) else ""
+    for stop in REFORMULATION_STOP or ():
+        answer = answer.split(stop, 1)[0]
+    answer = _PREAMBLE_RE.sub("", answer.strip()).strip().strip('"\u201c\u201d').strip()
+    if not answer or token_counter.count_text(answer) > max_tokens:
+        return None
+    return answer
+
+def shape_reformulation(text, question, max_tokens=REFORMULATED_QUESTION_MAX_TOKENS):
+    """
+    Turns raw reformulation output into the question for the response model: drops the
+    reasoning block, anything past a stop sequence, a leading "Reformulated question:"
+    preamble and wrapping quotes. Falls back to the user's own question when nothing
+    usable is left (e.g. the output was cut off mid-reasoning) or it exceeds max_tokens.
+    """
+    answer = _shaped_reformulation(text, max_tokens)
+    return question if answer is None else answer
+
+def get_system_prompt(config: RunnableConfig):
+    """
+    Resolves the system prompt for a run from config["configurable"], either given
+    directly as "system_prompt" or looked up from the registry by "personality".
+    """
+    configurable = (config or {}).get("configurable", {})
+    if configurable.get("system_prompt"):
+        return configurable["system_prompt"]
+    personality_name = configurable.get("personality")
+    if personality_name:
+        return rm.get_registry().snapshot().personality_description(personality_name)
+    return None
+
+def create_context_processor(reformulate_llm=None, self_containment_detector=None, speculator=None,
+                             summary_llm=None, reformulation_stop=REFORMULATION_STOP):
     """
     Creates a node that processes chat history and reformulates the user question with context.
+    The reformulation model is bound to the node, so graphs for different models can run side by side.
+    Old history lines are summarized with summary_llm (default: the reformulation model), which
+    should not carry the reformulation's output cap.
+    Questions the detector finds self-contained skip the reformulation model entirely.
+    With a speculator, the response model starts on the raw question while reformulation runs.
+    The reformulation call is sent reformulation_stop as its stop sequences; None sends none.
+    The node runs synchronously under stream/invoke and with ainvoke under astream/ainvoke.
     """
-    def context_processor(state: State):
+    stop_kwargs = {"stop": reformulation_stop} if reformulation_stop else {}
+    
+    def prepare(state: State, config: RunnableConfig):
+        """
+        Everything before the reformulation call. Returns (result, context_message, key);
+        context_message is None when the result is final and no model call is needed.
+        """
         messages = state["messages"]
         
         if not messages:
-            return {"reformulated_question": ""}
+            return {"reformulated_question": ""}, None, None
         
         # Get the last user message
         last_message = messages[-1] if messages else None
         if not last_message or not isinstance(last_message, HumanMessage):
-            return {"reformulated_question": ""}
+            return {"reformulated_question": ""}, None, None
         
         # If there's no history (first message), pass through as is
         if len(messages) <= 1:
-            return {"reformulated_question": last_message.content}
+            return {"reformulated_question": last_message.content}, None, None
+        
+        if not reformulate_llm:
+            return {"reformulated_question": last_message.content}, None, None
+        
+        # Use the history digest carried in the state instead of re-reading every message
+        history_turns = state.get("history_turns")
+        history_summary = state.get("history_summary", "")
+        if history_turns is None:
+            # Threads checkpointed before the digest existed are seeded from their messages once
+            history_turns = [line for line in map(format_turn, messages[:-1]) if line]
+        thread_id = config.get("configurable", {}).get("thread_id")
+        history_summary, history_turns, _ = history_compactor.fold(thread_id, history_summary, history_turns)
+        # Older lines are summarized off the request path and picked up on a later turn
+        history_compactor.schedule(thread_id, history_summary, history_turns,
+                                   history_compactor.summarize_with(summary_llm or reformulate_llm,
+                                                                    {"tags": [TAG_NOSTREAM]}))
+        digest = {"history_turns": history_turns, "history_summary": history_summary}
+        
+        # Clearly standalone questions go straight to the chatbot node
+        if self_containment_detector and self_containment_detector(last_message.content):
+            bypass_stats.record_bypass()
+            return {"reformulated_question": last_message.content, **digest}, None, None
         
         # Create a system prompt for context processing
         context_prompt = """You are a context processor. Your job is to:
@@ -54,15 +210,12 @@ Latest user question: {question}
 
 Provide a clear, self-contained reformulated question with necessary context:"""
         
-        # Build chat history (excluding the last message)
-        history_text = ""
-        for i, msg in enumerate(messages[:-1]):
-            if isinstance(msg, SystemMessage):
-                continue
-            elif isinstance(msg, HumanMessage):
-                history_text += f"User: {msg.content}\n"
-            else:
-                history_text += f"Assistant: {msg.content}\n"
+        # Build chat history (excluding the last message), keeping the newest lines that fit
+        # the reformulation model's token budget next to the prompt, summary and question
+        prompt_tokens = (token_counter.count_text(context_prompt) + token_counter.count_text(history_summary)
+                         + token_counter.count_text(last_message.content))
+        budget = resolve_token_budget(config, "reformulate_token_budget") - prompt_tokens
+        history_text = render_history(history_summary, trim_lines_to_budget(history_turns, budget))
         
         # Create the context processing message
         context_message = HumanMessage(
@@ -72,23 +225,91 @@ Provide a clear, self-contained reformulated question with necessary context:"""
             )
         )
         
+        # Retries and identical short threads reuse an earlier reformulation
+        key = cache_key(model_fingerprint(reformulate_llm), context_prompt,
+                        normalize_text(history_text), normalize_text(last_message.content))
+        cached = reformulation_cache.get(key)
+        if cached is not None:
+            return {"reformulated_question": cached, **digest}, None, None
+        
+        return {"reformulated_question": last_message.content, **digest}, context_message, key
+    
+    def speculative_prompt(state: State, config: RunnableConfig):
+        return trim_messages_to_budget(state["messages"], resolve_token_budget(config)), get_system_prompt(config)
+    
+    def finish(result, key, reformulated_response, started):
+        bypass_stats.record_reformulation(time.perf_counter() - started)
+        # A cut-off or unusable output falls back to the user's question, which result
+        # still carries; the fallback isn't cached, so the next attempt asks again
+        if was_truncated(reformulated_response):
+            return result
+        reformulated_question = _shaped_reformulation(reformulated_response.content)
+        if reformulated_question is None:
+            return result
+        reformulation_cache.put(key, reformulated_question)
+        # Return only the reformulated_question and history digest, NO messages update
+        result["reformulated_question"] = reformulated_question
+        return result
+    
+    def context_processor(state: State, config: RunnableConfig):
+        result, context_message, key = prepare(state, config)
+        if context_message is None:
+            return result
+        
+        # Speculatively answer the raw question with recent history in the meantime
+        speculation = speculator.start(*speculative_prompt(state, config)) if speculator else None
         # Get the reformulated question from the reformulate LLM
-        if reformulate_llm:
-            reformulated_response = reformulate_llm.invoke([context_message])
-            # Return only the reformulated_question, NO messages update
-            return {"reformulated_question": reformulated_response.content}
+        # Keep the reformulation out of the token stream; only the answer is shown
+        started = time.perf_counter()
+        reformulated_response = rate_limiter.invoke(reformulate_llm, [context_message],
+                                                    config={"tags": [TAG_NOSTREAM]}, **stop_kwargs)
+        result = finish(result, key, reformulated_response, started)
+        if speculation is not None:
+            speculative_answer = speculator.resolve(speculation, result["reformulated_question"])
+            if speculative_answer:
+                result["speculative_answer"] = speculative_answer
+        return result
+    
+    async def acontext_processor(state: State, config: RunnableConfig):
+        # prepare and finish read the registry and the reformulation cache's SQLite tier and
+        # count tokens, so they run in a worker thread to keep the event loop free
+        result, context_message, key = await asyncio.to_thread(prepare, state, config)
+        if context_message is None:
+            return result
         
-        return {"reformulated_question": last_message.content}
+        if speculator:
+            speculation = speculator.astart(*await asyncio.to_thread(speculative_prompt, state, config))
+        else:
+            speculation = None
+        started = time.perf_counter()
+        reformulated_response = await rate_limiter.ainvoke(reformulate_llm, [context_message],
+                                                           config={"tags": [TAG_NOSTREAM]}, **stop_kwargs)
+        result = await asyncio.to_thread(finish, result, key, reformulated_response, started)
+        if speculation is not None:
+            speculative_answer = await speculator.aresolve(speculation, result["reformulated_question"])
+            if speculative_answer:
+                result["speculative_answer"] = speculative_answer
+        return result
     
-    return context_processor
+    return RunnableLambda(context_processor, afunc=acontext_processor, name="context_processor")
 
-def create_chatbot(system_content: str):
-    def chatbot(state: State):
+def create_chatbot(response_llm=None):
+    """
+    Creates the node that answers the reformulated question. Like the context processor,
+    it has a synchronous and an async implementation sharing the same steps.
+    """
+    def prepare(state: State, config: RunnableConfig):
+        """
+        Returns None when there is nothing to answer, else (chatbot_messages, cached_answer,
+        semantic_partition); semantic_partition is None when the semantic cache doesn't apply.
+        """
         # Get the reformulated question from the previous node
         reformulated_question = state.get("reformulated_question", "")
         
-        if not reformulated_question:
-            return {}
+        if not reformulated_question or not response_llm:
+            return None
+        
+        system_content = get_system_prompt(config)
         
         # Create fresh messages with only system message and reformulated question
         chatbot_messages = []
@@ -97,48 +318,157 @@ def create_chatbot(system_content: str):
         
         chatbot_messages.append(HumanMessage(content=reformulated_question))
         
-        # Get the response from the response LLM
-        if response_llm:
-            response = response_llm.invoke(chatbot_messages)
-            # Only return the assistant response, not the reformulated question
-            return {"messages": [response]}
+        # The speculative answer was accepted by the context processor
+        speculative_answer = state.get("speculative_answer")
+        if speculative_answer:
+            return chatbot_messages, speculative_answer, None
         
-        return {}
-    return chatbot
-
-def build_chatbot_graph(personality_name: str = None, response_model=None, reformulate_model=None):
-    """
-    Builds the chatbot graph with two separate nodes: context processor and chatbot.
-    """
+        # Paraphrases of questions answered before are replayed from the semantic cache,
+        # partitioned by model and system prompt; it follows the response cache's policy
+        semantic = semantic_cache.shared_semantic_cache
+        personality = config.get("configurable", {}).get("personality")
+        if semantic is None or not response_cache.shared_response_cache.policy.is_eligible(response_llm, personality):
+            return chatbot_messages, None, None
+        partition = cache_key(model_fingerprint(response_llm), system_content)
+        return chatbot_messages, semantic.lookup(partition, reformulated_question), partition
     
-    system_message = None
+    def finish(state: State, response, semantic_partition, answered_by_model):
+        # Only the answer goes into the thread history; the reasoning gets its own channel
+        response, reasoning = strip_reasoning(response)
+        semantic = semantic_cache.shared_semantic_cache
+        if (answered_by_model and semantic_partition is not None and semantic is not None
+                and isinstance(response.content, str) and response.content):
+            semantic.add(semantic_partition, state["reformulated_question"], response.content)
+        # Append this turn to the history digest rather than rebuilding it next time
+        last_message = state["messages"][-1]
+        history_turns = state.get("history_turns")
+        if history_turns is None:
+            history_turns = [line for line in map(format_turn, state["messages"][:-1]) if line]
+        history_turns = history_turns + [format_turn(last_message), format_turn(response)]
+        # Only return the assistant response, not the reformulated question
+        return {"messages": [response], "history_turns": history_turns, "speculative_answer": "",
+                "reasoning": reasoning}
     
-    # Get the actual system message content from the personality
-    if personality_name:
-        registry = rm.ModelRegistry()
-        system_message = registry.get_personality_description(personality_name)
+    def chatbot(state: State, config: RunnableConfig):
+        plan = prepare(state, config)
+        if plan is None:
+            return {}
+        chatbot_messages, cached_answer, semantic_partition = plan
+        responses = response_cache.shared_response_cache
+        if cached_answer is not None:
+            response = responses.replay(cached_answer)
+        else:
+            # Deterministic calls seen before are replayed from the response cache
+            response = responses.invoke(response_llm, chatbot_messages, config)
+        return finish(state, response, semantic_partition, cached_answer is None)
     
-    global response_llm, reformulate_llm
+    async def achatbot(state: State, config: RunnableConfig):
+        # The registry, semantic cache (numpy) and token counting work blocks, so it runs in a worker thread
+        plan = await asyncio.to_thread(prepare, state, config)
+        if plan is None:
+            return {}
+        chatbot_messages, cached_answer, semantic_partition = plan
+        responses = response_cache.shared_response_cache
+        if cached_answer is not None:
+            response = await responses.areplay(cached_answer)
+        else:
+            response = await responses.ainvoke(response_llm, chatbot_messages, config)
+        return await asyncio.to_thread(finish, state, response, semantic_partition, cached_answer is None)
     
-    # Set the models
-    if response_model:
-        response_llm = response_model
-    if reformulate_model:
-        reformulate_llm = reformulate_model
+    return RunnableLambda(chatbot, afunc=achatbot, name="chatbot")
+
+def build_chatbot_graph(response_model=None, reformulate_model=None, checkpointer=None,
+                        self_containment_detector=None, speculative=False, summary_model=None,
+                        reformulation_stop=REFORMULATION_STOP):
+    """
+    Builds the chatbot graph with two separate nodes: context processor and chatbot.
+    The personality is chosen per run through config["configurable"], so one compiled
+    graph serves every personality. Unless another checkpointer is given, the graph
+    uses the backend's shared one, keyed by thread_id. Follow-up questions are always
+    reformulated unless a self_containment_detector (e.g. default_self_containment_detector)
+    is passed to skip reformulation for questions it finds standalone. With speculative=True, the response model
+    starts on the raw question in parallel with reformulation (see SpeculativeResponder).
+    Both nodes have async implementations, so the graph works with astream/ainvoke too.
+    Models may be given as ModelSpecs, which are drawn from the shared LLM pool. A
+    reformulation spec gets the REFORMULATION_MAX_TOKENS cap, while history summaries
+    use summary_model, by default the same spec without the cap. When reformulate_model
+    is an instance, pass an uncapped summary_model alongside it. Pass reformulation_stop=None
+    for reformulation models that reject stop sequences.
+    """
+    pooled = []
+    try:
+        if isinstance(summary_model, ModelSpec):
+            summary_model = llm_pool.acquire(summary_model)
+            pooled.append(summary_model)
+        elif summary_model is None and isinstance(reformulate_model, ModelSpec):
+            summary_model = llm_pool.acquire(reformulate_model)
+            pooled.append(summary_model)
+        if isinstance(response_model, ModelSpec):
+            response_model = llm_pool.acquire(response_model)
+            pooled.append(response_model)
+        if isinstance(reformulate_model, ModelSpec):
+            # Cap the reformulation output; the node falls back to the raw question if it overruns
+            capped = dataclasses.replace(reformulate_model, kwargs={
+                **reformulation_model_kwargs(reformulate_model.provider), **reformulate_model.kwargs})
+            reformulate_model = llm_pool.acquire(capped)
+            pooled.append(reformulate_model)
     
-    graph_builder = StateGraph(State)
+        graph_builder = StateGraph(State)
     
-    # Add the context processing node
-    context_processor = create_context_processor()
-    graph_builder.add_node("context_processor", context_processor)
+        # Add the context processing node
+        speculator = None
+        if speculative and response_model and reformulate_model:
+            speculator = SpeculativeResponder(response_model, stats=speculation_stats)
+        context_processor = create_context_processor(reformulate_model, self_containment_detector, speculator,
+                                                     summary_model, reformulation_stop)
+        graph_builder.add_node("context_processor", context_processor)
     
-    # Add the chatbot node
-    chatbot_func = create_chatbot(system_message)
-    graph_builder.add_node("chatbot", chatbot_func)
+        # Add the chatbot node
+        chatbot_func = create_chatbot(response_model)
+        graph_builder.add_node("chatbot", chatbot_func)
     
-    # Define the flow: START -> context_processor -> chatbot -> END
-    graph_builder.add_edge(START, "context_processor")
-    graph_builder.add_edge("context_processor", "chatbot")
-    graph_builder.add_edge("chatbot", END)
+        # Define the flow: START -> context_processor -> chatbot -> END
+        graph_builder.add_edge(START, "context_processor")
+        graph_builder.add_edge("context_processor", "chatbot")
+        graph_builder.add_edge("chatbot", END)
     
-    return graph_builder.compile(checkpointer=InMemorySaver())
\ No newline at end of file
+        graph = graph_builder.compile(checkpointer=shared_checkpointer if checkpointer is None else checkpointer)
+    except Exception:
+        # Hand back the instances acquired so far; nothing else holds them yet
+        for model in pooled:
+            llm_pool.release(model)
+        raise
+    return attach_pooled_models(graph, pooled)
+
+def stream_response_tokens(graph, inputs, config, include_status=False):
+    """
+    Streams the answer token by token from the chatbot node. The reformulation step
+    runs first but stays hidden, so the first token arrives after the reformulation
+    plus the response model's time-to-first-token. With ``include_status``, rate-limiter
+    queue events ({"queue_position", "provider"}) are yielded as dicts between tokens.
+    """
+    stream_mode = ["messages", "custom"] if include_status else ["messages"]
+    for mode, event in graph.stream(inputs, config=config, stream_mode=stream_mode):
+        if mode == "custom":
+            yield event
+            continue
+        chunk, metadata = event
+        if metadata.get("langgraph_node") != "chatbot":
+            continue
+        text = chunk.text()
+        if text:
+            yield text
+
+async def astream_response_tokens(graph, inputs, config, include_status=False):
+    """Async counterpart of stream_response_tokens, driven by graph.astream"""
+    stream_mode = ["messages", "custom"] if include_status else ["messages"]
+    async for mode, event in graph.astream(inputs, config=config, stream_mode=stream_mode):
+        if mode == "custom":
+            yield event
+            continue
+        chunk, metadata = event
+        if metadata.get("langgraph_node") != "chatbot":
+            continue
+        text = chunk.text()
+        if text:
+            yield text
@@ -1,26 +1,71 @@
+import asyncio
 from typing import Annotated
 
 from typing_extensions import TypedDict
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import InMemorySaver
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import AIMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 import register_model as rm
+from graph_cache import GraphCache
+from llm_pool import ModelSpec, attach_pooled_models, llm_pool, release_pooled_models
+from bounded_checkpointer import DEFAULT_MAX_BYTES, BoundedMemorySaver
+from sqlite_checkpointer import SQLiteCheckpointer, checkpointer_from_env
+import response_cache
+from reasoning import strip_reasoning
+from token_budget import resolve_token_budget, trim_messages_to_budget
 
 class State(TypedDict):
     # Messages have the type "list". The `add_messages` function
     # in the annotation defines how this state key should be updated
     # (in this case, it appends messages to the list, rather than overwriting them)
     messages: Annotated[list, add_messages]
+    # Reasoning of the latest answer, kept out of the messages sent back to the model
+    reasoning: str
 
-# Initialize the chat model
-# llm = ChatOllama(model="deepseek-r1:14B", temperature=0)
-llm = None  # Placeholder for the LLM, to be set later
+# Compiled graphs keyed by model configuration; personalities share a graph.
+# Evicted graphs hand their pooled model instances back to the LLM pool.
+graph_cache = GraphCache(maxsize=8, ttl=3600, on_evict=release_pooled_models)
 
-def create_chatbot(system_content: str):
-    def chatbot(state: State):
-        messages = state["messages"][:]  # Create a copy of messages
+# Conversation history is shared by every graph, so it outlives graph eviction.
+# In bounded memory by default; set CHATBOT_CHECKPOINT_DB to keep it in SQLite across restarts.
+shared_checkpointer = checkpointer_from_env(BoundedMemorySaver)
+
+def configure_checkpointer(db_path=None, keep_last=20, max_idle_seconds=None,
+                           max_bytes=DEFAULT_MAX_BYTES, spill_dir=None):
+    """
+    Switches the shared checkpointer to SQLite at db_path, or with None to the bounded
+    in-memory store (idle threads spill to spill_dir once max_bytes is exceeded).
+    Cached graphs are dropped so graphs built from now on use the new checkpointer.
+    """
+    global shared_checkpointer
+    if db_path:
+        shared_checkpointer = SQLiteCheckpointer(db_path, keep_last=keep_last, max_idle_seconds=max_idle_seconds)
+    else:
+        shared_checkpointer = BoundedMemorySaver(keep_last=keep_last, max_bytes=max_bytes, spill_dir=spill_dir)
+    graph_cache.clear()
+    return shared_checkpointer
+
+def get_system_prompt(config: RunnableConfig):
+    """
+    Resolves the system prompt for a run from config["configurable"], either given
+    directly as "system_prompt" or looked up from the registry by "personality".
+    """
+    configurable = (config or {}).get("configurable", {})
+    if configurable.get("system_prompt"):
+        return configurable["system_prompt"]
+    personality_name = configurable.get("personality")
+    if personality_name:
+        return rm.get_registry().snapshot().personality_description(personality_name)
+    return None
+
+def create_chatbot(llm):
+    """Creates the chatbot node, with a synchronous and an async implementation"""
+    def prepare(state: State, config: RunnableConfig):
+        # Answers are stored without reasoning; this also cleans threads checkpointed before that
+        messages = [strip_reasoning(m)[0] if isinstance(m, AIMessage) else m for m in state["messages"]]
+        system_content = get_system_prompt(config)
         
         if system_content:
             # Remove any existing system messages
@@ -28,24 +73,64 @@ def create_chatbot(system_content: str):
             # Add the new system message at the beginning
             messages.insert(0, SystemMessage(content=system_content))
         
-        return {"messages": llm.invoke(messages)}
-    return chatbot
+        # Keep the system prompt and the most recent turns within the model's token budget
+        return trim_messages_to_budget(messages, resolve_token_budget(config))
+    
+    def finish(response):
+        # Only the answer goes into the thread history; the reasoning gets its own channel
+        answer, reasoning = strip_reasoning(response)
+        return {"messages": answer, "reasoning": reasoning}
+    
+    def chatbot(state: State, config: RunnableConfig):
+        # Deterministic calls seen before are replayed from the response cache
+        return finish(response_cache.shared_response_cache.invoke(llm, prepare(state, config), config))
+    
+    async def achatbot(state: State, config: RunnableConfig):
+        # The registry lookup and token counting in prepare block, so they run in a worker thread
+        messages = await asyncio.to_thread(prepare, state, config)
+        return finish(await response_cache.shared_response_cache.ainvoke(llm, messages, config))
+    
+    return RunnableLambda(chatbot, afunc=achatbot, name="chatbot")
 
-def build_chatbot_graph(personality_name: str = None):
+def build_chatbot_graph(llm, checkpointer=None):
     """
     Builds the chatbot graph with a single node for the chatbot function.
+    The model is bound to the graph instance, so graphs for different models can run side by side.
+    The personality is chosen per run through config["configurable"], so one compiled
+    graph serves every personality. Unless another checkpointer is given, the graph
+    uses the backend's shared one, keyed by thread_id. The node has an async
+    implementation, so the graph works with astream/ainvoke too. The model may be
+    given as a ModelSpec, which is drawn from the shared LLM pool.
     """
-    
-    system_message = None
-    
-    # Get the actual system message content from the personality
-    if personality_name:
-        registry = rm.ModelRegistry()
-        system_message = registry.get_personality_description(personality_name)
-        
-    graph_builder = StateGraph(State)
-    chatbot_func = create_chatbot(system_message)
-    graph_builder.add_node("chatbot", chatbot_func)
-    graph_builder.add_edge(START, "chatbot")
-    graph_builder.add_edge("chatbot", END)
-    return graph_builder.compile(checkpointer=InMemorySaver())
+    pooled = []
+    if isinstance(llm, ModelSpec):
+        llm = llm_pool.acquire(llm)
+        pooled.append(llm)
+    try:
+        graph_builder = StateGraph(State)
+        chatbot_func = create_chatbot(llm)
+        graph_builder.add_node("chatbot", chatbot_func)
+        graph_builder.add_edge(START, "chatbot")
+        graph_builder.add_edge("chatbot", END)
+        graph = graph_builder.compile(checkpointer=shared_checkpointer if checkpointer is None else checkpointer)
+    except Exception:
+        # Hand back the pooled instance; nothing else holds it yet
+        for model in pooled:
+            llm_pool.release(model)
+        raise
+    return attach_pooled_models(graph, pooled)
+
+async def astream_response_tokens(graph, inputs, config, include_status=False):
+    """
+    Streams the answer token by token with graph.astream. With ``include_status``,
+    rate-limiter queue events ({"queue_position", "provider"}) are yielded as dicts.
+    """
+    stream_mode = ["messages", "custom"] if include_status else ["messages"]
+    async for mode, event in graph.astream(inputs, config=config, stream_mode=stream_mode):
+        if mode == "custom":
+            yield event
+            continue
+        chunk, metadata = event
+        text = chunk.text()
+        if text:
+            yield text
@@ -0,0 +1,132 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+
+from langchain.chat_models import init_chat_model
+
+from register_model import api_key_kwarg
+
+
+def key_fingerprint(api_key):
+    """Short, non-reversible identifier for an API key, safe to use in cache keys and logs"""
+    if not api_key:
+        return None
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """What to draw from the pool: a registered model plus its init_chat_model kwargs"""
+    model: str
+    provider: str
+    temperature: float = None
+    kwargs: dict = field(default_factory=dict, compare=False)
+
+
+def _init_chat_model(model, provider, temperature, **kwargs):
+    return init_chat_model(model, model_provider=provider, temperature=temperature, **kwargs)
+
+
+class LLMPool:
+    """
+    Process-wide pool of chat-model instances.
+
+    Instances are keyed by (provider, model, temperature, API-key fingerprint,
+    remaining kwargs), so every graph using the same configuration shares one
+    instance and with it one HTTP client and its keep-alive connections.
+    ``acquire`` counts references and ``release`` drops them; an instance no
+    graph references stays in the pool for ``idle_ttl`` seconds, so switching
+    back to a recently used model reuses it, and is evicted after that.
+    """
+    def __init__(self, idle_ttl=600, factory=_init_chat_model):
+        self.idle_ttl = idle_ttl
+        self.factory = factory
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        # key -> [instance, references, idle since (None while referenced)]
+        self._entries = {}
+        self._keys_by_instance = {}
+        self._specs_by_instance = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(spec):
+        kwargs = dict(spec.kwargs)
+        fingerprint = key_fingerprint(kwargs.pop(api_key_kwarg(spec.provider) or "api_key", None))
+        return (spec.provider.lower(), spec.model, spec.temperature, fingerprint,
+                tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+
+    def acquire(self, spec):
+        """Return the pooled instance for ``spec``, creating it on first use"""
+        key = self._key(spec)
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                instance = self.factory(spec.model, spec.provider, spec.temperature, **spec.kwargs)
+                entry = self._entries[key] = [instance, 0, None]
+                self._keys_by_instance[id(instance)] = key
+                self._specs_by_instance[id(instance)] = spec
+                self.created += 1
+            else:
+                self.reused += 1
+            entry[1] += 1
+            entry[2] = None
+            return entry[0]
+
+    def release(self, instance):
+        """Drop one reference to a pooled instance; unknown instances are ignored"""
+        with self._lock:
+            entry = self._entries.get(self._keys_by_instance.get(id(instance)))
+            if entry is None or entry[1] == 0:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                entry[2] = time.monotonic()
+
+    def spec_of(self, instance):
+        """The ModelSpec a pooled instance was created from, or None for instances not in the pool"""
+        with self._lock:
+            return self._specs_by_instance.get(id(instance))
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for key, (instance, references, idle_since) in list(self._entries.items()):
+            if references == 0 and idle_since is not None and idle_since < cutoff:
+                del self._entries[key]
+                self._keys_by_instance.pop(id(instance), None)
+                self._specs_by_instance.pop(id(instance), None)
+                self.evicted += 1
+
+    def evict_idle(self):
+        """Drop every unreferenced instance idle for longer than ``idle_ttl``"""
+        with self._lock:
+            self._evict_idle()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "instances": len(self._entries),
+                "in_use": sum(1 for entry in self._entries.values() if entry[1] > 0),
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+
+# Pool shared by every graph in the process
+llm_pool = LLMPool()
+
+
+def attach_pooled_models(graph, models):
+    """Record the pooled instances a graph holds, for release when the graph is evicted"""
+    graph.pooled_models = list(models)
+    return graph
+
+
+def release_pooled_models(key, graph):
+    """GraphCache on_evict hook: release the graph's pooled model instances"""
+    for model in getattr(graph, "pooled_models", ()):
+        llm_pool.release(model)
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe, size-bounded least-recently-used cache.
+
+    With ``ttl`` set, entries that have not been used for ``ttl`` seconds are
+    treated as missing and dropped. ``on_evict(key, value)`` is called for every
+    entry that leaves the cache other than by being replaced with itself.
+    """
+    def __init__(self, maxsize=128, ttl=None, on_evict=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1.")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> [value, last_used]
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        now = time.monotonic()
+        if self.ttl is not None and now - entry[1] > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            self._dropped(key, entry[0])
+            return False, None
+        entry[1] = now
+        self._entries.move_to_end(key)
+        return True, entry[0]
+
+    def get(self, key, default=None):
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def _dropped(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def put(self, key, value):
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = [value, time.monotonic()]
+            self._entries.move_to_end(key)
+            if previous is not None and previous[0] is not value:
+                self._dropped(key, previous[0])
+            while len(self._entries) > self.maxsize:
+                evicted_key, (evicted, _) = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._dropped(evicted_key, evicted)
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for ``key``, building it with ``factory()`` on a miss"""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            # Build under the lock so concurrent misses don't build the same value twice
+            value = factory()
+            self.put(key, value)
+            return value
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._dropped(key, entry[0])
+
+    def expire(self):
+        """Drop every entry whose TTL has run out"""
+        if self.ttl is None:
+            return
+        with self._lock:
+            cutoff = time.monotonic() - self.ttl
+            for key in [k for k, (_, last_used) in self._entries.items() if last_used < cutoff]:
+                value = self._entries.pop(key)[0]
+                self.expirations += 1
+                self._dropped(key, value)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+            for key, (value, _) in entries:
+                self._dropped(key, value)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key)[0]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
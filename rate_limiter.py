@@ -0,0 +1,429 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import replace
+
+import register_model as rm
+from api_key_pool import shared_key_pools
+from llm_pool import llm_pool
+from token_budget import token_counter
+
+# Retries of a call the provider rejected with HTTP 429
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# How often a limiter re-reads its limits from the registry
+REFRESH_SECONDS = 5.0
+# Upper bound on a single wait, so limit changes and async waiters are picked up
+_MAX_WAIT_SECONDS = 1.0
+_ASYNC_POLL_SECONDS = 0.05
+
+
+class TokenBucket:
+    """
+    Refills at ``per_minute`` units a minute up to ``per_minute``; None is unlimited.
+    The level may go negative when a call uses more than was reserved for it,
+    which delays later calls until the overdraft is paid back.
+    """
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self.level = float(per_minute or 0)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def delay(self, amount):
+        """Seconds until ``amount`` units are available (capped at the bucket size)"""
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        shortfall = min(amount, self.per_minute) - self.level
+        return max(0.0, shortfall * 60 / self.per_minute)
+
+    def take(self, amount):
+        if self.per_minute:
+            self._refill()
+            self.level -= amount
+
+
+class ProviderLimiter:
+    """
+    Admission control for one provider: at most ``max_concurrency`` calls in
+    flight, and token buckets for requests and tokens per minute. Callers are
+    admitted strictly in arrival order, so a large request at the head of the
+    queue isn't starved by smaller ones behind it. Waiters can be told their
+    queue position through ``on_wait(position)``, which is always called
+    outside the limiter's lock.
+    """
+    def __init__(self, name, max_concurrency=None, requests_per_minute=None, tokens_per_minute=None):
+        self.name = name
+        self.in_flight = 0
+        self.admitted = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self.max_concurrency = None
+        self._requests = TokenBucket()
+        self._tokens = TokenBucket()
+        self.configure(max_concurrency, requests_per_minute, tokens_per_minute)
+
+    def configure(self, max_concurrency=None, requests_per_minute=None, tokens_per_minute=None):
+        with self._cond:
+            self.max_concurrency = max_concurrency or None
+            if self._requests.per_minute != (requests_per_minute or None):
+                self._requests = TokenBucket(requests_per_minute or None)
+            if self._tokens.per_minute != (tokens_per_minute or None):
+                self._tokens = TokenBucket(tokens_per_minute or None)
+            self._cond.notify_all()
+
+    def _try_admit(self, ticket, tokens):
+        """Admit ``ticket`` if its turn has come; otherwise return how long to wait"""
+        if self._queue[0] is not ticket:
+            return _MAX_WAIT_SECONDS
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return _MAX_WAIT_SECONDS
+        delay = max(self._requests.delay(1), self._tokens.delay(tokens))
+        if delay > 0:
+            return min(delay, _MAX_WAIT_SECONDS)
+        self._queue.popleft()
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self.in_flight += 1
+        self.admitted += 1
+        # The next ticket is now at the head
+        self._cond.notify_all()
+        return None
+
+    def _leave(self, ticket):
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _waited(self, started):
+        with self._cond:
+            self.waited += 1
+            self.wait_seconds += time.monotonic() - started
+
+    def acquire(self, tokens=1, on_wait=None):
+        """Block until the call is admitted; pair with ``release``"""
+        ticket = object()
+        started = time.monotonic()
+        reported = None
+        queued = False
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket, tokens)
+                    if delay is None:
+                        break
+                    queued = True
+                    position = self._queue.index(ticket) + 1
+                    if on_wait is None or position == reported:
+                        self._cond.wait(delay)
+                        continue
+                on_wait(position)
+                reported = position
+        except BaseException:
+            self._leave(ticket)
+            raise
+        if queued:
+            self._waited(started)
+
+    async def aacquire(self, tokens=1, on_wait=None):
+        """Async counterpart of ``acquire``; waits without blocking the event loop"""
+        ticket = object()
+        started = time.monotonic()
+        reported = None
+        queued = False
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket, tokens)
+                    if delay is None:
+                        break
+                    queued = True
+                    position = self._queue.index(ticket) + 1
+                if on_wait is not None and position != reported:
+                    on_wait(position)
+                    reported = position
+                await asyncio.sleep(min(delay, _ASYNC_POLL_SECONDS))
+        except BaseException:
+            self._leave(ticket)
+            raise
+        if queued:
+            self._waited(started)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tokens=1, on_wait=None):
+        self.acquire(tokens, on_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens=1, on_wait=None):
+        await self.aacquire(tokens, on_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def charge(self, tokens):
+        """Count tokens used beyond the reservation, e.g. the generated output"""
+        with self._cond:
+            self._tokens.take(tokens)
+
+    def record_rate_limited(self, retrying):
+        with self._cond:
+            self.rate_limited += 1
+            if retrying:
+                self.retries += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "avg_wait_seconds": self.wait_seconds / self.waited if self.waited else 0.0,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "max_concurrency": self.max_concurrency,
+                "requests_per_minute": self._requests.per_minute,
+                "tokens_per_minute": self._tokens.per_minute,
+            }
+
+
+def _registry_limits(provider):
+    try:
+        return rm.get_registry().get_rate_limits(provider)
+    except ValueError:
+        return {}
+
+
+class RateLimiters:
+    """
+    One ProviderLimiter per provider, shared by all of that provider's models.
+    Limits come from the registry's ``rate_limits`` table and are re-read every
+    ``refresh_seconds``, so changes apply without a restart.
+    """
+    def __init__(self, limits=_registry_limits, refresh_seconds=REFRESH_SECONDS):
+        self._limits = limits
+        self.refresh_seconds = refresh_seconds
+        # provider -> (limiter, refreshed at)
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider):
+        now = time.monotonic()
+        with self._lock:
+            limiter, refreshed = self._limiters.get(provider, (None, None))
+            if limiter is not None and now - refreshed < self.refresh_seconds:
+                return limiter
+            if limiter is not None:
+                # Marked fresh before reading, so concurrent callers don't all hit the registry
+                self._limiters[provider] = (limiter, now)
+        limits = self._limits(provider) or {}
+        with self._lock:
+            limiter, _ = self._limiters.get(provider, (None, None))
+            if limiter is None:
+                limiter = ProviderLimiter(provider, **limits)
+            else:
+                limiter.configure(**limits)
+            self._limiters[provider] = (limiter, now)
+            return limiter
+
+    def stats(self):
+        with self._lock:
+            limiters = [limiter for limiter, _ in self._limiters.values() if limiter is not None]
+        return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+# Limiters shared by every graph in the process
+shared_limiters = RateLimiters()
+
+
+def provider_of(llm):
+    """Registry provider name of a pooled model, else its class name"""
+    spec = llm_pool.spec_of(llm)
+    return spec.provider if spec is not None else type(llm).__name__
+
+
+def _status_code(error):
+    """HTTP status of a provider SDK error, read from its status-code attributes only"""
+    for status in (getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None),
+                   getattr(error, "code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_rate_limit_error(error):
+    """Whether a provider SDK error is an HTTP 429"""
+    return _status_code(error) == 429
+
+
+def is_auth_error(error):
+    """Whether a provider SDK error is an HTTP 401, i.e. the API key was rejected"""
+    return _status_code(error) == 401
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error=None):
+    """Full-jitter exponential backoff, honouring a Retry-After header when the provider sends one"""
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after is not None:
+        return retry_after + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _queue_feedback(provider):
+    """on_wait callback emitting the queue position as a custom stream event, if inside a graph run"""
+    try:
+        from langgraph.config import get_stream_writer
+        writer = get_stream_writer()
+    except Exception:
+        return None
+    return lambda position: writer({"queue_position": position, "provider": provider})
+
+
+def _key_pool(llm, key_pools):
+    """The key pool for ``llm``'s provider, or None when ``llm`` isn't a pooled keyed instance"""
+    spec = llm_pool.spec_of(llm)
+    if spec is None or not spec.kwargs.get(rm.api_key_kwarg(spec.provider)):
+        return None
+    return key_pools.get(spec.provider)
+
+
+@contextmanager
+def _dispatched(llm, pool):
+    """
+    Yield the instance to call: ``llm`` itself, or its pooled twin holding the key
+    picked from ``pool``. Rejected keys are reported back to the pool.
+    """
+    spec = llm_pool.spec_of(llm)
+    picked = pool.checkout() if pool is not None else None
+    if picked is None:
+        yield llm
+        return
+    key_id, api_key = picked
+    instance = llm
+    kwarg = rm.api_key_kwarg(spec.provider)
+    if api_key != spec.kwargs[kwarg]:
+        instance = llm_pool.acquire(replace(spec, kwargs={**spec.kwargs, kwarg: api_key}))
+    try:
+        yield instance
+    except Exception as e:
+        pool.checkin(key_id, rate_limited=is_rate_limit_error(e), unauthorized=is_auth_error(e),
+                     retry_after=_retry_after(e))
+        raise
+    else:
+        pool.checkin(key_id)
+    finally:
+        if instance is not llm:
+            llm_pool.release(instance)
+
+
+def _estimate_tokens(messages):
+    return sum(token_counter.count_message(m) for m in messages if hasattr(m, "content"))
+
+
+def _output_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("output_tokens") or 0
+
+
+def _retry_plan(limiter, pool, attempt, auth_retried, error):
+    """
+    Returns (delay before the next attempt or None to give up, auth_retried). The
+    pool has already disabled a rejected key, so a retry lands on another one.
+    """
+    rate_limited = is_rate_limit_error(error)
+    retry_auth = (not auth_retried and is_auth_error(error) and pool is not None and pool.available() > 0)
+    retrying = attempt < MAX_RETRIES and (rate_limited or retry_auth)
+    if rate_limited:
+        limiter.record_rate_limited(retrying)
+    if not retrying:
+        return None, auth_retried
+    return (backoff_delay(attempt, error) if rate_limited else 0.0), auth_retried or retry_auth
+
+
+def invoke(llm, messages, config=None, limiters=None, key_pools=None, **kwargs):
+    """
+    ``llm.invoke`` behind the provider's limiter, spread over the provider's API keys,
+    retrying 429s with jittered backoff. A retry picks a key again, so it usually
+    lands on a key that isn't rate limited. A key rejected with 401 is retried once
+    on another of the provider's keys, if one is available.
+    """
+    limiter = (limiters or shared_limiters).get(provider_of(llm))
+    tokens = _estimate_tokens(messages)
+    on_wait = _queue_feedback(limiter.name)
+    auth_retried = False
+    for attempt in range(MAX_RETRIES + 1):
+        with limiter.slot(tokens, on_wait):
+            pool = _key_pool(llm, key_pools or shared_key_pools)
+            try:
+                with _dispatched(llm, pool) as instance:
+                    response = instance.invoke(messages, config=config, **kwargs)
+            except Exception as e:
+                delay, auth_retried = _retry_plan(limiter, pool, attempt, auth_retried, e)
+                if delay is None:
+                    raise
+            else:
+                limiter.charge(_output_tokens(response))
+                return response
+        # Back off outside the slot so other callers keep the provider busy
+        time.sleep(delay)
+
+
+async def ainvoke(llm, messages, config=None, limiters=None, key_pools=None, **kwargs):
+    """Async counterpart of ``invoke`` using ``llm.ainvoke``"""
+    # Limiter and key-pool refreshes read the registry and token counting is CPU bound,
+    # so they run in a worker thread rather than on the event loop
+    limiter = await asyncio.to_thread((limiters or shared_limiters).get, provider_of(llm))
+    tokens = await asyncio.to_thread(_estimate_tokens, messages)
+    on_wait = _queue_feedback(limiter.name)
+    auth_retried = False
+    for attempt in range(MAX_RETRIES + 1):
+        async with limiter.aslot(tokens, on_wait):
+            pool = await asyncio.to_thread(_key_pool, llm, key_pools or shared_key_pools)
+            try:
+                with _dispatched(llm, pool) as instance:
+                    response = await instance.ainvoke(messages, config=config, **kwargs)
+            except Exception as e:
+                delay, auth_retried = _retry_plan(limiter, pool, attempt, auth_retried, e)
+                if delay is None:
+                    raise
+            else:
+                limiter.charge(_output_tokens(response))
+                return response
+        await asyncio.sleep(delay)
@@ -0,0 +1,47 @@
+import re
+
+# Reasoning models open their answer with a block like <think>...</think>
+REASONING_TAGS = ("think", "reasoning", "thought", "analysis", "internal")
+_REASONING_RE = re.compile(rf'^\s*<({"|".join(REASONING_TAGS)})>(.*?)</\1>(.*)', flags=re.DOTALL)
+# A block that was never closed, e.g. because the output hit its token limit
+_UNCLOSED_REASONING_RE = re.compile(rf'^\s*<({"|".join(REASONING_TAGS)})>(.*)', flags=re.DOTALL)
+# Stop reasons providers report when the output hit its token limit
+_TRUNCATED_STOP_REASONS = {"length", "max_tokens"}
+
+
+def split_reasoning(text):
+    """
+    Split a leading reasoning block off a response; returns (reasoning, answer).
+    Reasoning is "" when there is none. An unclosed block is all reasoning.
+    """
+    if not isinstance(text, str):
+        return "", text
+    match = _REASONING_RE.match(text)
+    if match:
+        return match.group(2).strip(), match.group(3).strip()
+    match = _UNCLOSED_REASONING_RE.match(text)
+    if match:
+        return match.group(2).strip(), ""
+    return "", text
+
+
+def strip_reasoning(message):
+    """
+    Return (message without reasoning, reasoning). Handles reasoning inlined as a tag
+    block and reasoning returned separately in additional_kwargs["reasoning_content"].
+    The message keeps its id.
+    """
+    reasoning, answer = split_reasoning(message.content)
+    additional_kwargs = dict(message.additional_kwargs or {})
+    side_reasoning = additional_kwargs.pop("reasoning_content", None)
+    if not reasoning and not side_reasoning:
+        return message, ""
+    reasoning = "\n\n".join(part for part in (side_reasoning, reasoning) if part)
+    return message.model_copy(update={"content": answer, "additional_kwargs": additional_kwargs}), reasoning
+
+
+def was_truncated(message):
+    """Whether the provider reports that a response stopped at its token limit"""
+    metadata = getattr(message, "response_metadata", None) or {}
+    return any(metadata.get(field) in _TRUNCATED_STOP_REASONS
+               for field in ("finish_reason", "stop_reason", "done_reason"))
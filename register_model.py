@@ -1,89 +1,693 @@
 import sqlite3
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+import copy
+import csv
+import io
+import json
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import wraps
+from types import MappingProxyType
+
+DEFAULT_DB_PATH = 'model_registry.db'
+DEFAULT_KEY_PATH = 'secret.key'
+
+# init_chat_model keyword taking a provider's API key; unlisted providers take "api_key".
+# None marks chat models that only read the key from the configured environment variable.
+API_KEY_KWARGS = {
+    "google_genai": "google_api_key",
+    "huggingface": "huggingfacehub_api_token",
+    "google_vertexai": None,
+    "bedrock": None,
+    "bedrock_converse": None,
+}
+
+# Admission limits of a provider; NULL means unlimited
+_RATE_LIMIT_COLUMNS = ("max_concurrency", "requests_per_minute", "tokens_per_minute")
+
+# Columns of each bulk import/export section, and the fields that identify a row
+_BULK_SECTIONS = {
+    "models": (("provider", "model_name", "display_name", "token_budget"), ("provider", "model_name")),
+    "personalities": (("personality_name", "personality_description"), ("personality_name",)),
+    "configs": (("provider", "api_env_name", "api"), ("provider",)),
+    "rate_limits": (("provider",) + _RATE_LIMIT_COLUMNS, ("provider",)),
+    "api_keys": (("provider", "label", "api"), ("provider", "api")),
+}
+# Columns that may be left empty in an import file
+_OPTIONAL_BULK_COLUMNS = {"api", "token_budget", "label", *_RATE_LIMIT_COLUMNS}
+# Columns holding optional integers
+_INTEGER_BULK_COLUMNS = {"token_budget", *_RATE_LIMIT_COLUMNS}
+# Record type used for each section in the single-file CSV format
+_CSV_RECORD_TYPES = {"model": "models", "personality": "personalities", "config": "configs",
+                     "rate_limit": "rate_limits", "api_key": "api_keys"}
+
+
+def api_key_kwarg(provider):
+    """The init_chat_model keyword for ``provider``'s API key, or None if it's read from the environment"""
+    return API_KEY_KWARGS.get(provider.lower(), "api_key")
+
+
+# Process-wide state shared by every ModelRegistry that points at the same db file
+_pools = {}
+_caches = {}
+_vaults = {}
+_initialized_paths = set()
+_registries = {}
+_state_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections for one database file"""
+    def __init__(self, db_path, max_size=8, timeout=30.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self):
+        # Connections are shared across Streamlit script threads, so allow that explicitly.
+        # Each connection keeps its own compiled statement cache, which is what makes
+        # the repeated registry queries cheap once the connection is reused.
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool and return it when done"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ValueError(f"Timed out waiting for a database connection to '{self.db_path}'.")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                # Never hand a connection with an open transaction back to the pool
+                conn.rollback()
+                raise
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class RegistryCache:
+    """In-memory read-through cache for registry lookups.
+
+    Entries are dropped whenever the registry is written through this process, or
+    when the change counter maintained by database triggers moves, which is how
+    writes from other processes are noticed. The counter is polled at most once
+    per ``check_interval`` seconds.
+    """
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._generation = 0
+        self._version = None
+        self._checked_at = 0.0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """Call ``callback()`` whenever the cached entries are dropped"""
+        self._listeners.append(callback)
+
+    def needs_version_check(self):
+        return time.monotonic() - self._checked_at >= self.check_interval
+
+    def sync_version(self, version):
+        """Record the database change counter, dropping entries if it moved"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._version is not None and version != self._version:
+                self._clear()
+            self._version = version
+
+    def lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return True, self._entries[key], self._generation
+            self.misses += 1
+            return False, None, self._generation
+
+    def store(self, key, value, generation):
+        with self._lock:
+            # Skip values loaded while a write was invalidating the cache
+            if generation == self._generation:
+                self._entries[key] = value
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            # Force the next lookup to re-read the change counter
+            self._checked_at = 0.0
+            self._version = None
+
+    def _clear(self):
+        self._entries.clear()
+        self._generation += 1
+        self.invalidations += 1
+        for callback in self._listeners:
+            callback()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+class KeyVault:
+    """In-memory holder of the Fernet cipher and decrypted provider API keys.
+
+    The key file is read once. It may hold several keys, one per line with the
+    newest first; they are combined into a MultiFernet so values encrypted
+    with older keys keep decrypting after a rotation.
+    """
+    def __init__(self, key_path=DEFAULT_KEY_PATH):
+        self.key_path = key_path
+        self._keys = None
+        self._cipher = None
+        self._api_keys = {}
+        self._key_pools = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.key_path):
+            with open(self.key_path, 'wb') as key_file:
+                key_file.write(Fernet.generate_key())
+        with open(self.key_path, 'rb') as key_file:
+            keys = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+        if not keys:
+            raise ValueError("Encryption key is not available.")
+        self._keys = keys
+        self._cipher = MultiFernet([Fernet(key) for key in keys])
+
+    @property
+    def primary_key(self):
+        with self._lock:
+            if self._keys is None:
+                self._load()
+            return self._keys[0]
+
+    @property
+    def cipher(self):
+        with self._lock:
+            if self._cipher is None:
+                self._load()
+            return self._cipher
+
+    def encrypt(self, plaintext):
+        return self.cipher.encrypt(plaintext.encode('utf-8'))
+
+    def decrypt(self, token):
+        try:
+            return self.cipher.decrypt(token).decode('utf-8')
+        except InvalidToken:
+            # Another process may have rotated the key file since it was read
+            self.reload()
+            return self.cipher.decrypt(token).decode('utf-8')
+
+    def get_api_key(self, provider, loader):
+        """Return the decrypted key for a provider, calling ``loader`` on a miss"""
+        with self._lock:
+            if provider in self._api_keys:
+                return self._api_keys[provider]
+        api_key = loader()
+        with self._lock:
+            self._api_keys[provider] = api_key
+        return api_key
+
+    def get_api_key_pool(self, provider, loader):
+        """Return every decrypted key of a provider, calling ``loader`` on a miss"""
+        with self._lock:
+            if provider in self._key_pools:
+                return self._key_pools[provider]
+        pool = loader()
+        with self._lock:
+            self._key_pools[provider] = pool
+        return pool
+
+    def invalidate(self, provider=None):
+        """Forget decrypted keys for one provider, or all of them"""
+        with self._lock:
+            if provider is None:
+                self._api_keys.clear()
+                self._key_pools.clear()
+            else:
+                self._api_keys.pop(provider, None)
+                self._key_pools.pop(provider, None)
+
+    def rotate(self):
+        """Prepend a freshly generated key and return the cipher that includes it"""
+        with self._lock:
+            # Re-read the file so keys another process added aren't dropped
+            self._load()
+            keys = [Fernet.generate_key()] + self._keys
+            with open(self.key_path, 'wb') as key_file:
+                key_file.write(b'\n'.join(keys))
+            self._keys = keys
+            self._cipher = MultiFernet([Fernet(key) for key in keys])
+            self._api_keys.clear()
+            self._key_pools.clear()
+            return self._cipher
+
+    def reload(self):
+        """Re-read the key file on next use, e.g. after it was rotated elsewhere"""
+        with self._lock:
+            self._keys = None
+            self._cipher = None
+            self._api_keys.clear()
+            self._key_pools.clear()
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    """Immutable, indexed view of the registry taken in a single transaction"""
+    version: int
+    providers: tuple
+    models_by_provider: MappingProxyType
+    display_names: MappingProxyType
+    personalities: MappingProxyType
+    token_budgets: MappingProxyType
+
+    @property
+    def personality_names(self):
+        return tuple(self.personalities)
+
+    def models_for(self, provider):
+        """(model_name, display_name) pairs registered for a provider"""
+        return self.models_by_provider.get(provider, ())
+
+    def display_name(self, provider, model):
+        return self.display_names.get((provider, model))
+
+    def personality_description(self, personality_name):
+        return self.personalities.get(personality_name)
+
+    def token_budget(self, provider, model):
+        """Configured prompt token budget for a model, or None for the backend default"""
+        return self.token_budgets.get((provider, model))
+
+
+def _cached_lookup(method):
+    """Serve a read-only registry method from the registry cache"""
+    @wraps(method)
+    def wrapper(self, *args):
+        cache = self._cache
+        if cache.needs_version_check():
+            cache.sync_version(self._read_change_version())
+        found, value, generation = cache.lookup((method.__name__, args))
+        if not found:
+            value = method(self, *args)
+            cache.store((method.__name__, args), value, generation)
+        # Hand out copies so callers can't mutate cached rows or dicts
+        return copy.copy(value) if isinstance(value, (list, dict, set)) else value
+    return wrapper
+
+
+def _invalidates_cache(method):
+    """Drop cached lookups after a registry write, whether or not it succeeded"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._cache.invalidate()
+    return wrapper
+
+
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS config (
+            provider TEXT NOT NULL PRIMARY KEY,
+            api TEXT NOT NULL,
+            api_env_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS models (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            display_name TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS personality (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            personality_name TEXT NOT NULL UNIQUE,
+            personality_description TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _add_change_counter(conn):
+    # Change counter bumped by triggers on every registry write, so
+    # caches in any process can tell when their entries went stale
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS registry_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO registry_changes (id, version) VALUES (1, 0)')
+    for table in ('config', 'models', 'personality'):
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{action.lower()}_changes
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE registry_changes SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+def _index_models(conn):
+    # Older databases could hold the same model several times; keep the latest registration
+    conn.execute('''
+        DELETE FROM models WHERE id NOT IN (
+            SELECT MAX(id) FROM models GROUP BY provider, model_name
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_models_provider_model ON models (provider, model_name)')
+    # Covering index so provider and display-name lookups never touch the table
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_models_provider_model_display
+        ON models (provider, model_name, display_name)
+    ''')
+
+
+def _add_model_token_budget(conn):
+    # Prompt token budget per model; NULL means the backend default applies
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(models)')]
+    if 'token_budget' not in columns:
+        conn.execute('ALTER TABLE models ADD COLUMN token_budget INTEGER')
+
+
+def _add_provider_rate_limits(conn):
+    # Admission limits per provider; NULL means unlimited. Kept apart from config,
+    # so limiting a provider never needs a keyless config row
+    columns = ", ".join(f"{column} INTEGER" for column in _RATE_LIMIT_COLUMNS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS rate_limits (provider TEXT NOT NULL PRIMARY KEY, {columns})')
+    for action in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS rate_limits_{action.lower()}_changes
+            AFTER {action} ON rate_limits
+            BEGIN
+                UPDATE registry_changes SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def _add_api_keys(conn):
+    # Extra keys per provider, dispatched alongside the key in the config table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            api TEXT NOT NULL,
+            label TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_api_keys_provider ON api_keys (provider, id)')
+    for action in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS api_keys_{action.lower()}_changes
+            AFTER {action} ON api_keys
+            BEGIN
+                UPDATE registry_changes SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+# Ordered schema migrations: (version, description, function applying it)
+_MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "registry change counter", _add_change_counter),
+    (3, "unique and covering indexes on models", _index_models),
+    (4, "per-model token budget", _add_model_token_budget),
+    (5, "per-provider rate limits", _add_provider_rate_limits),
+    (6, "api key pools", _add_api_keys),
+]
+
+
+def _migrate(conn):
+    """Apply pending schema migrations in a single write transaction"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+        for version, description, apply in _MIGRATIONS:
+            if version > current:
+                apply(conn)
+                conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (version, description))
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _is_fernet_token(value):
+    # Fernet tokens are urlsafe base64 of a payload starting with the 0x80 version byte
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return isinstance(value, bytes) and value.startswith(b'gAAAAA')
+
+
+def _reencrypt(cipher, api, provider):
+    """Re-encrypt a stored key with the newest key of ``cipher``"""
+    if not api:
+        return api
+    if not _is_fernet_token(api):
+        # Plain-text keys from older databases get encrypted now
+        return cipher.encrypt(api.encode('utf-8') if isinstance(api, str) else api)
+    try:
+        return cipher.rotate(api)
+    except InvalidToken as e:
+        raise ValueError(f"The API key for provider '{provider}' can't be decrypted with the current "
+                         f"key file, so it can't be re-encrypted.") from e
+
+
+def _parse_bulk_records(data, fmt):
+    """Turn JSON/CSV import data into {section: [row dict, ...]}"""
+    if fmt == 'json':
+        payload = json.loads(data) if isinstance(data, (str, bytes)) else data
+        if not isinstance(payload, dict):
+            raise ValueError("Registry JSON must be an object with models, personalities, configs, "
+                             "rate_limits and api_keys lists.")
+        records = {section: list(payload.get(section) or []) for section in _BULK_SECTIONS}
+    elif fmt == 'csv':
+        text = data.decode('utf-8') if isinstance(data, bytes) else data
+        records = {section: [] for section in _BULK_SECTIONS}
+        for line_no, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+            section = _CSV_RECORD_TYPES.get((row.get('record_type') or '').strip().lower())
+            if section is None:
+                raise ValueError(f"Line {line_no}: record_type must be one of {', '.join(_CSV_RECORD_TYPES)}.")
+            records[section].append(row)
+    else:
+        raise ValueError(f"Unsupported registry format '{fmt}'. Use 'json' or 'csv'.")
+
+    parsed = {}
+    for section, (columns, key_columns) in _BULK_SECTIONS.items():
+        rows = {}
+        for index, record in enumerate(records[section]):
+            row = {column: str(record.get(column) if record.get(column) is not None else '').strip()
+                   for column in columns}
+            required = [c for c in columns if c not in _OPTIONAL_BULK_COLUMNS]
+            missing = [c for c in required if not row[c]]
+            if missing:
+                raise ValueError(f"{section}[{index}] is missing {', '.join(missing)}.")
+            for column in _INTEGER_BULK_COLUMNS.intersection(row):
+                try:
+                    row[column] = int(row[column]) if row[column] else None
+                except ValueError as e:
+                    raise ValueError(f"{section}[{index}] has a non-integer {column}.") from e
+            # Later rows win when the same entry appears twice in one file
+            rows[tuple(row[c] for c in key_columns)] = row
+        parsed[section] = rows
+    return parsed
+
+
+def _get_pool(db_path):
+    with _state_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+def get_registry(db_path=DEFAULT_DB_PATH):
+    """Return the process-wide ModelRegistry for a database file"""
+    key = os.path.abspath(db_path)
+    with _state_lock:
+        registry = _registries.get(key)
+    if registry is None:
+        registry = ModelRegistry(db_path)
+        with _state_lock:
+            registry = _registries.setdefault(key, registry)
+    return registry
+
 
 class ModelRegistry:
-    def __init__(self, db_path='model_registry.db'):
+    def __init__(self, db_path=DEFAULT_DB_PATH):
         self.db_path = db_path
-        # Create tables and close connection
+        # Connections are pooled per db file and shared by every instance
+        self._pool = _get_pool(os.path.abspath(db_path))
+        with _state_lock:
+            self._cache = _caches.get(os.path.abspath(db_path))
+            if self._cache is None:
+                self._cache = _caches[os.path.abspath(db_path)] = RegistryCache()
+                self._vault = _vaults[os.path.abspath(db_path)] = KeyVault()
+                # Decrypted keys go stale together with the rest of the registry
+                self._cache.add_listener(self._vault.invalidate)
+            else:
+                self._vault = _vaults[os.path.abspath(db_path)]
+        # Create tables only the first time this db file is seen in the process
         self._initialize_database()
         
-    def _get_connection(self):
-        """Get a new database connection"""
-        return sqlite3.connect(self.db_path)
+    def _connection(self):
+        """Borrow a pooled database connection"""
+        return self._pool.connection()
             
     def _initialize_database(self):
-        """Initialize database tables and close connection"""
-        conn = self._get_connection()
+        """Bring the database schema up to date once per database file"""
+        key = os.path.abspath(self.db_path)
+        if key in _initialized_paths:
+            return
+        with _state_lock:
+            if key in _initialized_paths:
+                return
+            try:
+                with self._connection() as conn:
+                    _migrate(conn)
+            except sqlite3.Error as e:
+                raise ValueError(f"Error initializing database: {e}") from e
+            _initialized_paths.add(key)
+
+    def _read_change_version(self):
+        """Read the registry change counter maintained by the write triggers"""
         try:
-            with conn:
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS config (
-                        provider TEXT NOT NULL PRIMARY KEY,
-                        api TEXT NOT NULL,
-                        api_env_name TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )              
-                ''')
-                
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS models (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        provider TEXT NOT NULL,
-                        display_name TEXT NOT NULL,
-                        model_name TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS personality (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        personality_name TEXT NOT NULL UNIQUE,
-                        personality_description TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
+            with self._connection() as conn:
+                return conn.execute('SELECT version FROM registry_changes WHERE id = 1').fetchone()[0]
         except sqlite3.Error as e:
-            raise ValueError(f"Error initializing database: {e}") from e
-        finally:
-            conn.close()
+            raise ValueError(f"Error reading registry change counter: {e}") from e
+
+    @_cached_lookup
+    def snapshot(self):
+        """Load models and personalities in one read transaction for page rendering"""
+        try:
+            with self._connection() as conn:
+                conn.execute('BEGIN')
+                try:
+                    version = conn.execute('SELECT version FROM registry_changes WHERE id = 1').fetchone()[0]
+                    model_rows = conn.execute(
+                        'SELECT provider, model_name, display_name, token_budget FROM models ORDER BY id').fetchall()
+                    personality_rows = conn.execute(
+                        'SELECT personality_name, personality_description FROM personality ORDER BY id').fetchall()
+                finally:
+                    conn.commit()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error loading registry snapshot: {e}") from e
+
+        models_by_provider = {}
+        display_names = {}
+        token_budgets = {}
+        for provider, model_name, display_name, token_budget in model_rows:
+            models_by_provider.setdefault(provider, []).append((model_name, display_name))
+            display_names.setdefault((provider, model_name), display_name)
+            if token_budget:
+                token_budgets.setdefault((provider, model_name), token_budget)
+        return RegistrySnapshot(
+            version=version,
+            providers=tuple(models_by_provider),
+            models_by_provider=MappingProxyType({p: tuple(m) for p, m in models_by_provider.items()}),
+            display_names=MappingProxyType(display_names),
+            personalities=MappingProxyType(dict(personality_rows)),
+            token_budgets=MappingProxyType(token_budgets),
+        )
 
-    def register_model(self, display_name, name, provider):
-        conn = self._get_connection()
+    def schema_version(self):
+        """Version of the most recent migration applied to the database"""
+        with self._connection() as conn:
+            return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+
+    def cache_stats(self):
+        """Hit/miss counters of the registry lookup cache"""
+        return self._cache.stats()
+
+    def clear_cache(self):
+        """Drop every cached registry lookup"""
+        self._cache.invalidate()
+
+    @_invalidates_cache
+    def register_model(self, display_name, name, provider, token_budget=None):
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 conn.execute('''
-                    INSERT INTO models (provider, display_name, model_name)
-                    VALUES (?, ?, ?)
-                ''', (provider, display_name, name))
+                    INSERT INTO models (provider, display_name, model_name, token_budget)
+                    VALUES (?, ?, ?, ?)
+                ''', (provider, display_name, name, token_budget or None))
                 conn.commit()
         except sqlite3.IntegrityError as e:
             raise ValueError(f"Model with name '{name}' already exists for provider '{provider}'.") from e
-        finally:
-            conn.close()
 
     
+    @_invalidates_cache
     def register_config(self, provider, api, api_env_name):
-        conn = self._get_connection()
         try:
             # Encrypt the API key before storing
             encrypted_api = self.encrypt_api_key(api)
-            conn.execute('''
-                INSERT INTO config (provider, api, api_env_name)
-                VALUES (?, ?, ?)
-            ''', (provider, encrypted_api, api_env_name))
-            conn.commit()
+            with self._connection() as conn:
+                conn.execute('''
+                    INSERT INTO config (provider, api, api_env_name)
+                    VALUES (?, ?, ?)
+                ''', (provider, encrypted_api, api_env_name))
+                conn.commit()
         except sqlite3.IntegrityError as e:
             raise ValueError(f"Configuration for provider '{provider}' already exists.") from e
-        finally:
-            conn.close()
+        self._vault.invalidate(provider)
             
+    @_invalidates_cache
     def register_personality(self, personality_name, personality_description):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 conn.execute('''
                     INSERT INTO personality (personality_name, personality_description)
                     VALUES (?, ?)
@@ -91,27 +695,23 @@ class ModelRegistry:
                 conn.commit()
         except sqlite3.IntegrityError as e:
             raise ValueError(f"Personality with name '{personality_name}' already exists.") from e
-        finally:
-            conn.close()
             
     # Fetch all registered personalities
+    @_cached_lookup
     def get_all_personalities(self):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT distinct personality_name FROM personality')
                 return cursor.fetchall()
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching personalities: {e}") from e
-        finally:
-            conn.close()
             
     # Edit personality description by name
+    @_invalidates_cache
     def edit_personality_description(self, personality_name, new_description):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('UPDATE personality SET personality_description = ? WHERE personality_name = ?', 
                                (new_description, personality_name))
@@ -120,14 +720,12 @@ class ModelRegistry:
                 conn.commit()
         except sqlite3.Error as e:
             raise ValueError(f"Error updating personality '{personality_name}': {e}") from e
-        finally:
-            conn.close()
             
     # Delete personality by name
+    @_invalidates_cache
     def delete_personality(self, personality_name):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM personality WHERE personality_name = ?', (personality_name,))
                 if cursor.rowcount == 0:
@@ -135,14 +733,12 @@ class ModelRegistry:
                 conn.commit()
         except sqlite3.Error as e:
             raise ValueError(f"Error deleting personality '{personality_name}': {e}") from e
-        finally:
-            conn.close()
             
     # Fetch personality description by name
+    @_cached_lookup
     def get_personality_description(self, personality_name):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT personality_description FROM personality WHERE personality_name = ?', (personality_name,))
                 result = cursor.fetchone()
@@ -151,41 +747,35 @@ class ModelRegistry:
                 return None
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching description for personality '{personality_name}': {e}") from e
-        finally:
-            conn.close()
             
     # Fetch all providers
+    @_cached_lookup
     def get_all_providers(self):
-        conn = self._get_connection()
         # How can I fetch and close the cursor?
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT distinct provider FROM models')
                 return cursor.fetchall()
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching providers: {e}") from e
-        finally:
-            conn.close()
     
     # Fetch all models for a specific provider
+    @_cached_lookup
     def get_models_by_provider(self, provider):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT model_name, display_name FROM models WHERE provider = ?', (provider,))
                 return cursor.fetchall()
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching models for provider '{provider}': {e}") from e
-        finally:
-            conn.close()
     
     # Get model display name by provider and model name
+    @_cached_lookup
     def get_model_display_name(self, provider, model):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT display_name FROM models WHERE provider = ? AND model_name = ?', (provider, model))
                 result = cursor.fetchone()
@@ -194,36 +784,168 @@ class ModelRegistry:
                 return None
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching display name for model '{model}' from provider '{provider}': {e}") from e
-        finally:
-            conn.close()
     
+    # Get the prompt token budget configured for a model
+    @_cached_lookup
+    def get_model_token_budget(self, provider, model):
+        try:
+            with self._connection() as conn, conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT token_budget FROM models WHERE provider = ? AND model_name = ?', (provider, model))
+                result = cursor.fetchone()
+                if result:
+                    return result[0]
+                return None
+        except sqlite3.Error as e:
+            raise ValueError(f"Error fetching token budget for model '{model}' from provider '{provider}': {e}") from e
+
+    # Set or clear the prompt token budget of a model
+    @_invalidates_cache
+    def set_model_token_budget(self, provider, model, token_budget):
+        try:
+            with self._connection() as conn, conn:
+                cursor = conn.execute('UPDATE models SET token_budget = ? WHERE provider = ? AND model_name = ?',
+                                      (token_budget or None, provider, model))
+                if cursor.rowcount == 0:
+                    raise ValueError(f"Model '{model}' not found for provider '{provider}'.")
+        except sqlite3.Error as e:
+            raise ValueError(f"Error updating token budget for model '{model}': {e}") from e
+
+    # Get the admission limits configured for a provider
+    @_cached_lookup
+    def get_rate_limits(self, provider):
+        """{"max_concurrency", "requests_per_minute", "tokens_per_minute"} for a provider; None values are unlimited"""
+        try:
+            with self._connection() as conn:
+                row = conn.execute('''
+                    SELECT max_concurrency, requests_per_minute, tokens_per_minute FROM rate_limits WHERE provider = ?
+                ''', (provider,)).fetchone()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error fetching rate limits for provider '{provider}': {e}") from e
+        return dict(zip(_RATE_LIMIT_COLUMNS, row or (None, None, None)))
+
+    # Set or clear the admission limits of a provider
+    @_invalidates_cache
+    def set_rate_limits(self, provider, max_concurrency=None, requests_per_minute=None, tokens_per_minute=None):
+        """Works for providers without a configuration too, e.g. a local Ollama; all None clears them"""
+        limits = (max_concurrency or None, requests_per_minute or None, tokens_per_minute or None)
+        try:
+            with self._connection() as conn, conn:
+                if limits == (None, None, None):
+                    conn.execute('DELETE FROM rate_limits WHERE provider = ?', (provider,))
+                else:
+                    conn.execute('''
+                        INSERT INTO rate_limits (provider, max_concurrency, requests_per_minute, tokens_per_minute)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (provider) DO UPDATE SET
+                            max_concurrency = excluded.max_concurrency,
+                            requests_per_minute = excluded.requests_per_minute,
+                            tokens_per_minute = excluded.tokens_per_minute
+                    ''', (provider, *limits))
+        except sqlite3.Error as e:
+            raise ValueError(f"Error updating rate limits for provider '{provider}': {e}") from e
+
     # Fetch api key for a specific provider and model
     def get_api_key(self, provider):
-        conn = self._get_connection()
+        """Get the decrypted API key for a provider, served from the key vault"""
+        if self._cache.needs_version_check():
+            self._cache.sync_version(self._read_change_version())
+        return self._vault.get_api_key(provider, lambda: self._load_api_key(provider))
+
+    def _load_api_key(self, provider):
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT api FROM config WHERE provider = ?', (provider,))
                 result = cursor.fetchone()
-                if result:
-                    try:
-                        # Decrypt the API key if it's encrypted
-                        return self.decrypt_api_key(result[0])
-                    except Exception as e:
-                        # If decryption fails, assume it's stored as plain text
-                        return result[0]
-                return None
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching API key for provider '{provider}': {e}") from e
-        finally:
-            conn.close()
+        return self._stored_api_key(result[0], provider) if result else None
+
+    def get_model_kwargs(self, provider):
+        """
+        Keyword arguments that hand a provider's API key to init_chat_model under the
+        provider's own keyword (see API_KEY_KWARGS). Chat models that only read the key
+        from the environment get it through the configured variable instead.
+        """
+        api_key = self.get_api_key(provider)
+        if not api_key:
+            return {}
+        kwarg = api_key_kwarg(provider)
+        if kwarg is None:
+            env_name = self.get_api_env_name(provider)
+            if env_name:
+                os.environ[env_name] = api_key
+            return {}
+        return {kwarg: api_key}
+
+    # Add another API key to a provider's pool
+    @_invalidates_cache
+    def add_api_key(self, provider, api, label=''):
+        """Store an extra encrypted key for a provider that already has a configuration"""
+        encrypted_api = self.encrypt_api_key(api)
+        try:
+            with self._connection() as conn, conn:
+                if conn.execute('SELECT 1 FROM config WHERE provider = ?', (provider,)).fetchone() is None:
+                    raise ValueError(f"Register a configuration for provider '{provider}' first.")
+                cursor = conn.execute('INSERT INTO api_keys (provider, api, label) VALUES (?, ?, ?)',
+                                      (provider, encrypted_api, label or ''))
+                key_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            raise ValueError(f"Error adding API key for provider '{provider}': {e}") from e
+        self._vault.invalidate(provider)
+        return key_id
+
+    @_invalidates_cache
+    def delete_api_key(self, provider, key_id):
+        """Remove an extra key from a provider's pool"""
+        try:
+            with self._connection() as conn, conn:
+                conn.execute('DELETE FROM api_keys WHERE provider = ? AND id = ?', (provider, key_id))
+        except sqlite3.Error as e:
+            raise ValueError(f"Error deleting API key {key_id} of provider '{provider}': {e}") from e
+        self._vault.invalidate(provider)
+
+    @_cached_lookup
+    def list_api_keys(self, provider):
+        """(id, label, created_at) of a provider's extra keys; the keys themselves are not returned"""
+        try:
+            with self._connection() as conn:
+                return conn.execute('SELECT id, label, created_at FROM api_keys WHERE provider = ? ORDER BY id',
+                                    (provider,)).fetchall()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error listing API keys for provider '{provider}': {e}") from e
+
+    def get_api_key_pool(self, provider):
+        """
+        Every decrypted key of a provider as (key_id, api_key) pairs: the config key
+        as "primary" first, then the extra keys. Served from the key vault.
+        """
+        if self._cache.needs_version_check():
+            self._cache.sync_version(self._read_change_version())
+        return self._vault.get_api_key_pool(provider, lambda: self._load_api_key_pool(provider))
+
+    def _load_api_key_pool(self, provider):
+        pool = []
+        primary = self._load_api_key(provider)
+        if primary:
+            pool.append(("primary", primary))
+        try:
+            with self._connection() as conn:
+                rows = conn.execute('SELECT id, api FROM api_keys WHERE provider = ? ORDER BY id',
+                                    (provider,)).fetchall()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error fetching API keys for provider '{provider}': {e}") from e
+        for key_id, api in rows:
+            pool.append((str(key_id), self._stored_api_key(api, provider)))
+        return tuple(pool)
         
     
+    @_cached_lookup
     def get_api_env_name(self, provider):
-        conn = self._get_connection()
         """Get the environment variable name for the API key of a specific provider."""
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT api_env_name FROM config WHERE provider = ?', (provider,))
                 result = cursor.fetchone()
@@ -232,88 +954,281 @@ class ModelRegistry:
                 return None
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching environment variable name for provider '{provider}': {e}") from e
-        finally:
-            conn.close()
     
-    # Load fernet key from secret.key file
+    # Load the primary fernet key from the key file
     def load_key(self):
-        if not os.path.exists('secret.key'):
-            self.generate_key()
-        # Load the key from the file
-        with open('secret.key', 'rb') as key_file:
-            key = key_file.read()
-        return key
+        return self._vault.primary_key
     
     # encrypt the api key
     def encrypt_api_key(self, api_key):
-        key = self.load_key()
-        if not key:
-            raise ValueError("Encryption key is not available.")
-        fernet = Fernet(key)
-        encrypted_api_key = fernet.encrypt(api_key.encode('utf-8'))
-        return encrypted_api_key
+        return self._vault.encrypt(api_key)
     
     # decrypt the api key
     def decrypt_api_key(self, encrypted_api_key):
-        key = self.load_key()
-        if not key:
-            raise ValueError("Encryption key is not available.")
-        fernet = Fernet(key)
-        decrypted_api_key = fernet.decrypt(encrypted_api_key)  
+        decrypted_api_key = self._vault.decrypt(encrypted_api_key)
         if not decrypted_api_key:
             raise ValueError("Decryption failed. Invalid encrypted API key.")
-        return decrypted_api_key.decode('utf-8')
+        return decrypted_api_key
     
     # generate a new key for encryption if not exists
     def generate_key(self): 
-        if not os.path.exists('secret.key'):
-            key = Fernet.generate_key()
-            with open('secret.key', 'wb') as key_file:
-                key_file.write(key)
+        # The vault creates the key file on first load when it is missing
+        self.load_key()
+
+    # Rotate the encryption key and re-encrypt every stored API key with it
+    @_invalidates_cache
+    def rotate_encryption_key(self):
+        cipher = self._vault.rotate()
+        try:
+            with self._connection() as conn, conn:
+                rows = conn.execute('SELECT provider, api FROM config').fetchall()
+                conn.executemany('UPDATE config SET api = ? WHERE provider = ?',
+                                 [(_reencrypt(cipher, api, provider), provider) for provider, api in rows])
+                rows = conn.execute('SELECT provider, id, api FROM api_keys').fetchall()
+                conn.executemany('UPDATE api_keys SET api = ? WHERE id = ?',
+                                 [(_reencrypt(cipher, api, provider), key_id) for provider, key_id, api in rows])
+        except sqlite3.Error as e:
+            raise ValueError(f"Error re-encrypting API keys: {e}") from e
                 
             
-    # Deletre a model by provider and name
+    # Delete a model by provider and name
+    @_invalidates_cache
     def delete_model(self, provider, model):
-        conn = self._get_connection()
         """Delete a model by provider and name."""
-        try:
-            with conn:
-                conn.execute('DELETE FROM models WHERE provider = ? AND name = ?', (provider, model))
-        finally:
-            conn.close()
+        with self._connection() as conn, conn:
+            conn.execute('DELETE FROM models WHERE provider = ? AND model_name = ?', (provider, model))
             
-    # Update model configuration
+    # Delete provider configuration
+    @_invalidates_cache
     def delete_config(self, provider):
-        conn = self._get_connection()
         """Delete a configuration by provider."""
-        try:
-            with conn:
-                conn.execute('DELETE FROM models WHERE provider = ?', (provider))
-        finally:
-            conn.close()
+        with self._connection() as conn, conn:
+            conn.execute('DELETE FROM config WHERE provider = ?', (provider,))
+            conn.execute('DELETE FROM api_keys WHERE provider = ?', (provider,))
+        self._vault.invalidate(provider)
             
     # Get privider and model names
+    @_cached_lookup
     def get_provider_model_names(self):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 # Fetch all provider and model names
                 cursor = conn.cursor()
                 cursor.execute('SELECT provider, display_name, model_name FROM models')
                 return cursor.fetchall()
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching provider and model names: {e}") from e
-        finally:
-            conn.close()
             
+    @_cached_lookup
     def get_provider_configurations(self):
-        conn = self._get_connection()
         try:
-            with conn:
+            with self._connection() as conn, conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT provider, api_env_name FROM config')
                 return cursor.fetchall()
         except sqlite3.Error as e:
             raise ValueError(f"Error fetching provider configurations: {e}") from e
-        finally:
-            conn.close()
\ No newline at end of file
+
+    # Bulk import models, personalities, configurations, rate limits and pool keys in one transaction
+    @_invalidates_cache
+    def import_registry(self, data, fmt='json', dry_run=False):
+        """Upsert registry entries from JSON or CSV data.
+
+        Returns a diff of what was (or, with ``dry_run``, would be) added, updated
+        and left unchanged per section. Nothing is written on a dry run.
+        """
+        records = _parse_bulk_records(data, fmt)
+        diff = {section: {"added": [], "updated": [], "unchanged": 0} for section in _BULK_SECTIONS}
+        try:
+            with self._connection() as conn:
+                # Take the write lock up front so the diff matches what gets written
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    existing_models = {}
+                    for row_id, provider, model_name, display_name, token_budget in conn.execute(
+                            'SELECT id, provider, model_name, display_name, token_budget FROM models ORDER BY id'):
+                        existing_models.setdefault((provider, model_name), (row_id, display_name, token_budget))
+                    existing_personalities = dict(conn.execute(
+                        'SELECT personality_name, personality_description FROM personality'))
+                    existing_configs = {provider: (api, api_env_name) for provider, api, api_env_name
+                                        in conn.execute('SELECT provider, api, api_env_name FROM config')}
+                    existing_limits = {provider: tuple(limits) for provider, *limits in conn.execute(
+                        'SELECT provider, max_concurrency, requests_per_minute, tokens_per_minute FROM rate_limits')}
+                    # Pool keys are matched on their decrypted value; ones that no longer decrypt match nothing
+                    existing_keys = {}
+                    for key_id, provider, api, label in conn.execute(
+                            'SELECT id, provider, api, label FROM api_keys ORDER BY id'):
+                        try:
+                            existing_keys.setdefault((provider, self._stored_api_key(api, provider)), (key_id, label))
+                        except ValueError:
+                            continue
+
+                    model_inserts, model_updates = [], []
+                    for key, row in records["models"].items():
+                        current = existing_models.get(key)
+                        if current is None:
+                            model_inserts.append((row["provider"], row["display_name"], row["model_name"],
+                                                  row["token_budget"]))
+                            diff["models"]["added"].append(key)
+                        elif current[1:] != (row["display_name"], row["token_budget"]):
+                            model_updates.append((row["display_name"], row["token_budget"], current[0]))
+                            diff["models"]["updated"].append(key)
+                        else:
+                            diff["models"]["unchanged"] += 1
+
+                    personality_upserts = []
+                    for key, row in records["personalities"].items():
+                        current = existing_personalities.get(key[0])
+                        if current == row["personality_description"]:
+                            diff["personalities"]["unchanged"] += 1
+                            continue
+                        personality_upserts.append((row["personality_name"], row["personality_description"]))
+                        diff["personalities"]["added" if current is None else "updated"].append(key[0])
+
+                    config_upserts = []
+                    for key, row in records["configs"].items():
+                        current = existing_configs.get(key[0])
+                        if current is None and not row["api"]:
+                            raise ValueError(f"Configuration for provider '{key[0]}' needs an api key.")
+                        try:
+                            stored_api = self._stored_api_key(current[0], row["provider"]) if current else None
+                        except ValueError:
+                            # A key that no longer decrypts is replaced by the imported one
+                            stored_api = None
+                        api_changed = bool(row["api"]) and stored_api != row["api"]
+                        if current is not None and not api_changed and current[1] == row["api_env_name"]:
+                            diff["configs"]["unchanged"] += 1
+                            continue
+                        encrypted_api = self.encrypt_api_key(row["api"]) if api_changed else current[0]
+                        config_upserts.append((row["provider"], encrypted_api, row["api_env_name"]))
+                        diff["configs"]["added" if current is None else "updated"].append(key[0])
+
+                    limit_upserts = []
+                    for key, row in records["rate_limits"].items():
+                        current = existing_limits.get(key[0])
+                        limits = tuple(row[column] for column in _RATE_LIMIT_COLUMNS)
+                        if current == limits:
+                            diff["rate_limits"]["unchanged"] += 1
+                            continue
+                        limit_upserts.append((key[0], *limits))
+                        diff["rate_limits"]["added" if current is None else "updated"].append(key[0])
+
+                    key_inserts, key_updates = [], []
+                    for key, row in records["api_keys"].items():
+                        if not row["api"]:
+                            raise ValueError(f"An api_keys entry for provider '{key[0]}' has no api key.")
+                        if key[0] not in existing_configs and (key[0],) not in records["configs"]:
+                            raise ValueError(f"API keys for provider '{key[0]}' need a configuration for it.")
+                        current = existing_keys.get(key)
+                        if current is None:
+                            key_inserts.append((row["provider"], self.encrypt_api_key(row["api"]), row["label"]))
+                            diff["api_keys"]["added"].append(key[0])
+                        elif current[1] != row["label"]:
+                            key_updates.append((row["label"], current[0]))
+                            diff["api_keys"]["updated"].append(key[0])
+                        else:
+                            diff["api_keys"]["unchanged"] += 1
+
+                    if not dry_run:
+                        conn.executemany('''
+                            INSERT INTO models (provider, display_name, model_name, token_budget) VALUES (?, ?, ?, ?)
+                        ''', model_inserts)
+                        conn.executemany('UPDATE models SET display_name = ?, token_budget = ? WHERE id = ?',
+                                         model_updates)
+                        conn.executemany('''
+                            INSERT INTO personality (personality_name, personality_description) VALUES (?, ?)
+                            ON CONFLICT(personality_name) DO UPDATE SET personality_description = excluded.personality_description
+                        ''', personality_upserts)
+                        conn.executemany('''
+                            INSERT INTO config (provider, api, api_env_name) VALUES (?, ?, ?)
+                            ON CONFLICT(provider) DO UPDATE SET api = excluded.api, api_env_name = excluded.api_env_name
+                        ''', config_upserts)
+                        conn.executemany('''
+                            INSERT INTO rate_limits (provider, max_concurrency, requests_per_minute, tokens_per_minute)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT(provider) DO UPDATE SET max_concurrency = excluded.max_concurrency,
+                                requests_per_minute = excluded.requests_per_minute,
+                                tokens_per_minute = excluded.tokens_per_minute
+                        ''', limit_upserts)
+                        conn.executemany('INSERT INTO api_keys (provider, api, label) VALUES (?, ?, ?)', key_inserts)
+                        conn.executemany('UPDATE api_keys SET label = ? WHERE id = ?', key_updates)
+                except BaseException:
+                    conn.rollback()
+                    raise
+                if dry_run:
+                    conn.rollback()
+                else:
+                    conn.commit()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error importing registry: {e}") from e
+        return diff
+
+    def _stored_api_key(self, stored, provider):
+        """
+        Decrypt a stored key. Values that aren't Fernet tokens are plain-text keys from
+        older databases; a token that can't be decrypted raises instead of being handed
+        out as the key.
+        """
+        if not _is_fernet_token(stored):
+            return stored
+        try:
+            return self.decrypt_api_key(stored)
+        except InvalidToken as e:
+            raise ValueError(f"The API key for provider '{provider}' can't be decrypted with the keys in "
+                             f"'{self._vault.key_path}'. Restore the key file it was encrypted with or "
+                             f"register the key again.") from e
+
+    # Export the registry as JSON or CSV
+    def export_registry(self, fmt='json', include_api_keys=False):
+        """Serialize models, personalities, configurations and rate limits for import_registry.
+
+        API keys are left out unless ``include_api_keys`` is set, in which case
+        they are exported decrypted so the file can be imported elsewhere. The
+        additional pool keys are only exported with ``include_api_keys``.
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute('BEGIN')
+                try:
+                    sections = {
+                        "models": conn.execute(
+                            'SELECT provider, model_name, display_name, token_budget FROM models ORDER BY id').fetchall(),
+                        "personalities": conn.execute(
+                            'SELECT personality_name, personality_description FROM personality ORDER BY id').fetchall(),
+                        "configs": conn.execute(
+                            'SELECT provider, api_env_name, api FROM config ORDER BY provider').fetchall(),
+                        "rate_limits": conn.execute(
+                            'SELECT provider, max_concurrency, requests_per_minute, tokens_per_minute '
+                            'FROM rate_limits ORDER BY provider').fetchall(),
+                        # Pool keys are only worth exporting together with their values
+                        "api_keys": conn.execute(
+                            'SELECT provider, label, api FROM api_keys ORDER BY id').fetchall()
+                                    if include_api_keys else [],
+                    }
+                finally:
+                    conn.commit()
+        except sqlite3.Error as e:
+            raise ValueError(f"Error exporting registry: {e}") from e
+
+        payload = {}
+        for section, rows in sections.items():
+            columns = _BULK_SECTIONS[section][0]
+            payload[section] = [dict(zip(columns, row)) for row in rows]
+        for config in payload["configs"]:
+            config["api"] = self._stored_api_key(config["api"], config["provider"]) if include_api_keys else ""
+        for api_key in payload["api_keys"]:
+            api_key["api"] = self._stored_api_key(api_key["api"], api_key["provider"])
+
+        if fmt == 'json':
+            return json.dumps(payload, indent=2, ensure_ascii=False)
+        if fmt == 'csv':
+            columns = ["record_type"] + list(dict.fromkeys(
+                column for section_columns, _ in _BULK_SECTIONS.values() for column in section_columns))
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns)
+            writer.writeheader()
+            for record_type, section in _CSV_RECORD_TYPES.items():
+                for row in payload[section]:
+                    writer.writerow({"record_type": record_type, **row})
+            return buffer.getvalue()
+        raise ValueError(f"Unsupported registry format '{fmt}'. Use 'json' or 'csv'.")
@@ -1,15 +1,15 @@
 import streamlit as st
-from register_model import ModelRegistry
+from register_model import get_registry
 
-# Initialize the model registry
-registry = ModelRegistry()
+# Use the shared, process-wide model registry
+registry = get_registry()
 
 st.set_page_config(page_title="Register Model", page_icon=":robot_face:",
                    layout="wide")
 
 st.title("Model Configuration and Registration")
 
-tab1, tab2, tab3, tab4  = st.tabs(["Registered Models", "Register Model", "Delete Models", "System Prompts"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["Registered Models", "Register Model", "Delete Models", "System Prompts", "Bulk import"])
    
 with tab1:
     # Display registered models in tabular format
@@ -37,6 +37,10 @@ with tab1:
     if st.button("Refresh"):
         st.rerun()
 
+    cache_stats = registry.cache_stats()
+    st.caption(f"Registry cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+               f"{cache_stats['invalidations']} invalidations")
+
 
 with tab2:
     register_form_1 = st.form("Register Model Details", clear_on_submit=True)
@@ -45,13 +49,13 @@ with tab2:
         display_name = st.text_input("Model Display Name", placeholder="Enter model display name")
         model_name = st.text_input("Model Name", placeholder="Enter model name")
         provider = st.text_input("Provider", placeholder="Enter provider name")
+        token_budget = st.number_input("Prompt Token Budget", min_value=0, value=0, step=1024,
+                                       help="Maximum prompt tokens sent to this model. 0 uses the default budget.")
         submit_button = st.form_submit_button("Register Model")
         if submit_button:
             if display_name and model_name and provider:
                 try:
-                    from register_model import ModelRegistry
-                    register_model = ModelRegistry()
-                    register_model.register_model(display_name, model_name, provider)
+                    registry.register_model(display_name, model_name, provider, int(token_budget) or None)
                     st.success("Model registered successfully!")
                 except Exception as e:
                     st.error(f"Error registering model: {e}")
@@ -75,6 +79,48 @@ with tab2:
                     st.error(f"Error registering configuration: {e}")
             else:
                 st.warning("Please fill in all fields.")
+    
+    rate_limit_form = st.form("Provider rate limits", clear_on_submit=True)
+    with rate_limit_form:
+        st.subheader("Rate Limits")
+        provider = st.text_input("Provider", placeholder="Enter provider name to limit")
+        max_concurrency = st.number_input("Max Concurrent Requests", min_value=0, value=0, step=1,
+                                          help="Calls in flight at once across all of the provider's models. 0 is unlimited.")
+        requests_per_minute = st.number_input("Requests per Minute", min_value=0, value=0, step=10,
+                                              help="0 is unlimited.")
+        tokens_per_minute = st.number_input("Tokens per Minute", min_value=0, value=0, step=10000,
+                                            help="Prompt plus generated tokens. 0 is unlimited.")
+        limits_button = st.form_submit_button("Save Rate Limits")
+        
+        if limits_button:
+            if provider:
+                try:
+                    registry.set_rate_limits(provider, int(max_concurrency), int(requests_per_minute),
+                                             int(tokens_per_minute))
+                    st.success("Rate limits saved. Running chats pick them up within a few seconds.")
+                except Exception as e:
+                    st.error(f"Error saving rate limits: {e}")
+            else:
+                st.warning("Please enter a provider.")
+    
+    api_key_form = st.form("Additional API keys", clear_on_submit=True)
+    with api_key_form:
+        st.subheader("Additional API Keys")
+        st.caption("Requests to a provider are spread over its configuration key and these keys.")
+        provider = st.text_input("Provider", placeholder="Enter a provider that already has a configuration")
+        extra_api_key = st.text_input("API Key", placeholder="Enter an additional API key", type="password")
+        key_label = st.text_input("Label", placeholder="Optional, e.g. the account or project the key belongs to")
+        add_key_button = st.form_submit_button("Add API Key")
+        
+        if add_key_button:
+            if provider and extra_api_key:
+                try:
+                    registry.add_api_key(provider, extra_api_key, key_label)
+                    st.success("API key added successfully!")
+                except Exception as e:
+                    st.error(f"Error adding API key: {e}")
+            else:
+                st.warning("Please fill in the provider and API key.")
 
 with tab3:                
     # Delelte existing model
@@ -105,6 +151,22 @@ with tab3:
                 st.success("Configuration deleted successfully!")
             except Exception as e:
                 st.error(f"Error deleting Configuration: {e}")
+    
+    st.subheader("Delete Additional API Key")
+    delete_key_form = st.form("Delete API Key", clear_on_submit=True)
+    with delete_key_form:
+        key_choices = [(provider, key_id, label) for (provider, _) in registry.get_provider_configurations()
+                       for key_id, label, _ in registry.list_api_keys(provider)]
+        delete_key = st.selectbox("Select API Key", key_choices,
+                                  format_func=lambda choice: f"{choice[0]} #{choice[1]} {choice[2]}".strip())
+        delete_key_button = st.form_submit_button("Delete API Key")
+        
+        if delete_key_button and delete_key:
+            try:
+                registry.delete_api_key(delete_key[0], delete_key[1])
+                st.success("API key deleted successfully!")
+            except Exception as e:
+                st.error(f"Error deleting API key: {e}")
                 
 with tab4:
     st.subheader("System Prompts")
@@ -169,4 +231,48 @@ with tab4:
                 registry.delete_personality(prompt_name)
                 st.success("System prompt deleted successfully!")
             except Exception as e:
-                st.error(f"Error deleting system prompt: {e}")
\ No newline at end of file
+                st.error(f"Error deleting system prompt: {e}")
+
+with tab5:
+    st.subheader("Bulk Import")
+    st.markdown("Upload a JSON file with `models`, `personalities`, `configs`, `rate_limits` and `api_keys` lists, "
+                "or a CSV file with a `record_type` column (`model`, `personality`, `config`, `rate_limit` or "
+                "`api_key`). Existing entries are updated in place.")
+    uploaded_file = st.file_uploader("Registry file", type=["json", "csv"], key="bulk_import_file")
+    if uploaded_file is not None:
+        import_format = "csv" if uploaded_file.name.lower().endswith(".csv") else "json"
+        import_data = uploaded_file.getvalue().decode("utf-8")
+        col_preview, col_import = st.columns(2)
+        with col_preview:
+            if st.button("Preview changes", use_container_width=True):
+                try:
+                    st.session_state.bulk_import_diff = registry.import_registry(import_data, import_format, dry_run=True)
+                except Exception as e:
+                    st.error(f"Error reading registry file: {e}")
+        with col_import:
+            if st.button("Import", type="primary", use_container_width=True):
+                try:
+                    st.session_state.bulk_import_diff = registry.import_registry(import_data, import_format)
+                    st.success("Registry imported successfully!")
+                except Exception as e:
+                    st.error(f"Error importing registry: {e}")
+        if "bulk_import_diff" in st.session_state:
+            diff = st.session_state.bulk_import_diff
+            for section, changes in diff.items():
+                st.markdown(f"**{section.capitalize()}**: {len(changes['added'])} added, "
+                            f"{len(changes['updated'])} updated, {changes['unchanged']} unchanged")
+            with st.expander("Details"):
+                st.json(diff)
+
+    st.subheader("Export")
+    include_api_keys = st.checkbox("Include decrypted API keys", value=False)
+    if not include_api_keys and any(registry.list_api_keys(provider)
+                                    for provider, _ in registry.get_provider_configurations()):
+        st.warning("Additional API keys are only exported together with the decrypted keys.")
+    col_json, col_csv = st.columns(2)
+    with col_json:
+        st.download_button("Download JSON", registry.export_registry("json", include_api_keys),
+                           file_name="model_registry.json", mime="application/json", use_container_width=True)
+    with col_csv:
+        st.download_button("Download CSV", registry.export_registry("csv", include_api_keys),
+                           file_name="model_registry.csv", mime="text/csv", use_container_width=True)
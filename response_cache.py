@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+import rate_limiter
+from tiered_cache import SQLiteCacheTier, TieredCache, cache_key, model_fingerprint
+
+
+class CachePolicy:
+    """
+    Decides which chatbot calls may be answered from the response cache.
+
+    Only deterministic-enough models qualify: their temperature must be at or
+    below ``max_temperature``, and the run's personality must be one of the
+    ``personalities`` that opted in. By default none has, so nothing is cached.
+    """
+    def __init__(self, max_temperature=0.0, personalities=()):
+        self.max_temperature = max_temperature
+        self.personalities = set(personalities or ())
+
+    def is_eligible(self, llm, personality=None):
+        temperature = getattr(llm, "temperature", None)
+        if temperature is None or temperature > self.max_temperature:
+            return False
+        return personality in self.personalities
+
+
+class ResponseCache:
+    """
+    Exact-match cache in front of the chatbot model call, keyed on the model
+    fingerprint and the full prompt (system prompt included). Hits are replayed
+    through a streaming stub model, so they reach the UI token by token like a
+    generated answer.
+    """
+    def __init__(self, policy=None, maxsize=1024, ttl=None, db_path=None):
+        self.policy = policy or CachePolicy()
+        persistent = SQLiteCacheTier(db_path, table="response_cache", ttl=ttl) if db_path else None
+        self.cache = TieredCache(maxsize=maxsize, ttl=ttl, persistent=persistent)
+        self.ineligible = 0
+        self._lock = threading.Lock()
+
+    def _key(self, llm, messages):
+        return cache_key(model_fingerprint(llm), [(m.type, m.content) for m in messages])
+
+    def _lookup(self, llm, messages, config):
+        """Returns (key, cached content); key is None for calls the policy excludes"""
+        personality = (config or {}).get("configurable", {}).get("personality")
+        if not self.policy.is_eligible(llm, personality):
+            with self._lock:
+                self.ineligible += 1
+            return None, None
+        key = self._key(llm, messages)
+        return key, self.cache.get(key)
+
+    def _store(self, key, response):
+        if key is not None and isinstance(response.content, str) and response.content:
+            self.cache.put(key, response.content)
+
+    def invoke(self, llm, messages, config=None):
+        """Call the model (behind its provider's rate limiter) unless an identical eligible call is cached"""
+        key, cached = self._lookup(llm, messages, config)
+        if cached is not None:
+            return self.replay(cached)
+        response = rate_limiter.invoke(llm, messages, config=config)
+        self._store(key, response)
+        return response
+
+    async def ainvoke(self, llm, messages, config=None):
+        """Async counterpart of ``invoke``; the cache's SQLite tier is read and written in a worker thread"""
+        key, cached = await asyncio.to_thread(self._lookup, llm, messages, config)
+        if cached is not None:
+            return await self.areplay(cached)
+        response = await rate_limiter.ainvoke(llm, messages, config=config)
+        await asyncio.to_thread(self._store, key, response)
+        return response
+
+    def replay(self, content):
+        # Invoked inside the graph node, so the stub's tokens flow into the messages stream
+        return GenericFakeChatModel(messages=iter([AIMessage(content=content)])).invoke([])
+
+    async def areplay(self, content):
+        return await GenericFakeChatModel(messages=iter([AIMessage(content=content)])).ainvoke([])
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            stats["ineligible"] = self.ineligible
+        return stats
+
+
+# Response cache shared by both backends
+shared_response_cache = ResponseCache()
+
+
+def configure_response_cache(max_temperature=0.0, personalities=(), maxsize=1024, ttl=None, db_path=None):
+    """Replace the shared response cache, e.g. to change the policy or add the on-disk tier"""
+    global shared_response_cache
+    shared_response_cache = ResponseCache(CachePolicy(max_temperature, personalities),
+                                          maxsize=maxsize, ttl=ttl, db_path=db_path)
+    return shared_response_cache
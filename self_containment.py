@@ -0,0 +1,125 @@
+import re
+import threading
+
+# Words that usually point back at something said earlier in the conversation
+ANAPHORA_WORDS = {
+    "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
+    "he", "him", "his", "she", "her", "hers", "this", "that", "these", "those",
+    "there", "former", "latter", "above", "previous", "same", "such", "else",
+    "one", "ones", "again", "also", "too", "instead",
+}
+
+# Openings that continue the previous turn instead of asking something new
+ELLIPSIS_PREFIXES = (
+    "and ", "but ", "or ", "so ", "then ", "also ", "what about", "how about",
+    "what else", "why not", "more ", "another ", "same ",
+    "ok ", "okay ", "continue", "go on", "elaborate", "explain more",
+)
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "do", "does",
+    "did", "of", "in", "on", "at", "to", "for", "with", "by", "from", "and",
+    "or", "but", "what", "which", "who", "whom", "whose", "when", "where",
+    "why", "how", "can", "could", "would", "should", "will", "shall", "may",
+    "might", "must", "i", "you", "we", "me", "my", "your", "our", "us", "please",
+    "tell", "give", "about", "as", "if", "than", "into", "not", "no", "yes",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_TOKEN_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9'.-]*")
+
+
+def _words(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def content_words(text):
+    """Lowercased words of ``text`` that carry meaning: no stopwords, at least three letters"""
+    return {w for w in _words(text) if w not in STOPWORDS and len(w) > 2}
+
+
+def named_subjects(question):
+    """
+    Tokens that name something on their own: capitalized words past the first
+    one, acronyms and numbers. Every question starts with a capital, so the
+    first word only counts when it opens a multi-word name ("Eiffel Tower: ...").
+    """
+    tokens = [t.rstrip(".'-") for t in _TOKEN_RE.findall(question)]
+    named = []
+    for index, token in enumerate(tokens):
+        lower = token.lower()
+        if lower in STOPWORDS or lower in ANAPHORA_WORDS:
+            continue
+        if any(c.isdigit() for c in token) or (len(token) > 1 and token.isupper()):
+            named.append(token)
+        elif token[:1].isupper() and (index > 0 or (len(tokens) > 1 and tokens[1][:1].isupper())):
+            named.append(token)
+    return named
+
+
+class HeuristicSelfContainmentDetector:
+    """
+    Cheap check for whether a question can be answered without the chat history.
+
+    Only positive evidence counts: besides having no pronouns or demonstratives
+    pointing back, not opening like a continuation ("and what about...") and
+    being long enough, the question must name its own subject, i.e. contain a
+    proper noun, acronym or number. Follow-ups like "Why was the design
+    controversial?" lean on the conversation without any pronoun, so a question
+    that names nothing is always reformulated. The conversation itself isn't
+    consulted: a question repeating the subject of recent turns is, if
+    anything, more self-contained. An optional
+    ``classifier(question) -> probability`` gets the final say on questions
+    that pass the heuristics. Misses only cost a reformulation round-trip.
+    """
+    def __init__(self, min_words=4, classifier=None, classifier_threshold=0.5):
+        self.min_words = min_words
+        self.classifier = classifier
+        self.classifier_threshold = classifier_threshold
+
+    def __call__(self, question):
+        words = _words(question)
+        if len(words) < self.min_words:
+            return False
+        if any(w in ANAPHORA_WORDS for w in words):
+            return False
+        if question.strip().lower().startswith(ELLIPSIS_PREFIXES):
+            return False
+        if not named_subjects(question):
+            return False
+
+        if self.classifier is not None:
+            return self.classifier(question) >= self.classifier_threshold
+        return True
+
+
+class BypassStats:
+    """Counts how often reformulation was skipped and estimates the latency saved"""
+    def __init__(self):
+        self.bypassed = 0
+        self.reformulated = 0
+        self.reformulation_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def record_reformulation(self, seconds):
+        with self._lock:
+            self.reformulated += 1
+            self.reformulation_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            average = self.reformulation_seconds / self.reformulated if self.reformulated else 0.0
+            total = self.bypassed + self.reformulated
+            return {
+                "bypassed": self.bypassed,
+                "reformulated": self.reformulated,
+                "bypass_rate": self.bypassed / total if total else 0.0,
+                "avg_reformulation_seconds": average,
+                # Each bypass saves roughly one average reformulation round-trip
+                "estimated_seconds_saved": average * self.bypassed,
+            }
+
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from register_model import ConnectionPool
+from self_containment import named_subjects
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _stable_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: hashes word unigrams and bigrams into a fixed-size signed
+    vector (the hashing trick) with sublinear term frequency, L2-normalized.
+    Good at near-duplicates and light paraphrases, with no model download.
+    """
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = _stable_hash(feature)
+                vectors[row, h % self.dim] += 1.0 if h & 1 << 62 else -1.0
+        return _normalize(np.sign(vectors) * np.log1p(np.abs(vectors)))
+
+
+def key_terms(question):
+    """
+    The names and numbers of a question. Cached answers only match questions
+    naming exactly the same things, since embeddings alone rate "vitamin C" and
+    "vitamin D" or "1900" and "1990" questions as near-duplicates. The rest of
+    the wording is left to the embedding, so paraphrases still match.
+    """
+    return _stable_hash(" ".join(sorted({name.lower() for name in named_subjects(question)})))
+
+
+def as_embedder(embedder):
+    """Accept a callable ``texts -> array`` or a LangChain ``Embeddings`` object"""
+    if hasattr(embedder, "embed_documents"):
+        return lambda texts: np.asarray(embedder.embed_documents(list(texts)), dtype=np.float32)
+    return embedder
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SemanticCache:
+    """
+    Answers keyed by question embeddings, searched with one matrix-vector product.
+
+    Embeddings sit in a (capacity, dim) float32 matrix of normalized rows, so
+    cosine similarity against every cached question is ``vectors @ query``.
+    Each row belongs to a partition (e.g. personality + model), and only rows of
+    the query's partition naming the same things (``key_terms``) can match; the
+    embedding decides whether the rest of the question is a paraphrase.
+    When full, the least recently used row is overwritten.
+
+    With ``path`` set, the matrix, partition and term ids and last-used times are
+    memory-mapped ``.npy`` files and answers live in a SQLite file next to
+    them, so a restart reopens the index without loading it.
+    """
+    def __init__(self, embedder=None, dim=512, capacity=4096, threshold=0.9, path=None):
+        self.embed = as_embedder(embedder or HashingEmbedder(dim))
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path:
+            self._vectors = self._open_array(f"{path}.vectors.npy", (capacity, dim), np.float32)
+            self._partitions = self._open_array(f"{path}.partitions.npy", (capacity,), np.int64)
+            self._terms = self._open_array(f"{path}.terms.npy", (capacity,), np.int64)
+            # 0 marks an empty slot
+            self._last_used = self._open_array(f"{path}.last_used.npy", (capacity,), np.float64)
+            self._pool = ConnectionPool(os.path.abspath(f"{path}.db"))
+            try:
+                with self._pool.connection() as conn, conn:
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS semantic_answers (
+                            slot INTEGER NOT NULL PRIMARY KEY,
+                            answer TEXT NOT NULL
+                        )
+                    ''')
+            except sqlite3.Error as e:
+                raise ValueError(f"Error initializing semantic cache at '{path}': {e}") from e
+            self._answers = None
+        else:
+            self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+            self._partitions = np.zeros(capacity, dtype=np.int64)
+            self._terms = np.zeros(capacity, dtype=np.int64)
+            self._last_used = np.zeros(capacity, dtype=np.float64)
+            self._answers = {}
+
+    @staticmethod
+    def _open_array(filename, shape, dtype):
+        if os.path.exists(filename):
+            array = np.lib.format.open_memmap(filename, mode="r+")
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            del array
+        return np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+
+    def _embed_one(self, text):
+        vector = np.asarray(self.embed([text]), dtype=np.float32).reshape(1, -1)
+        if vector.shape[1] != self.dim:
+            raise ValueError(f"Embedder returned {vector.shape[1]} dimensions, expected {self.dim}.")
+        return _normalize(vector)[0]
+
+    def _get_answer(self, slot):
+        if self._answers is not None:
+            return self._answers.get(slot)
+        with self._pool.connection() as conn:
+            row = conn.execute('SELECT answer FROM semantic_answers WHERE slot = ?', (slot,)).fetchone()
+        return row[0] if row else None
+
+    def _set_answer(self, slot, answer):
+        if self._answers is not None:
+            self._answers[slot] = answer
+            return
+        with self._pool.connection() as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO semantic_answers (slot, answer) VALUES (?, ?)', (slot, answer))
+
+    def lookup(self, partition, question):
+        """Return the cached answer closest to ``question`` above the threshold, or None"""
+        query = self._embed_one(question)
+        partition_id = _stable_hash(partition)
+        terms = key_terms(question)
+        with self._lock:
+            candidates = (self._last_used > 0) & (self._partitions == partition_id) & (self._terms == terms)
+            if candidates.any():
+                scores = self._vectors @ query
+                scores[~candidates] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    self._last_used[slot] = time.time()
+                    self.hits += 1
+                    return self._get_answer(slot)
+            self.misses += 1
+            return None
+
+    def add(self, partition, question, answer):
+        vector = self._embed_one(question)
+        with self._lock:
+            # Empty slots have last_used == 0, so argmin fills them before evicting anything
+            slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._partitions[slot] = _stable_hash(partition)
+            self._terms[slot] = key_terms(question)
+            self._last_used[slot] = time.time()
+            self._set_answer(slot, answer)
+
+    def flush(self):
+        """Write memory-mapped arrays to disk"""
+        if self.path:
+            with self._lock:
+                for array in (self._vectors, self._partitions, self._terms, self._last_used):
+                    array.flush()
+
+    def __len__(self):
+        return int(np.count_nonzero(self._last_used))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": int(np.count_nonzero(self._last_used)),
+                "capacity": self.capacity,
+            }
+
+
+# Semantic cache used by the context-processor backend; off (None) until configured
+shared_semantic_cache = None
+
+
+def configure_semantic_cache(embedder=None, dim=512, capacity=4096, threshold=0.9, path=None, enabled=None):
+    """
+    Replace the shared semantic cache, e.g. to plug in an embedding model or persist it.
+    It is enabled when an embedder is given; the offline HashingEmbedder needs enabled=True.
+    """
+    global shared_semantic_cache
+    if enabled is None:
+        enabled = embedder is not None
+    shared_semantic_cache = SemanticCache(embedder, dim, capacity, threshold, path) if enabled else None
+    return shared_semantic_cache
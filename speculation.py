@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.messages import SystemMessage
+from langgraph.constants import TAG_NOSTREAM
+
+import rate_limiter
+from self_containment import content_words
+
+# Worker threads for synchronous speculative calls, shared by every responder so
+# graphs evicted from the graph cache leave no threads behind
+shared_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative-response")
+
+
+def context_coverage(context, reformulated_question):
+    """Share of the reformulation's content words that also appear in ``context``"""
+    reformulated_terms = content_words(reformulated_question)
+    if not reformulated_terms:
+        return 1.0
+    return len(reformulated_terms & content_words(context)) / len(reformulated_terms)
+
+
+class SpeculationStats:
+    """Counts speculation wins and losses and keeps recent latency savings for percentiles"""
+    def __init__(self, window=1000):
+        self.wins = 0
+        self.losses = 0
+        self._saved = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, won, seconds_saved=0.0):
+        with self._lock:
+            if won:
+                self.wins += 1
+            else:
+                self.losses += 1
+            self._saved.append(seconds_saved)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.wins + self.losses
+            saved = np.array(self._saved) if self._saved else np.zeros(1)
+            return {
+                "wins": self.wins,
+                "losses": self.losses,
+                "win_rate": self.wins / total if total else 0.0,
+                "p50_seconds_saved": float(np.percentile(saved, 50)),
+                "p95_seconds_saved": float(np.percentile(saved, 95)),
+            }
+
+
+class SpeculativeResponder:
+    """
+    Starts the response model on the raw question and a short window of recent
+    messages while the question is still being reformulated.
+
+    Once the reformulation is back, the speculative answer is kept if the
+    reformulation adds little the speculative prompt didn't already contain
+    (at least ``min_coverage`` of its content words appear there). Otherwise
+    it is dropped and the chatbot node answers the reformulated question as
+    usual. A dropped call that already started runs to completion in the
+    background; only its result is discarded. Synchronous calls run on
+    ``executor``, by default the module's ``shared_executor``.
+    """
+    def __init__(self, llm, window=4, min_coverage=0.8, stats=None, executor=None):
+        self.llm = llm
+        self.window = window
+        self.min_coverage = min_coverage
+        self.stats = stats or SpeculationStats()
+        self._executor = executor or shared_executor
+
+    def _run(self, messages):
+        started = time.perf_counter()
+        # Not streamed: a kept answer is replayed from the chatbot node instead
+        response = rate_limiter.invoke(self.llm, messages, config={"tags": [TAG_NOSTREAM]})
+        return response, started, time.perf_counter()
+
+    async def _arun(self, messages):
+        started = time.perf_counter()
+        response = await rate_limiter.ainvoke(self.llm, messages, config={"tags": [TAG_NOSTREAM]})
+        return response, started, time.perf_counter()
+
+    def _prompt(self, messages, system_prompt):
+        """Speculative prompt and the text it gives the model to work with"""
+        recent = [m for m in messages[:-1] if not isinstance(m, SystemMessage)][-self.window:]
+        prompt = ([SystemMessage(content=system_prompt)] if system_prompt else []) + recent + [messages[-1]]
+        context = " ".join(m.content for m in recent + [messages[-1]] if isinstance(m.content, str))
+        return prompt, context
+
+    def start(self, messages, system_prompt=None):
+        """Submit the speculative call; returns a handle for ``resolve``"""
+        prompt, context = self._prompt(messages, system_prompt)
+        return self._executor.submit(self._run, prompt), context
+
+    def astart(self, messages, system_prompt=None):
+        """Start the speculative call as a task on the running loop; returns a handle for ``aresolve``"""
+        prompt, context = self._prompt(messages, system_prompt)
+        return asyncio.ensure_future(self._arun(prompt)), context
+
+    def resolve(self, speculation, reformulated_question):
+        """Return the speculative answer text if it can stand in for the reformulated one, else None"""
+        future, context = speculation
+        if context_coverage(context, reformulated_question) < self.min_coverage:
+            future.cancel()
+            self.stats.record(False)
+            return None
+        reformulated_at = time.perf_counter()
+        try:
+            result = future.result()
+        except Exception:
+            self.stats.record(False)
+            return None
+        return self._accept(result, reformulated_at)
+
+    async def aresolve(self, speculation, reformulated_question):
+        """Async counterpart of ``resolve``; a rejected task is cancelled outright"""
+        task, context = speculation
+        if context_coverage(context, reformulated_question) < self.min_coverage:
+            task.cancel()
+            self.stats.record(False)
+            return None
+        reformulated_at = time.perf_counter()
+        try:
+            result = await task
+        except Exception:
+            self.stats.record(False)
+            return None
+        return self._accept(result, reformulated_at)
+
+    def _accept(self, result, reformulated_at):
+        response, started, finished = result
+        if not isinstance(response.content, str) or not response.content:
+            self.stats.record(False)
+            return None
+        # A sequential run would start the response call only now
+        waited = max(0.0, finished - reformulated_at)
+        self.stats.record(True, (finished - started) - waited)
+        return response.content
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import partial
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from register_model import ConnectionPool
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer that keeps thread history in a SQLite database.
+
+    Runs in WAL mode with relaxed syncing, so readers never block the writer
+    and commits don't wait on fsync; each checkpoint and each batch of pending
+    writes is stored in a single transaction. Tables are clustered on
+    (thread_id, checkpoint_ns, checkpoint_id), which is the index every
+    lookup goes through.
+
+    Retention: only the newest ``keep_last`` checkpoints of a thread are kept,
+    pruned as new ones are written. With ``max_idle_seconds`` set, threads
+    with no checkpoint in that long are deleted every ``prune_every`` writes.
+    """
+    def __init__(self, db_path, keep_last=20, max_idle_seconds=None, prune_every=256, serde=None):
+        super().__init__(serde=serde)
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must be at least 1.")
+        self.db_path = db_path
+        self.keep_last = keep_last
+        self.max_idle_seconds = max_idle_seconds
+        self.prune_every = prune_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._pool = ConnectionPool(os.path.abspath(db_path))
+        try:
+            with self._pool.connection() as conn, conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS checkpoints (
+                        thread_id TEXT NOT NULL,
+                        checkpoint_ns TEXT NOT NULL DEFAULT '',
+                        checkpoint_id TEXT NOT NULL,
+                        parent_checkpoint_id TEXT,
+                        type TEXT,
+                        checkpoint BLOB NOT NULL,
+                        metadata_type TEXT,
+                        metadata BLOB NOT NULL,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+                    ) WITHOUT ROWID
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS checkpoint_writes (
+                        thread_id TEXT NOT NULL,
+                        checkpoint_ns TEXT NOT NULL DEFAULT '',
+                        checkpoint_id TEXT NOT NULL,
+                        task_id TEXT NOT NULL,
+                        idx INTEGER NOT NULL,
+                        channel TEXT NOT NULL,
+                        type TEXT,
+                        value BLOB,
+                        task_path TEXT NOT NULL DEFAULT '',
+                        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                    ) WITHOUT ROWID
+                ''')
+                # Finds idle threads without scanning every checkpoint
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_checkpoints_created_at ON checkpoints (created_at)')
+        except sqlite3.Error as e:
+            raise ValueError(f"Error initializing checkpoint database '{db_path}': {e}") from e
+
+    def _load_tuple(self, conn, row):
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = conn.execute('''
+            SELECT task_id, channel, type, value FROM checkpoint_writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx
+        ''', (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=({"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                             "checkpoint_id": parent_checkpoint_id}}
+                           if parent_checkpoint_id else None),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value)))
+                            for task_id, channel, value_type, value in writes],
+        )
+
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        query = '''
+            SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                   type, checkpoint, metadata_type, metadata
+            FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+        '''
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += ' AND checkpoint_id = ?'
+            params.append(checkpoint_id)
+        else:
+            query += ' ORDER BY checkpoint_id DESC LIMIT 1'
+        with self._pool.connection() as conn:
+            row = conn.execute(query, params).fetchone()
+            return self._load_tuple(conn, row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = '''
+            SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                   type, checkpoint, metadata_type, metadata
+            FROM checkpoints
+        '''
+        clauses, params = [], []
+        if config:
+            clauses.append('thread_id = ?')
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append('checkpoint_ns = ?')
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append('checkpoint_id = ?')
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append('checkpoint_id < ?')
+            params.append(before_id)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC'
+        # Metadata filters are applied after decoding, so the limit can only go to SQL without one
+        if limit is not None and not filter:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            results = []
+            for row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                checkpoint_tuple = self._load_tuple(conn, row)
+                if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(checkpoint_tuple)
+        yield from results
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._pool.connection() as conn, conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO checkpoints
+                    (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                     type, checkpoint, metadata_type, metadata, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (thread_id, checkpoint_ns, checkpoint["id"], configurable.get("checkpoint_id"),
+                  type_, serialized, metadata_type, serialized_metadata, time.time()))
+            if self.keep_last is not None:
+                self._prune_thread(conn, thread_id, checkpoint_ns)
+        with self._lock:
+            self._puts += 1
+            prune = self.max_idle_seconds is not None and self._puts % self.prune_every == 0
+        if prune:
+            self.prune_idle_threads()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def _prune_thread(self, conn, thread_id, checkpoint_ns):
+        # Checkpoint ids sort by creation time, so everything past the newest keep_last goes
+        cutoff = conn.execute('''
+            SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+            ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?
+        ''', (thread_id, checkpoint_ns, self.keep_last - 1)).fetchone()
+        if cutoff is None:
+            return
+        for table in ("checkpoints", "checkpoint_writes"):
+            conn.execute(f'DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?',
+                         (thread_id, checkpoint_ns, cutoff[0]))
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        key = (configurable["thread_id"], configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"])
+        # Special channels (errors, interrupts) overwrite; regular writes keep the first value
+        replace, ignore = [], []
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            type_, serialized = self.serde.dumps_typed(value)
+            row = (*key, task_id, write_idx, channel, type_, serialized, task_path)
+            (replace if write_idx < 0 else ignore).append(row)
+        columns = '(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)'
+        with self._pool.connection() as conn, conn:
+            if replace:
+                conn.executemany(f'INSERT OR REPLACE INTO checkpoint_writes {columns} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 replace)
+            if ignore:
+                conn.executemany(f'INSERT OR IGNORE INTO checkpoint_writes {columns} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 ignore)
+
+    def delete_thread(self, thread_id):
+        with self._pool.connection() as conn, conn:
+            conn.execute('DELETE FROM checkpoints WHERE thread_id = ?', (thread_id,))
+            conn.execute('DELETE FROM checkpoint_writes WHERE thread_id = ?', (thread_id,))
+
+    def prune_idle_threads(self, max_idle_seconds=None):
+        """Delete threads whose newest checkpoint is older than the idle limit; returns how many"""
+        max_idle_seconds = max_idle_seconds if max_idle_seconds is not None else self.max_idle_seconds
+        if max_idle_seconds is None:
+            return 0
+        with self._pool.connection() as conn, conn:
+            idle = [row[0] for row in conn.execute('''
+                SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?
+            ''', (time.time() - max_idle_seconds,))]
+            for thread_id in idle:
+                conn.execute('DELETE FROM checkpoints WHERE thread_id = ?', (thread_id,))
+                conn.execute('DELETE FROM checkpoint_writes WHERE thread_id = ?', (thread_id,))
+        return len(idle)
+
+    def stats(self):
+        with self._pool.connection() as conn:
+            threads, checkpoints = conn.execute(
+                'SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints').fetchone()
+        return {"threads": threads, "checkpoints": checkpoints}
+
+    def get_next_version(self, current, channel):
+        # Same scheme as InMemorySaver: a sortable counter with a random tie-breaker
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # SQLite calls are short and blocking, so the async API runs them in the default executor
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def aget_tuple(self, config):
+        return await self._run(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        results = await self._run(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in results:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await self._run(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await self._run(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await self._run(self.delete_thread, thread_id)
+
+
+def checkpointer_from_env(default_factory):
+    """
+    SQLite checkpointer when CHATBOT_CHECKPOINT_DB names a database file, else
+    ``default_factory()``. CHATBOT_CHECKPOINT_KEEP sets how many checkpoints per
+    thread are retained.
+    """
+    db_path = os.environ.get("CHATBOT_CHECKPOINT_DB")
+    if not db_path:
+        return default_factory()
+    return SQLiteCheckpointer(db_path, keep_last=int(os.environ.get("CHATBOT_CHECKPOINT_KEEP", "20")))
@@ -1,11 +1,18 @@
 import streamlit as st
 import lg_cp_bend
+import async_serving
 import re
 import os
 from datetime import datetime
-from langchain.chat_models import init_chat_model
+from llm_pool import ModelSpec
 import uuid
 import register_model as rm
+import api_key_pool
+import rate_limiter
+import response_cache
+from reasoning import split_reasoning
+from bounded_checkpointer import BoundedMemorySaver
+import semantic_cache
 import json
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
@@ -14,7 +21,7 @@ from reportlab.lib.units import inch
 import io
 
 
-registry = rm.ModelRegistry()
+registry = rm.get_registry()
 
 def save_conversation(messages, thread_id, title=None):
     """Save conversation to a JSON file"""
@@ -276,55 +283,57 @@ if "selected_temperature" not in st.session_state:
     st.session_state.selected_temperature = 0.5
 if "selected_personality" not in st.session_state:
     st.session_state.selected_personality = None
-if "previous_model" not in st.session_state:
-    st.session_state.previous_model = st.session_state.selected_model
-if "previous_provider" not in st.session_state:
-    st.session_state.previous_provider = st.session_state.selected_provider
+if "session_id" not in st.session_state:
+    # Identifies this browser session to the shared graph cache
+    st.session_state.session_id = str(uuid.uuid4())
 if "reformulate_provider" not in st.session_state:
     st.session_state.reformulate_provider = "Ollama"
 if "reformulate_model" not in st.session_state:
     st.session_state.reformulate_model = "deepseek-r1"
-if "previous_reformulate_model" not in st.session_state:
-    st.session_state.previous_reformulate_model = st.session_state.reformulate_model
-if "previous_reformulate_provider" not in st.session_state:
-    st.session_state.previous_reformulate_provider = st.session_state.reformulate_provider
-if "previous_personality" not in st.session_state:
-    st.session_state.previous_personality = st.session_state.selected_personality
+if "reformulate_temperature" not in st.session_state:
+    st.session_state.reformulate_temperature = 0.0
+
+# Everything the sidebar renders comes from one registry snapshot per rerun
+snapshot = registry.snapshot()
 
 with st.sidebar:
     st.markdown('<div class="sidebar-section">🎭 Personality</div>', unsafe_allow_html=True)
     # Get list of all personalities
-    personalities = registry.get_all_personalities()
+    personalities = snapshot.personality_names
     if personalities:
         selected_personality = st.selectbox("Choose AI Personality", 
-                                           [p[0] for p in personalities],
+                                           list(personalities),
                                            index=None, key="personality_select",
                                            help="Select a personality to customize the AI's behavior")
         st.session_state.selected_personality = selected_personality
     
     st.markdown('<div class="sidebar-section">🔄 Context Processing Model</div>', unsafe_allow_html=True)
-    providers = registry.get_all_providers()
+    providers = snapshot.providers
     if not providers:
         st.error("No providers registered. Please register a model first.")
     
-    reformulate_provider = st.selectbox("🏢 Context Provider", [p[0] for p in providers],
+    reformulate_provider = st.selectbox("🏢 Context Provider", list(providers),
                                        index=0, key="reformulate_provider_select")
     st.session_state.reformulate_provider = reformulate_provider
     
     if reformulate_provider:
-        reformulate_models = registry.get_models_by_provider(reformulate_provider)
+        reformulate_models = snapshot.models_for(reformulate_provider)
         reformulate_model = st.selectbox("🧠 Context Model", [m[0] for m in reformulate_models],
                                         index=0, key="reformulate_model_select",
                                         help="Model used for reformulating questions with context")
         st.session_state.reformulate_model = reformulate_model
+        
+        st.session_state.reformulate_temperature = st.slider(
+            "🌡️ Context Temperature", 0.0, 1.0, 0.0, key="reformulate_temperature_slider",
+            help="Temperature for reformulating questions (0 keeps reformulations focused and cacheable)")
     
     st.markdown('<div class="sidebar-section">🤖 Response Generation Model</div>', unsafe_allow_html=True)
-    selected_provider = st.selectbox("🏢 Response Provider", [p[0] for p in providers],
+    selected_provider = st.selectbox("🏢 Response Provider", list(providers),
                                     index=0, key="provider_select")
     st.session_state.selected_provider = selected_provider
     
     if selected_provider:
-        models = registry.get_models_by_provider(selected_provider)
+        models = snapshot.models_for(selected_provider)
         selected_model = st.selectbox("🧠 Response Model", [m[0] for m in models],
                                      index=0, key="model_select",
                                      help="Model used for generating the final response")
@@ -332,12 +341,10 @@ with st.sidebar:
         
         if selected_model:
             try:
-                # Set up API keys for both providers
+                # Resolve API keys for both providers from the key vault so configuration
+                # problems surface here; the keys are handed to the models in get_graph
                 for provider in [selected_provider, reformulate_provider]:
-                    api_key = registry.get_api_key(provider)
-                    env_var_name = registry.get_api_env_name(provider)
-                    if api_key and env_var_name:
-                        api_key = os.environ[f'{env_var_name}'] = f"{api_key}"
+                    registry.get_api_key(provider)
             except Exception as e:
                 st.error(f"Configuration error: {e}")
                 st.stop()
@@ -345,39 +352,49 @@ with st.sidebar:
             selected_temperature = st.slider("🌡️ Response Temperature", 0.0, 1.0, 0.5, key="temperature",
                                             help="Temperature for response generation (lower = more focused, higher = more creative)")
             st.session_state.selected_temperature = selected_temperature
+            
+            st.session_state.speculative = st.toggle(
+                "🏎️ Speculative responses", value=False, key="speculative_toggle",
+                help="Start the response model on the raw question while it is being reformulated")
+            
+            st.session_state.skip_standalone = st.toggle(
+                "⚡ Skip reformulation for standalone questions", value=False, key="skip_standalone_toggle",
+                help="Send follow-ups that name their own subject straight to the response model")
         else:
             st.error("Unable to initialize the model. Please check the log.")
 
-# Cache the graph so it's not rebuilt on every run.
-# This preserves the conversation history in the graph's memory.
-@st.cache_resource
-def get_graph(response_model, response_provider, response_temp, reformulate_model, reformulate_provider):
-    # Update both models inside the cached function
-    response_llm = init_chat_model(response_model,
-                                 model_provider=response_provider,
-                                 temperature=response_temp)
-    
-    reformulate_llm = init_chat_model(reformulate_model,
-                                    model_provider=reformulate_provider,
-                                    temperature=1)
-    
-    return lg_cp_bend.build_chatbot_graph(st.session_state.selected_personality, response_llm, reformulate_llm)
+# Cache the graph so it's not rebuilt on every run. Graphs are keyed by model
+# configuration only and shared between sessions; the personality is passed per run
+# in the graph config. Switching models only evicts the graph this session left
+# behind, and conversation history lives in the backend's shared checkpointer.
+def get_graph(response_model, response_provider, response_temp, reformulate_model, reformulate_provider,
+              reformulate_temp, speculative=False, skip_standalone=False):
+    cache_key = (response_model, response_provider, response_temp, reformulate_model, reformulate_provider,
+                 reformulate_temp, speculative, skip_standalone)
+    return lg_cp_bend.graph_cache.acquire(
+        st.session_state.session_id, cache_key,
+        lambda: build_graph(response_model, response_provider, response_temp, reformulate_model, reformulate_provider,
+                            reformulate_temp, speculative, skip_standalone))
+
+def build_graph(response_model, response_provider, response_temp, reformulate_model, reformulate_provider,
+                reformulate_temp, speculative=False, skip_standalone=False):
+    # Both models are bound to the graph being built; instances come from the shared
+    # LLM pool, so graphs using the same model share one client and its connections
+    response_spec = ModelSpec(response_model, response_provider, response_temp,
+                              registry.get_model_kwargs(response_provider))
+    
+    # The backend caps the reformulation output and summarizes history with an uncapped twin
+    reformulate_spec = ModelSpec(reformulate_model, reformulate_provider, reformulate_temp,
+                                 registry.get_model_kwargs(reformulate_provider))
+    
+    detector = lg_cp_bend.default_self_containment_detector if skip_standalone else None
+    return lg_cp_bend.build_chatbot_graph(response_spec, reformulate_spec, self_containment_detector=detector,
+                                          speculative=speculative)
 
-# Clear the cached graph when any model changes
-if (st.session_state.selected_model != st.session_state.previous_model or 
-    st.session_state.selected_provider != st.session_state.previous_provider or
-    st.session_state.reformulate_model != st.session_state.previous_reformulate_model or
-    st.session_state.reformulate_provider != st.session_state.previous_reformulate_provider or
-     st.session_state.selected_personality != st.session_state.previous_personality):
-    get_graph.clear()  # Clear the cached graph
-    st.session_state.previous_model = st.session_state.selected_model
-    st.session_state.previous_provider = st.session_state.selected_provider
-    st.session_state.previous_reformulate_model = st.session_state.reformulate_model
-    st.session_state.previous_reformulate_provider = st.session_state.reformulate_provider
     
 # Display the selected models and providers at the top of the page
-response_model_display = registry.get_model_display_name(st.session_state.selected_provider, st.session_state.selected_model)
-context_model_display = registry.get_model_display_name(st.session_state.reformulate_provider, st.session_state.reformulate_model)
+response_model_display = snapshot.display_name(st.session_state.selected_provider, st.session_state.selected_model)
+context_model_display = snapshot.display_name(st.session_state.reformulate_provider, st.session_state.reformulate_model)
 
 if st.session_state.selected_personality:
     st.markdown(f'''
@@ -399,8 +416,14 @@ if "messages" not in st.session_state:
 if "thread_id" not in st.session_state:
     st.session_state.thread_id = str(uuid.uuid4())
 
-# Set the configuration for the graph
-config = {"configurable": {"thread_id": st.session_state.thread_id}}
+# Set the configuration for the graph; the personality picks the system prompt for this run
+config = {"configurable": {"thread_id": st.session_state.thread_id,
+                           "personality": st.session_state.selected_personality,
+                           # Per-model prompt token budgets from the registry (None = backend default)
+                           "token_budget": snapshot.token_budget(st.session_state.selected_provider,
+                                                                 st.session_state.selected_model),
+                           "reformulate_token_budget": snapshot.token_budget(st.session_state.reformulate_provider,
+                                                                             st.session_state.reformulate_model)}}
 
 # Display the entire chat history from session state
 for message in st.session_state.messages:
@@ -419,15 +442,20 @@ if prompt := st.chat_input("💬 Ask me anything..."):
                 st.session_state.selected_provider,
                 st.session_state.selected_temperature,
                 st.session_state.reformulate_model,
-                st.session_state.reformulate_provider)
+                st.session_state.reformulate_provider,
+                st.session_state.reformulate_temperature,
+                st.session_state.get("speculative", False),
+                st.session_state.get("skip_standalone", False))
         
         # The checkpointer in the graph will load the previous messages for the given thread_id
         try:
-            events = graph.stream(
+            # The generation runs as a task on the shared serving loop; tokens are handed back here
+            events = async_serving.get_serving_loop().iterate(lg_cp_bend.astream_response_tokens(
+                graph,
                 {"messages": [("user", prompt)]},
                 config=config,
-                stream_mode="updates"
-            )
+                include_status=True
+            ))
         except Exception as e:
             st.error(f"Error invoking the model: {e}")
             st.stop()
@@ -437,17 +465,23 @@ if prompt := st.chat_input("💬 Ask me anything..."):
             placeholder = st.empty()
             full_response = ""
             
-            for chunk in events:
-                # Only process updates from the chatbot node
-                if "chatbot" in chunk and "messages" in chunk["chatbot"]:
-                    messages = chunk["chatbot"]["messages"]
-                    if messages:
-                        # Get the last message content
-                        message = messages[-1]
-                        if hasattr(message, 'content'):
-                            content = message.content
-                            full_response = content  # Replace, don't concatenate
-                            placeholder.markdown(full_response + "▌")
+            try:
+                # Tokens come only from the chatbot node; the reformulation stays hidden
+                for token in events:
+                    if isinstance(token, dict):
+                        # Queued behind other requests to the same provider
+                        if not full_response:
+                            placeholder.markdown(f"⏳ Waiting for {token['provider']} "
+                                                 f"(position {token['queue_position']} in queue)")
+                        continue
+                    full_response += token
+                    placeholder.markdown(full_response + "▌")
+            except Exception as e:
+                if rate_limiter.is_rate_limit_error(e):
+                    st.error("The provider is rate limiting requests right now. Please try again in a moment.")
+                else:
+                    st.error(f"Error invoking the model: {e}")
+                st.stop()
 
             # Clear the placeholder and render the final, formatted response
             placeholder.empty()
@@ -457,16 +491,11 @@ if prompt := st.chat_input("💬 Ask me anything..."):
             st.stop()
         
         if full_response:
-            # Check if response starts with thinking tags (more reliable for thinking models)
-            thinking_match = re.match(r'^<(think|reasoning|thought|analysis|internal)>(.*?)</\1>(.*)', 
-                                    full_response, flags=re.DOTALL)
+            # The streamed text still has the reasoning block; the backend stored only the answer
+            thinking_content, actual_response = split_reasoning(full_response)
             
-            if thinking_match:
-                # Extract thinking content and actual response
-                thinking_content = thinking_match.group(2).strip()
-                actual_response = thinking_match.group(3).strip()
-            
-            # Display thinking part in expander
+            if thinking_content:
+                # Display thinking part in expander
                 with st.expander("🧠 AI's Thought Process", expanded=False):
                     st.markdown(f'<div class="thinking-content">{thinking_content}</div>', unsafe_allow_html=True)
                 
@@ -475,7 +504,6 @@ if prompt := st.chat_input("💬 Ask me anything..."):
             else:
                 # No thinking tags at start, display full response
                 st.markdown(full_response)
-                actual_response = full_response
             
             st.session_state.messages.append({"role": "assistant", "content": actual_response})
 
@@ -542,6 +570,40 @@ with st.sidebar:
         except Exception as e:
             st.error(f"Error creating PDF: {e}")
     
+    bypass = lg_cp_bend.bypass_stats.snapshot()
+    if st.session_state.get("skip_standalone") and (bypass["bypassed"] or bypass["reformulated"]):
+        st.caption(f"⚡ Reformulation skipped {bypass['bypassed']} of {bypass['bypassed'] + bypass['reformulated']} "
+                   f"follow-ups (~{bypass['estimated_seconds_saved']:.1f}s saved)")
+    reformulation_stats = lg_cp_bend.reformulation_cache.stats()
+    if reformulation_stats["hits"] or reformulation_stats["misses"]:
+        st.caption(f"♻️ Reformulation cache hit rate: {reformulation_stats['hit_rate']:.0%} "
+                   f"({reformulation_stats['hits']} hits)")
+    
+    speculation = lg_cp_bend.speculation_stats.snapshot()
+    if speculation["wins"] or speculation["losses"]:
+        st.caption(f"🏎️ Speculation won {speculation['wins']} of {speculation['wins'] + speculation['losses']} "
+                   f"(saved p50 {speculation['p50_seconds_saved']:.1f}s, p95 {speculation['p95_seconds_saved']:.1f}s)")
+    
+    response_cache_stats = response_cache.shared_response_cache.stats()
+    st.caption(f"💾 Response cache hits: {response_cache_stats['hits']}")
+    for provider, limiter_stats in rate_limiter.shared_limiters.stats().items():
+        if limiter_stats["waited"] or limiter_stats["rate_limited"]:
+            st.caption(f"🚦 {provider}: {limiter_stats['waited']} queued "
+                       f"(avg {limiter_stats['avg_wait_seconds']:.1f}s), {limiter_stats['rate_limited']} rate limited")
+    for provider, key_stats in api_key_pool.shared_key_pools.stats().items():
+        if len(key_stats) > 1:
+            st.caption(f"🔑 {provider} keys: " + ", ".join(
+                f"{key_id} {usage['requests']}" + (" (paused)" if usage["disabled_seconds"] else "")
+                for key_id, usage in key_stats.items()))
+    if isinstance(lg_cp_bend.shared_checkpointer, BoundedMemorySaver):
+        checkpoint_stats = lg_cp_bend.shared_checkpointer.stats()
+        st.caption(f"🗄️ Conversation memory: {checkpoint_stats['bytes'] / 1e6:.1f} MB "
+                   f"across {checkpoint_stats['threads']} threads")
+    if semantic_cache.shared_semantic_cache is not None:
+        semantic_stats = semantic_cache.shared_semantic_cache.stats()
+        st.caption(f"🧭 Semantic cache hits: {semantic_stats['hits']} "
+                   f"({semantic_stats['entries']} cached answers)")
+    
     # Load saved conversations section
     st.markdown('<div class="sidebar-section">📂 Saved Conversations</div>', unsafe_allow_html=True)
     
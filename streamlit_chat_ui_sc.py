@@ -1,11 +1,17 @@
 import streamlit as st
 import lg_sc_bend
+import async_serving
 import re
 import os
 from datetime import datetime
-from langchain.chat_models import init_chat_model
+from llm_pool import ModelSpec
 import uuid
 import register_model as rm
+import api_key_pool
+import rate_limiter
+import response_cache
+from reasoning import split_reasoning
+from bounded_checkpointer import BoundedMemorySaver
 import json
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
@@ -14,7 +20,7 @@ from reportlab.lib.units import inch
 import io
 
 
-registry = rm.ModelRegistry()
+registry = rm.get_registry()
 
 def save_conversation(messages, thread_id, title=None):
     """Save conversation to a JSON file"""
@@ -276,38 +282,37 @@ if "selected_temperature" not in st.session_state:
     st.session_state.selected_temperature = 0.5
 if "selected_personality" not in st.session_state:
     st.session_state.selected_personality = None
-if "previous_model" not in st.session_state:
-    st.session_state.previous_model = st.session_state.selected_model
-if "previous_provider" not in st.session_state:
-    st.session_state.previous_provider = st.session_state.selected_provider
-if "previous_personality" not in st.session_state:
-    st.session_state.previous_personality = st.session_state.selected_personality
+if "session_id" not in st.session_state:
+    # Identifies this browser session to the shared graph cache
+    st.session_state.session_id = str(uuid.uuid4())
+
+# Everything the sidebar renders comes from one registry snapshot per rerun
+snapshot = registry.snapshot()
 
 with st.sidebar:
     st.markdown('<div class="sidebar-section">🎭 Personality</div>', unsafe_allow_html=True)
     # Get list of all personalities
-    personalities = registry.get_all_personalities()
+    personalities = snapshot.personality_names
     if personalities:
         st.session_state.selected_personality = st.selectbox("Choose AI Personality", 
-                                                              [p[0] for p in personalities],
+                                                              list(personalities),
                                                               index=None, key="personality_select",
                                                               help="Select a personality to customize the AI's behavior")
     st.markdown('<div class="sidebar-section">🔧 Model Configuration</div>', unsafe_allow_html=True)
-    providers = registry.get_all_providers()
+    providers = snapshot.providers
     if not providers:
         st.error("No providers registered. Please register a model first.")
-    st.session_state.selected_provider = st.selectbox("🏢 Provider",[p[0] for p in providers],
+    st.session_state.selected_provider = st.selectbox("🏢 Provider", list(providers),
                                                         index=0, key="provider_select")
     if st.session_state.selected_provider:
-        models = registry.get_models_by_provider(st.session_state.selected_provider)
+        models = snapshot.models_for(st.session_state.selected_provider)
         st.session_state.selected_model = st.selectbox("🧠 Model", [m[0] for m in models],
                                                         index=0, key="model_select")
         if st.session_state.selected_model:
             try:
-                api_key = registry.get_api_key(st.session_state.selected_provider)
-                env_var_name = registry.get_api_env_name(st.session_state.selected_provider)
-                if api_key and env_var_name:
-                    api_key = os.environ[f'{env_var_name}'] = f"{api_key}"
+                # Resolve the API key from the key vault so configuration problems
+                # surface here; the key is handed to the model in get_graph
+                registry.get_api_key(st.session_state.selected_provider)
             except Exception as e:
                 st.error(f"Configuration error: {e}")
                 st.stop()
@@ -316,26 +321,22 @@ with st.sidebar:
         else:
             st.error("Unable to initilize the model. Please check the log.")
 
-# Cache the graph so it's not rebuilt on every run.
-# This preserves the conversation history in the graph's memory.
-@st.cache_resource
+# Cache the graph so it's not rebuilt on every run. Graphs are keyed by model
+# configuration only and shared between sessions; the personality is passed per run
+# in the graph config. Switching models only evicts the graph this session left
+# behind, and conversation history lives in the backend's shared checkpointer.
 def get_graph(model_name, provider, temperature):
-    # Update the model inside the cached function
-    lg_sc_bend.llm = init_chat_model(model_name,
-                               model_provider=provider,
-                               temperature=temperature)
-    return lg_sc_bend.build_chatbot_graph(st.session_state.selected_personality)
+    return lg_sc_bend.graph_cache.acquire(st.session_state.session_id, (model_name, provider, temperature),
+                                          lambda: build_graph(model_name, provider, temperature))
+
+def build_graph(model_name, provider, temperature):
+    # The model instance comes from the shared LLM pool, so its HTTP client is reused
+    return lg_sc_bend.build_chatbot_graph(
+        ModelSpec(model_name, provider, temperature, registry.get_model_kwargs(provider)))
 
-# Clear the cached graph when model changes
-if (st.session_state.selected_model != st.session_state.previous_model or 
-    st.session_state.selected_provider != st.session_state.previous_provider or
-    st.session_state.selected_personality != st.session_state.previous_personality):
-    get_graph.clear()  # Clear the cached graph
-    st.session_state.previous_model = st.session_state.selected_model
-    st.session_state.previous_provider = st.session_state.selected_provider
     
 # Display the selected model and provider at the top of the page
-model_display_name = registry.get_model_display_name(st.session_state.selected_provider, st.session_state.selected_model)
+model_display_name = snapshot.display_name(st.session_state.selected_provider, st.session_state.selected_model)
 if st.session_state.selected_personality:
     st.markdown(f'''
     <div class="model-header">
@@ -356,8 +357,12 @@ if "messages" not in st.session_state:
 if "thread_id" not in st.session_state:
     st.session_state.thread_id = str(uuid.uuid4())
 
-# Set the configuration for the graph
-config = {"configurable": {"thread_id": st.session_state.thread_id}}
+# Set the configuration for the graph; the personality picks the system prompt for this run
+config = {"configurable": {"thread_id": st.session_state.thread_id,
+                           "personality": st.session_state.selected_personality,
+                           # Per-model prompt token budget from the registry (None = backend default)
+                           "token_budget": snapshot.token_budget(st.session_state.selected_provider,
+                                                                 st.session_state.selected_model)}}
 
 # Display the entire chat history from session state
 for message in st.session_state.messages:
@@ -378,11 +383,13 @@ if prompt := st.chat_input("💬 Ask me anything..."):
         
         # The checkpointer in the graph will load the previous messages for the given thread_id
         try:
-            events = graph.stream(
+            # The generation runs as a task on the shared serving loop; tokens are handed back here
+            events = async_serving.get_serving_loop().iterate(lg_sc_bend.astream_response_tokens(
+                graph,
                 {"messages": [("user", prompt)]},
                 config=config,
-                stream_mode="messages"
-            )
+                include_status=True
+            ))
         except Exception as e:
             st.error(f"Error invoking the model: {e}")
             st.stop()
@@ -391,11 +398,23 @@ if prompt := st.chat_input("💬 Ask me anything..."):
         if events:
             placeholder = st.empty()
             full_response = ""
-            for chunk in events:
-                # The stream yields lists of message chunks. We get the content from the first one.
-                content = chunk[0].content if chunk else ""
-                full_response += content
-                placeholder.markdown(full_response + "▌")
+            
+            try:
+                for token in events:
+                    if isinstance(token, dict):
+                        # Queued behind other requests to the same provider
+                        if not full_response:
+                            placeholder.markdown(f"⏳ Waiting for {token['provider']} "
+                                                 f"(position {token['queue_position']} in queue)")
+                        continue
+                    full_response += token
+                    placeholder.markdown(full_response + "▌")
+            except Exception as e:
+                if rate_limiter.is_rate_limit_error(e):
+                    st.error("The provider is rate limiting requests right now. Please try again in a moment.")
+                else:
+                    st.error(f"Error invoking the model: {e}")
+                st.stop()
 
             # Clear the placeholder and render the final, formatted response
             placeholder.empty()
@@ -405,16 +424,11 @@ if prompt := st.chat_input("💬 Ask me anything..."):
             st.stop()
         
         if full_response:
-            # Check if response starts with thinking tags (more reliable for thinking models)
-            thinking_match = re.match(r'^<(think|reasoning|thought|analysis|internal)>(.*?)</\1>(.*)', 
-                                    full_response, flags=re.DOTALL)
+            # The streamed text still has the reasoning block; the backend stored only the answer
+            thinking_content, actual_response = split_reasoning(full_response)
             
-            if thinking_match:
-                # Extract thinking content and actual response
-                thinking_content = thinking_match.group(2).strip()
-                actual_response = thinking_match.group(3).strip()
-            
-            # Display thinking part in expander
+            if thinking_content:
+                # Display thinking part in expander
                 with st.expander("🧠 AI's Thought Process", expanded=False):
                     st.markdown(f'<div class="thinking-content">{thinking_content}</div>', unsafe_allow_html=True)
                 
@@ -423,7 +437,6 @@ if prompt := st.chat_input("💬 Ask me anything..."):
             else:
                 # No thinking tags at start, display full response
                 st.markdown(full_response)
-                actual_response = full_response
             
             st.session_state.messages.append({"role": "assistant", "content": actual_response})
 
@@ -490,6 +503,22 @@ with st.sidebar:
         except Exception as e:
             st.error(f"Error creating PDF: {e}")
     
+    response_cache_stats = response_cache.shared_response_cache.stats()
+    st.caption(f"💾 Response cache hits: {response_cache_stats['hits']}")
+    for provider, limiter_stats in rate_limiter.shared_limiters.stats().items():
+        if limiter_stats["waited"] or limiter_stats["rate_limited"]:
+            st.caption(f"🚦 {provider}: {limiter_stats['waited']} queued "
+                       f"(avg {limiter_stats['avg_wait_seconds']:.1f}s), {limiter_stats['rate_limited']} rate limited")
+    for provider, key_stats in api_key_pool.shared_key_pools.stats().items():
+        if len(key_stats) > 1:
+            st.caption(f"🔑 {provider} keys: " + ", ".join(
+                f"{key_id} {usage['requests']}" + (" (paused)" if usage["disabled_seconds"] else "")
+                for key_id, usage in key_stats.items()))
+    if isinstance(lg_sc_bend.shared_checkpointer, BoundedMemorySaver):
+        checkpoint_stats = lg_sc_bend.shared_checkpointer.stats()
+        st.caption(f"🗄️ Conversation memory: {checkpoint_stats['bytes'] / 1e6:.1f} MB "
+                   f"across {checkpoint_stats['threads']} threads")
+    
     # Load saved conversations section
     st.markdown('<div class="sidebar-section">📂 Saved Conversations</div>', unsafe_allow_html=True)
     
@@ -0,0 +1,62 @@
+import time
+
+from api_key_pool import KeyPool, KeyPools
+
+KEYS = [(1, "sk-one"), (2, "sk-two"), (3, "sk-three")]
+
+
+def take(pool):
+    key_id, _ = pool.checkout()
+    pool.checkin(key_id)
+    return key_id
+
+
+def test_light_traffic_rotates_round_robin():
+    pool = KeyPool("openai", KEYS)
+    assert [take(pool) for _ in range(6)] == [1, 2, 3, 1, 2, 3]
+
+
+def test_least_in_flight_key_is_picked():
+    pool = KeyPool("openai", KEYS[:2])
+    first, _ = pool.checkout()
+    second, _ = pool.checkout()
+    assert {first, second} == {1, 2}
+    pool.checkin(second)
+    # The other key is still busy, so the freed one is picked whatever the rotation says
+    assert pool.checkout()[0] == second
+
+
+def test_rate_limited_key_sits_out_its_cooldown():
+    pool = KeyPool("openai", KEYS[:2])
+    key_id, _ = pool.checkout()
+    pool.checkin(key_id, rate_limited=True, retry_after=0.05)
+    assert pool.available() == 1
+    assert {take(pool) for _ in range(4)} == {3 - key_id}
+    time.sleep(0.06)
+    assert pool.available() == 2
+    assert key_id in {take(pool) for _ in range(2)}
+
+
+def test_all_keys_cooling_down_uses_the_one_back_soonest():
+    pool = KeyPool("openai", KEYS[:2])
+    pool.checkin(pool.checkout()[0], rate_limited=True, retry_after=60)
+    soonest, _ = pool.checkout()
+    pool.checkin(soonest, rate_limited=True, retry_after=1)
+    assert pool.checkout()[0] == soonest
+
+
+def test_stats_identify_keys_by_fingerprint_only():
+    pool = KeyPool("openai", KEYS)
+    take(pool)
+    stats = pool.stats()
+    assert stats[1]["requests"] == 1
+    assert "sk-one" not in str(stats)
+
+
+def test_pools_are_refreshed_from_the_registry():
+    keys = {"openai": KEYS[:1]}
+    pools = KeyPools(keys=lambda provider: keys[provider], refresh_seconds=0)
+    pool = pools.get("openai")
+    keys["openai"] = KEYS
+    assert pools.get("openai") is pool
+    assert pool.available() == 3
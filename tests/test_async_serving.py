@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from async_serving import AsyncServingLoop
+
+
+@pytest.fixture
+def serving_loop():
+    serving_loop = AsyncServingLoop(max_concurrency=4)
+    yield serving_loop
+    serving_loop.close()
+
+
+def test_items_are_handed_to_the_calling_thread(serving_loop):
+    threads = set()
+
+    async def numbers():
+        for number in range(3):
+            threads.add(threading.current_thread())
+            await asyncio.sleep(0)
+            yield number
+
+    assert list(serving_loop.iterate(numbers())) == [0, 1, 2]
+    assert threads == {serving_loop._thread}
+    assert serving_loop.stats()["completed"] == 1
+
+
+def test_errors_are_reraised_in_the_calling_thread(serving_loop):
+    async def failing():
+        yield 1
+        raise RuntimeError("model went away")
+
+    items = serving_loop.iterate(failing())
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="model went away"):
+        next(items)
+    assert serving_loop.stats()["failed"] == 1
+
+
+def test_closing_early_cancels_the_task(serving_loop):
+    cancelled = threading.Event()
+
+    async def endless():
+        try:
+            while True:
+                yield "token"
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    items = serving_loop.iterate(endless())
+    assert next(items) == "token"
+    items.close()
+    assert cancelled.wait(timeout=2)
+
+
+def test_concurrency_is_capped(serving_loop):
+    async def slow():
+        await asyncio.sleep(0.02)
+
+    futures = [serving_loop.submit(slow()) for _ in range(10)]
+    for future in futures:
+        future.result(timeout=5)
+    assert serving_loop.stats()["peak"] == 4
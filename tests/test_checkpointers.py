@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+from typing import Annotated
+
+import pytest
+from typing_extensions import TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+from bounded_checkpointer import BoundedMemorySaver
+from sqlite_checkpointer import SQLiteCheckpointer
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def echo_graph(checkpointer):
+    builder = StateGraph(State)
+    builder.add_node("echo", lambda state: {"messages": [AIMessage(content=f"echo {len(state['messages'])}")]})
+    builder.add_edge(START, "echo")
+    builder.add_edge("echo", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def chat(graph, thread_id, turns=1):
+    config = {"configurable": {"thread_id": thread_id}}
+    for turn in range(turns):
+        graph.invoke({"messages": [HumanMessage(content=f"turn {turn}")]}, config)
+    return config
+
+
+def history(graph, config):
+    return [m.content for m in graph.get_state(config).values["messages"]]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def checkpointer(request, tmp_path):
+    if request.param == "memory":
+        return BoundedMemorySaver(keep_last=3)
+    return SQLiteCheckpointer(str(tmp_path / "checkpoints.db"), keep_last=3)
+
+
+def test_only_the_newest_checkpoints_are_kept(checkpointer):
+    graph = echo_graph(checkpointer)
+    config = chat(graph, "thread", turns=4)
+    assert len(list(checkpointer.list(config))) == 3
+    # Pruning never loses the conversation itself
+    assert history(graph, config) == ["turn 0", "echo 1", "turn 1", "echo 3", "turn 2", "echo 5",
+                                      "turn 3", "echo 7"]
+
+
+def test_budget_evicts_least_recently_used_threads():
+    saver = BoundedMemorySaver(max_bytes=1)
+    graph = echo_graph(saver)
+    chat(graph, "old")
+    chat(graph, "new")
+    assert list(saver.thread_memory()) == ["new"]
+    assert saver.stats()["bytes"] == saver.thread_memory()["new"]
+    assert saver.stats()["evictions"] >= 1
+
+
+def test_evicted_threads_spill_and_rehydrate(tmp_path):
+    saver = BoundedMemorySaver(max_bytes=1, spill_dir=str(tmp_path / "spill"))
+    graph = echo_graph(saver)
+    old = chat(graph, "old", turns=2)
+    chat(graph, "new")
+    assert os.listdir(tmp_path / "spill")
+    assert history(graph, old) == ["turn 0", "echo 1", "turn 1", "echo 3"]
+    assert saver.stats()["rehydrations"] == 1
+
+
+def test_async_spill_and_rehydrate(tmp_path):
+    saver = BoundedMemorySaver(max_bytes=1, spill_dir=str(tmp_path / "spill"))
+    graph = echo_graph(saver)
+
+    async def run():
+        old = {"configurable": {"thread_id": "old"}}
+        await graph.ainvoke({"messages": [HumanMessage(content="turn 0")]}, old)
+        await graph.ainvoke({"messages": [HumanMessage(content="turn 0")]}, {"configurable": {"thread_id": "new"}})
+        return [m.content for m in (await graph.aget_state(old)).values["messages"]]
+
+    assert asyncio.run(run()) == ["turn 0", "echo 1"]
+    assert saver.stats()["rehydrations"] == 1
+
+
+def test_idle_sqlite_threads_are_pruned(tmp_path):
+    saver = SQLiteCheckpointer(str(tmp_path / "checkpoints.db"))
+    graph = echo_graph(saver)
+    chat(graph, "idle")
+    time.sleep(0.05)
+    active = chat(graph, "active")
+    assert saver.prune_idle_threads(max_idle_seconds=0.03) == 1
+    assert saver.stats()["threads"] == 1
+    assert history(graph, active) == ["turn 0", "echo 1"]
+    assert saver.prune_idle_threads() == 0
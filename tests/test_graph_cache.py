@@ -0,0 +1,54 @@
+import time
+
+from graph_cache import GraphCache
+
+
+def _tracking_cache(**kwargs):
+    evicted = []
+    cache = GraphCache(on_evict=lambda key, graph: evicted.append(key), **kwargs)
+    return cache, evicted
+
+
+def test_switching_configuration_evicts_unused_graph():
+    cache, evicted = _tracking_cache()
+    cache.acquire("s1", ("a",), lambda: "graph-a")
+    cache.acquire("s1", ("b",), lambda: "graph-b")
+    assert evicted == [("a",)]
+    assert len(cache) == 1
+
+
+def test_shared_graph_kept_while_another_session_uses_it():
+    cache, evicted = _tracking_cache()
+    cache.acquire("s1", ("a",), lambda: "graph-a")
+    cache.acquire("s2", ("a",), lambda: "graph-a2")
+    cache.acquire("s1", ("b",), lambda: "graph-b")
+    assert evicted == []
+    cache.release("s2")
+    assert evicted == [("a",)]
+
+
+def test_reacquiring_same_configuration_keeps_one_reference():
+    cache, evicted = _tracking_cache()
+    for _ in range(3):
+        assert cache.acquire("s1", ("a",), lambda: object()) is cache.acquire("s1", ("a",), lambda: object())
+    cache.release("s1")
+    assert evicted == [("a",)]
+    assert cache.stats()["sessions"] == 0
+
+
+def test_sessions_are_bounded():
+    cache, evicted = _tracking_cache(max_sessions=2)
+    cache.acquire("s1", ("a",), lambda: "graph-a")
+    cache.acquire("s2", ("b",), lambda: "graph-b")
+    cache.acquire("s3", ("b",), lambda: "graph-b")
+    assert evicted == [("a",)]
+    assert cache.stats()["sessions"] == 2
+
+
+def test_idle_sessions_expire():
+    cache, evicted = _tracking_cache(session_ttl=0.05)
+    cache.acquire("s1", ("a",), lambda: "graph-a")
+    time.sleep(0.1)
+    cache.acquire("s2", ("b",), lambda: "graph-b")
+    assert evicted == [("a",)]
+    assert cache.stats()["sessions"] == 1
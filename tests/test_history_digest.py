@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import wait
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from history_digest import HistoryCompactor
+
+TURNS = [f"User: question {i}" if i % 2 == 0 else f"Assistant: answer {i}" for i in range(14)]
+
+
+def reasoning_model(content, **response_metadata):
+    return GenericFakeChatModel(messages=iter([AIMessage(content=content, response_metadata=response_metadata)]))
+
+
+def compact(compactor, llm):
+    compactor.schedule("thread", "", TURNS, compactor.summarize_with(llm))
+    wait([compactor._pending["thread"][0]])
+    return compactor.fold("thread", "", TURNS)
+
+
+@pytest.fixture
+def compactor():
+    return HistoryCompactor(max_lines=12, keep_lines=6)
+
+
+def test_reasoning_is_stripped_from_the_summary(compactor):
+    llm = reasoning_model("<think>The user asked several questions...</think>\nThe user asked seven questions.")
+    summary, turns, changed = compact(compactor, llm)
+    assert changed
+    assert summary == "The user asked seven questions."
+    assert turns == TURNS[-6:]
+
+
+@pytest.mark.parametrize("content", [
+    "<think>The user asked several questions and I should",
+    "<think>Only reasoning.</think>",
+    "   ",
+])
+def test_unusable_summaries_keep_the_original_turns(compactor, content):
+    summary, turns, changed = compact(compactor, reasoning_model(content))
+    assert not changed
+    assert summary == ""
+    assert turns == TURNS
+
+
+def test_truncated_summary_keeps_the_original_turns(compactor):
+    llm = reasoning_model("The user asked seven questions about", finish_reason="length")
+    summary, turns, changed = compact(compactor, llm)
+    assert not changed
+    assert turns == TURNS
+
+
+def test_unclaimed_summaries_expire():
+    compactor = HistoryCompactor(max_lines=12, keep_lines=6, pending_ttl=0.05)
+    compactor.schedule("abandoned", "", TURNS, lambda summary, lines: "summary")
+    wait([compactor._pending["abandoned"][0]])
+    time.sleep(0.1)
+    compactor.schedule("active", "", TURNS, lambda summary, lines: "summary")
+    compactor.fold("active", "", TURNS)
+    assert "abandoned" not in compactor._pending
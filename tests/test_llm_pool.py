@@ -0,0 +1,63 @@
+import time
+
+from llm_pool import LLMPool, ModelSpec, attach_pooled_models, key_fingerprint
+
+
+class FakeModel:
+    def __init__(self, model, **kwargs):
+        self.model = model
+        self.kwargs = kwargs
+
+
+def fake_pool(**kwargs):
+    return LLMPool(factory=lambda model, provider, temperature, **model_kwargs: FakeModel(model, **model_kwargs),
+                   **kwargs)
+
+
+SPEC = ModelSpec("gpt", "openai", 0.0, {"api_key": "sk-one"})
+
+
+def test_same_spec_shares_one_instance():
+    pool = fake_pool()
+    first = pool.acquire(SPEC)
+    assert pool.acquire(ModelSpec("gpt", "OpenAI", 0.0, {"api_key": "sk-one"})) is first
+    assert pool.stats()["created"] == 1 and pool.stats()["reused"] == 1
+    assert pool.spec_of(first) == SPEC
+
+
+def test_different_keys_get_different_instances():
+    pool = fake_pool()
+    assert pool.acquire(SPEC) is not pool.acquire(ModelSpec("gpt", "openai", 0.0, {"api_key": "sk-two"}))
+
+
+def test_instances_stay_while_referenced():
+    pool = fake_pool(idle_ttl=0)
+    instance = pool.acquire(SPEC)
+    pool.acquire(SPEC)
+    pool.release(instance)
+    pool.evict_idle()
+    assert pool.stats()["in_use"] == 1
+    pool.release(instance)
+    time.sleep(0.01)
+    pool.evict_idle()
+    assert pool.stats()["instances"] == 0 and pool.stats()["evicted"] == 1
+    assert pool.spec_of(instance) is None
+
+
+def test_recently_released_instances_are_reused():
+    pool = fake_pool(idle_ttl=60)
+    instance = pool.acquire(SPEC)
+    pool.release(instance)
+    assert pool.acquire(SPEC) is instance
+
+
+def test_releasing_unknown_instances_is_ignored():
+    pool = fake_pool()
+    pool.release(FakeModel("stranger"))
+    pool.release(attach_pooled_models(type("Graph", (), {})(), []))
+    assert pool.stats()["instances"] == 0
+
+
+def test_key_fingerprint_hides_the_key():
+    assert key_fingerprint("sk-one") != "sk-one" and len(key_fingerprint("sk-one")) == 16
+    assert key_fingerprint(None) is None
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import rate_limiter
+from api_key_pool import KeyPools
+from llm_pool import LLMPool, ModelSpec
+from rate_limiter import ProviderLimiter, RateLimiters, is_rate_limit_error
+
+
+def test_waits_are_counted_without_a_callback():
+    limiter = ProviderLimiter("test", max_concurrency=1)
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    time.sleep(0.05)
+    limiter.release()
+    waiter.join(timeout=2)
+    stats = limiter.stats()
+    assert stats["waited"] == 1
+    assert stats["avg_wait_seconds"] > 0
+
+
+class HTTPError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeClient:
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def invoke(self, messages, config=None, **kwargs):
+        if self.api_key == "sk-revoked":
+            raise HTTPError("invalid api key", status_code=401)
+        return AIMessage(content=f"answered with {self.api_key}")
+
+
+def pooled_client(monkeypatch, api_key):
+    pool = LLMPool(factory=lambda model, provider, temperature, **kwargs: FakeClient(kwargs["api_key"]))
+    monkeypatch.setattr(rate_limiter, "llm_pool", pool)
+    return pool.acquire(ModelSpec("model", "openai", kwargs={"api_key": api_key}))
+
+
+def test_rejected_key_is_retried_on_another_key(monkeypatch):
+    llm = pooled_client(monkeypatch, "sk-revoked")
+    key_pools = KeyPools(keys=lambda provider: [(0, "sk-revoked"), (1, "sk-valid")])
+    response = rate_limiter.invoke(llm, [HumanMessage(content="hi")], limiters=RateLimiters(limits=lambda p: {}),
+                                   key_pools=key_pools)
+    assert response.content == "answered with sk-valid"
+    assert key_pools.get("openai").stats()[0]["unauthorized"] == 1
+
+
+def test_rejected_only_key_raises(monkeypatch):
+    llm = pooled_client(monkeypatch, "sk-revoked")
+    key_pools = KeyPools(keys=lambda provider: [(0, "sk-revoked")])
+    with pytest.raises(HTTPError):
+        rate_limiter.invoke(llm, [HumanMessage(content="hi")], limiters=RateLimiters(limits=lambda p: {}),
+                            key_pools=key_pools)
+    assert key_pools.get("openai").stats()[0]["requests"] == 1
+
+
+def test_rate_limit_errors_are_recognised_by_status_code_only():
+    assert is_rate_limit_error(HTTPError("slow down", status_code=429))
+    assert not is_rate_limit_error(HTTPError("order 4291 not found", status_code=404))
+    assert not is_rate_limit_error(ValueError("request 429 failed"))
+
+
+def run_callers(limiter, count, hold=0.02):
+    peak = [0]
+    lock = threading.Lock()
+
+    def call():
+        with limiter.slot():
+            with lock:
+                peak[0] = max(peak[0], limiter.in_flight)
+            time.sleep(hold)
+
+    callers = [threading.Thread(target=call) for _ in range(count)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(timeout=5)
+    return peak[0]
+
+
+def test_concurrency_is_capped():
+    limiter = ProviderLimiter("test", max_concurrency=2)
+    assert run_callers(limiter, 6) == 2
+    assert limiter.stats()["admitted"] == 6
+    assert limiter.in_flight == 0
+
+
+def test_callers_are_admitted_in_arrival_order():
+    limiter = ProviderLimiter("test", max_concurrency=1)
+    limiter.acquire()
+    admitted = []
+
+    def call(index):
+        with limiter.slot():
+            admitted.append(index)
+
+    callers = []
+    for index in range(5):
+        callers.append(threading.Thread(target=call, args=(index,)))
+        callers[-1].start()
+        # Wait until this caller is queued before the next one arrives
+        while len(limiter._queue) < index + 1:
+            time.sleep(0.001)
+    limiter.release()
+    for caller in callers:
+        caller.join(timeout=5)
+    assert admitted == [0, 1, 2, 3, 4]
+
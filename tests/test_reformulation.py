@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+import lg_cp_bend
+from llm_pool import LLMPool, ModelSpec
+
+STATE = {"messages": [HumanMessage(content="Tell me about the Eiffel Tower."),
+                      AIMessage(content="It is a lattice tower in Paris."),
+                      HumanMessage(content="When was it finished?")]}
+CONFIG = {"configurable": {"thread_id": "reformulation-test"}}
+
+
+def fake_model(content, **response_metadata):
+    return GenericFakeChatModel(messages=iter([AIMessage(content=content, response_metadata=response_metadata)]))
+
+
+def run_context_processor(llm):
+    lg_cp_bend.configure_reformulation_cache()
+    return lg_cp_bend.create_context_processor(llm).invoke(STATE, CONFIG)
+
+
+def test_usable_reformulation_is_cached():
+    result = run_context_processor(fake_model("When was the Eiffel Tower finished?"))
+    assert result["reformulated_question"] == "When was the Eiffel Tower finished?"
+    assert lg_cp_bend.reformulation_cache.stats()["entries"] == 1
+
+
+def test_truncated_reformulation_falls_back_uncached():
+    result = run_context_processor(fake_model("When was the Eiffel", finish_reason="length"))
+    assert result["reformulated_question"] == "When was it finished?"
+    assert lg_cp_bend.reformulation_cache.stats()["entries"] == 0
+
+
+def test_unusable_reformulation_falls_back_uncached():
+    result = run_context_processor(fake_model("<think>The user refers to the tower, so"))
+    assert result["reformulated_question"] == "When was it finished?"
+    assert lg_cp_bend.reformulation_cache.stats()["entries"] == 0
+
+
+def test_summaries_use_an_uncapped_model(monkeypatch):
+    created = []
+    pool = LLMPool(factory=lambda model, provider, temperature, **kwargs: created.append(kwargs) or fake_model("ok"))
+    monkeypatch.setattr(lg_cp_bend, "llm_pool", pool)
+    lg_cp_bend.build_chatbot_graph(ModelSpec("answer", "openai"), ModelSpec("rewrite", "openai"),
+                                   checkpointer=False)
+    assert {"max_tokens": lg_cp_bend.REFORMULATION_MAX_TOKENS} in created
+    # The summary model and the response model carry no cap
+    assert created.count({}) == 2
+
+
+def test_async_reformulation_keeps_blocking_steps_off_the_event_loop(monkeypatch):
+    lg_cp_bend.configure_reformulation_cache()
+    threads = []
+    real_put = lg_cp_bend.reformulation_cache.put
+    monkeypatch.setattr(lg_cp_bend.reformulation_cache, "put",
+                        lambda *args: threads.append(threading.current_thread()) or real_put(*args))
+    node = lg_cp_bend.create_context_processor(fake_model("When was the Eiffel Tower finished?"))
+
+    async def run():
+        return threading.current_thread(), await node.ainvoke(STATE, CONFIG)
+
+    loop_thread, result = asyncio.run(run())
+    assert result["reformulated_question"] == "When was the Eiffel Tower finished?"
+    assert threads and loop_thread not in threads
+
+
+def test_failed_build_releases_pooled_models(monkeypatch):
+    def factory(model, provider, temperature, **kwargs):
+        if model == "rewrite" and kwargs:
+            raise RuntimeError("unknown model")
+        return fake_model("ok")
+    pool = LLMPool(factory=factory)
+    monkeypatch.setattr(lg_cp_bend, "llm_pool", pool)
+    with pytest.raises(RuntimeError):
+        lg_cp_bend.build_chatbot_graph(ModelSpec("answer", "openai"), ModelSpec("rewrite", "openai"),
+                                       checkpointer=False)
+    assert pool.stats()["instances"] > 0 and pool.stats()["in_use"] == 0
+
+
+class StopRecordingModel:
+    def __init__(self):
+        self.kwargs = []
+
+    def invoke(self, messages, config=None, **kwargs):
+        self.kwargs.append(kwargs)
+        return AIMessage(content="When was the Eiffel Tower finished?")
+
+
+@pytest.mark.parametrize("stop, expected", [
+    (lg_cp_bend.REFORMULATION_STOP, {"stop": lg_cp_bend.REFORMULATION_STOP}),
+    (None, {}),
+])
+def test_stop_sequences_are_configurable(stop, expected):
+    lg_cp_bend.configure_reformulation_cache()
+    llm = StopRecordingModel()
+    lg_cp_bend.create_context_processor(llm, reformulation_stop=stop).invoke(STATE, CONFIG)
+    assert llm.kwargs == [expected]
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+
+import pytest
+from cryptography.fernet import Fernet, MultiFernet
+
+import register_model as rm
+
+
+@pytest.fixture
+def registry():
+    registry = rm.get_registry()
+    registry.register_config("openai", "sk-original", "OPENAI_API_KEY")
+    assert registry.get_api_key("openai") == "sk-original"
+    return registry
+
+
+def write_key_file(*keys):
+    with open(rm.DEFAULT_KEY_PATH, "wb") as key_file:
+        key_file.write(b"\n".join(keys))
+
+
+def reencrypt_stored_keys(cipher):
+    with sqlite3.connect(rm.DEFAULT_DB_PATH) as conn:
+        for provider, api in conn.execute("SELECT provider, api FROM config").fetchall():
+            conn.execute("UPDATE config SET api = ? WHERE provider = ?", (cipher.rotate(api), provider))
+
+
+def test_key_rotated_by_another_process_is_picked_up(registry):
+    old_key = open(rm.DEFAULT_KEY_PATH, "rb").read().strip()
+    new_key = Fernet.generate_key()
+    write_key_file(new_key, old_key)
+    reencrypt_stored_keys(MultiFernet([Fernet(new_key), Fernet(old_key)]))
+    # Values encrypted with only the new key force a reload of the key file
+    with sqlite3.connect(rm.DEFAULT_DB_PATH) as conn:
+        conn.execute("UPDATE config SET api = ? WHERE provider = 'openai'",
+                     (Fernet(new_key).encrypt(b"sk-original"),))
+    registry.clear_cache()
+    assert registry.get_api_key("openai") == "sk-original"
+    assert registry.get_model_kwargs("openai") == {"api_key": "sk-original"}
+
+
+def test_undecryptable_key_raises_instead_of_returning_ciphertext(registry):
+    # As after a restart with the wrong key file
+    write_key_file(Fernet.generate_key())
+    registry._vault.reload()
+    with pytest.raises(ValueError, match="can't be decrypted"):
+        registry.get_api_key("openai")
+    with pytest.raises(ValueError, match="can't be decrypted"):
+        registry.get_model_kwargs("openai")
+    with pytest.raises(ValueError, match="can't be decrypted"):
+        registry.get_api_key_pool("openai")
+
+
+def test_plain_text_keys_from_older_databases_still_load(registry):
+    with sqlite3.connect(rm.DEFAULT_DB_PATH) as conn:
+        conn.execute("UPDATE config SET api = 'sk-legacy' WHERE provider = 'openai'")
+    registry.clear_cache()
+    assert registry.get_api_key("openai") == "sk-legacy"
+    registry.rotate_encryption_key()
+    assert registry.get_api_key("openai") == "sk-legacy"
+
+
+@pytest.mark.parametrize("fmt", ["json", "csv"])
+def test_rate_limits_survive_an_export_import_round_trip(fmt):
+    source = rm.get_registry("source.db")
+    source.register_config("openai", "sk-original", "OPENAI_API_KEY")
+    source.set_rate_limits("openai", 4, 60, 90000)
+    # Providers without a configuration can be limited too
+    source.set_rate_limits("ollama", max_concurrency=2)
+    exported = source.export_registry(fmt, include_api_keys=True)
+
+    target = rm.get_registry("target.db")
+    diff = target.import_registry(exported, fmt)
+    assert sorted(diff["rate_limits"]["added"]) == ["ollama", "openai"]
+    assert target.get_rate_limits("openai") == {"max_concurrency": 4, "requests_per_minute": 60,
+                                                "tokens_per_minute": 90000}
+    assert target.get_rate_limits("ollama") == {"max_concurrency": 2, "requests_per_minute": None,
+                                                "tokens_per_minute": None}
+    # Limiting a provider doesn't create a keyless configuration
+    assert target.get_provider_configurations() == [("openai", "OPENAI_API_KEY")]
+    assert target.import_registry(exported, fmt)["rate_limits"]["unchanged"] == 2
+
+
+def test_clearing_rate_limits():
+    registry = rm.get_registry()
+    registry.set_rate_limits("ollama", max_concurrency=2)
+    registry.set_rate_limits("ollama")
+    assert registry.get_rate_limits("ollama") == {"max_concurrency": None, "requests_per_minute": None,
+                                                  "tokens_per_minute": None}
+
+
+@pytest.mark.parametrize("fmt", ["json", "csv"])
+def test_pool_keys_survive_an_export_import_round_trip(fmt):
+    source = rm.get_registry("source.db")
+    source.register_config("openai", "sk-primary", "OPENAI_API_KEY")
+    source.add_api_key("openai", "sk-second", "project a")
+    source.add_api_key("openai", "sk-third")
+    # Without the decrypted keys there is nothing to restore the pool from
+    assert '"api_keys": []' in source.export_registry("json")
+    exported = source.export_registry(fmt, include_api_keys=True)
+
+    target = rm.get_registry("target.db")
+    assert target.import_registry(exported, fmt)["api_keys"]["added"] == ["openai", "openai"]
+    assert target.get_api_key_pool("openai") == (("primary", "sk-primary"), ("1", "sk-second"), ("2", "sk-third"))
+    assert [label for _, label, _ in target.list_api_keys("openai")] == ["project a", ""]
+    # Importing again matches the existing keys instead of duplicating them
+    assert target.import_registry(exported, fmt)["api_keys"]["unchanged"] == 2
+
+
+def test_pool_keys_need_a_configuration():
+    registry = rm.get_registry()
+    with pytest.raises(ValueError, match="need a configuration"):
+        registry.import_registry({"api_keys": [{"provider": "openai", "api": "sk-second"}]})
+
+
+def test_rate_limits_leave_the_config_table_alone():
+    registry = rm.get_registry()
+    registry.set_rate_limits("anthropic", max_concurrency=2)
+    with sqlite3.connect(rm.DEFAULT_DB_PATH) as conn:
+        config_columns = {row[1] for row in conn.execute("PRAGMA table_info(config)")}
+        configs = conn.execute("SELECT COUNT(*) FROM config").fetchone()[0]
+    assert not config_columns & set(rm._RATE_LIMIT_COLUMNS)
+    assert configs == 0
+    assert registry.get_rate_limits("anthropic")["max_concurrency"] == 2
+
+
+def test_model_kwargs_use_the_provider_keyword(registry, monkeypatch):
+    registry.register_config("google_genai", "gk-secret", "GOOGLE_API_KEY")
+    assert registry.get_model_kwargs("google_genai") == {"google_api_key": "gk-secret"}
+    monkeypatch.setenv("AWS_BEARER_TOKEN_BEDROCK", "")
+    registry.register_config("bedrock", "bk-secret", "AWS_BEARER_TOKEN_BEDROCK")
+    # Chat models that only read the environment get the key through the configured variable
+    assert registry.get_model_kwargs("bedrock") == {}
+    assert os.environ["AWS_BEARER_TOKEN_BEDROCK"] == "bk-secret"
+
+
+def test_cached_lookups_hand_out_copies():
+    registry = rm.get_registry()
+    registry.set_rate_limits("openai", requests_per_minute=60)
+    registry.get_rate_limits("openai")["requests_per_minute"] = 1
+    assert registry.get_rate_limits("openai")["requests_per_minute"] == 60
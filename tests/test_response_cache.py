@@ -0,0 +1,50 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from response_cache import CachePolicy, ResponseCache
+
+MESSAGES = [HumanMessage(content="What is the boiling point of water?")]
+CONFIG = {"configurable": {"personality": "teacher"}, "tags": ["chat"]}
+
+
+class RecordingModel:
+    def __init__(self, temperature=0.0):
+        self.temperature = temperature
+        self.configs = []
+
+    def invoke(self, messages, config=None, **kwargs):
+        self.configs.append(config)
+        return AIMessage(content=f"answer {len(self.configs)}")
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        return self.invoke(messages, config, **kwargs)
+
+
+def test_personalities_opt_in():
+    assert not CachePolicy().is_eligible(RecordingModel(), "teacher")
+    assert CachePolicy(personalities=["teacher"]).is_eligible(RecordingModel(), "teacher")
+    assert not CachePolicy(personalities=["teacher"]).is_eligible(RecordingModel(temperature=0.7), "teacher")
+
+
+def test_opted_in_calls_are_replayed():
+    cache = ResponseCache(CachePolicy(personalities=["teacher"]))
+    llm = RecordingModel()
+    assert cache.invoke(llm, MESSAGES, CONFIG).content == "answer 1"
+    assert cache.invoke(llm, MESSAGES, CONFIG).content == "answer 1"
+    assert len(llm.configs) == 1
+
+
+def test_calls_are_not_cached_by_default():
+    cache = ResponseCache()
+    llm = RecordingModel()
+    cache.invoke(llm, MESSAGES, CONFIG)
+    assert cache.invoke(llm, MESSAGES, CONFIG).content == "answer 2"
+    assert cache.stats()["ineligible"] == 2
+
+
+def test_misses_forward_the_run_config():
+    llm = RecordingModel()
+    ResponseCache().invoke(llm, MESSAGES, CONFIG)
+    asyncio.run(ResponseCache().ainvoke(llm, MESSAGES, CONFIG))
+    assert llm.configs == [CONFIG, CONFIG]
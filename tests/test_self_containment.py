@@ -0,0 +1,52 @@
+import pytest
+
+from self_containment import HeuristicSelfContainmentDetector, named_subjects
+
+
+@pytest.fixture
+def detector():
+    return HeuristicSelfContainmentDetector()
+
+
+@pytest.mark.parametrize("question", [
+    "What year was construction finished?",
+    "Why was the design controversial?",
+    "How long did the construction take?",
+    "Who designed the structure originally?",
+])
+def test_follow_ups_without_pronouns_are_reformulated(detector, question):
+    assert not detector(question)
+
+
+@pytest.mark.parametrize("question", [
+    "How tall is it today?",
+    "And what about the Statue of Liberty?",
+    "Why?",
+])
+def test_anaphora_ellipsis_and_short_questions_are_reformulated(detector, question):
+    assert not detector(question)
+
+
+@pytest.mark.parametrize("question", [
+    "How tall is the Eiffel Tower?",
+    "What is the capital of France?",
+    "What changed in Python 3.12 compared to earlier releases?",
+])
+def test_questions_naming_their_subject_skip_reformulation(detector, question):
+    assert detector(question)
+
+
+def test_repeating_the_conversation_subject_skips_reformulation(detector):
+    # Naming the subject of the previous turns makes the question more self-contained, not less
+    assert detector("When did the Eiffel Tower open to visitors?")
+
+
+def test_classifier_has_the_final_say(detector):
+    strict = HeuristicSelfContainmentDetector(classifier=lambda question: 0.1)
+    assert not strict("How tall is the Eiffel Tower?")
+
+
+def test_named_subjects_skips_the_leading_capital():
+    assert named_subjects("What year was construction finished?") == []
+    assert named_subjects("How tall is the Eiffel Tower?") == ["Eiffel", "Tower"]
+    assert named_subjects("Is the NASA budget larger than 2020?") == ["NASA", "2020"]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import semantic_cache
+from self_containment import content_words
+from semantic_cache import HashingEmbedder, SemanticCache, _normalize, _stable_hash
+
+# Stand-in for an embedding model: words with the same meaning land on the same concept
+SYNONYMS = {"high": "height", "tall": "height", "meters": "height", "what's": "what"}
+
+
+class ConceptEmbedder:
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in content_words(text):
+                vectors[row, _stable_hash(SYNONYMS.get(word, word)) % self.dim] = 1.0
+        return _normalize(vectors)
+
+
+@pytest.fixture(params=[HashingEmbedder, ConceptEmbedder])
+def cache(request):
+    return SemanticCache(request.param())
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What are the health benefits of vitamin C?", "What are the health benefits of vitamin D?"),
+    ("How do I configure nginx as a reverse proxy?", "How do I configure apache as a reverse proxy?"),
+    ("What was the population of Paris in 1900?", "What was the population of Paris in 1990?"),
+    ("How do I undo the last git commit?", "How do I undo the last git push?"),
+])
+def test_similar_questions_about_different_things_miss(cache, cached, asked):
+    cache.add("partition", cached, "cached answer")
+    assert cache.lookup("partition", asked) is None
+
+
+@pytest.mark.parametrize("asked", [
+    "How high is the Eiffel Tower?",
+    "What is the height of the Eiffel Tower in meters?",
+    "Eiffel Tower: how tall is it?",
+])
+def test_paraphrases_hit(asked):
+    cache = SemanticCache(ConceptEmbedder())
+    cache.add("partition", "What is the height of the Eiffel Tower?", "cached answer")
+    assert cache.lookup("partition", asked) == "cached answer"
+
+
+def test_paraphrase_about_something_else_misses():
+    cache = SemanticCache(ConceptEmbedder())
+    cache.add("partition", "What is the height of the Eiffel Tower?", "cached answer")
+    assert cache.lookup("partition", "How tall is the Statue of Liberty?") is None
+
+
+def test_rephrasing_with_the_same_terms_hits(cache):
+    cache.add("partition", "What are the health benefits of vitamin C?", "cached answer")
+    assert cache.lookup("partition", "what are the health benefits of vitamin C") == "cached answer"
+
+
+def test_partitions_are_separate(cache):
+    cache.add("model a", "What are the health benefits of vitamin C?", "cached answer")
+    assert cache.lookup("model b", "What are the health benefits of vitamin C?") is None
+
+
+def test_cache_is_opt_in(monkeypatch):
+    monkeypatch.setattr(semantic_cache, "shared_semantic_cache", None)
+    assert semantic_cache.configure_semantic_cache() is None
+    assert isinstance(semantic_cache.configure_semantic_cache(enabled=True), SemanticCache)
+    assert isinstance(semantic_cache.configure_semantic_cache(HashingEmbedder()), SemanticCache)
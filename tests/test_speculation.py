@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+import speculation
+from speculation import SpeculationStats, SpeculativeResponder, context_coverage
+
+MESSAGES = [HumanMessage(content="Tell me about France."), AIMessage(content="France is in Europe."),
+            HumanMessage(content="What is its capital city?")]
+
+
+def responder(content="Paris is the capital of France."):
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content=content)]))
+    return SpeculativeResponder(llm, stats=SpeculationStats())
+
+
+def test_context_coverage():
+    assert context_coverage("the capital city of France", "What is the capital city of France?") == 1.0
+    assert context_coverage("the capital city of France", "What is the capital city of Germany?") == pytest.approx(2 / 3)
+    assert context_coverage("anything", "What is it?") == 1.0
+
+
+def test_covered_reformulation_keeps_the_speculative_answer():
+    speculator = responder()
+    answer = speculator.resolve(speculator.start(MESSAGES), "What is the capital city of France?")
+    assert answer == "Paris is the capital of France."
+    assert speculator.stats.snapshot()["wins"] == 1
+
+
+def test_reformulation_adding_context_discards_the_speculative_answer():
+    speculator = responder()
+    answer = speculator.resolve(speculator.start(MESSAGES), "What is the capital city of Austria's neighbour Germany?")
+    assert answer is None
+    assert speculator.stats.snapshot()["losses"] == 1
+
+
+@pytest.mark.parametrize("reformulated, expected", [
+    ("What is the capital city of France?", "Paris is the capital of France."),
+    ("What is the capital city of Austria's neighbour Germany?", None),
+])
+def test_async_accept_and_discard(reformulated, expected):
+    speculator = responder()
+
+    async def run():
+        return await speculator.aresolve(speculator.astart(MESSAGES), reformulated)
+
+    assert asyncio.run(run()) == expected
+
+
+def test_empty_speculative_answer_is_discarded():
+    speculator = responder(content="")
+    assert speculator.resolve(speculator.start(MESSAGES), "What is the capital city of France?") is None
+
+
+def test_responders_share_one_executor():
+    assert responder()._executor is responder()._executor is speculation.shared_executor
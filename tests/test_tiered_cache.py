@@ -0,0 +1,35 @@
+import time
+
+from tiered_cache import SQLiteCacheTier, TieredCache, cache_key
+
+
+def test_persistent_tier_survives_a_new_cache(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    TieredCache(persistent=SQLiteCacheTier(db_path)).put("key", {"answer": 42})
+    cache = TieredCache(persistent=SQLiteCacheTier(db_path))
+    assert cache.get("key") == {"answer": 42}
+    # Promoted to memory, so the second lookup doesn't touch SQLite
+    assert cache.get("key") == {"answer": 42}
+    stats = cache.stats()
+    assert (stats["persistent_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_expired_rows_are_not_served(tmp_path):
+    tier = SQLiteCacheTier(str(tmp_path / "cache.db"), ttl=0.05)
+    tier.put("key", "value")
+    assert tier.get("key") == "value"
+    time.sleep(0.1)
+    assert tier.get("key") is None
+
+
+def test_prune_keeps_the_newest_rows(tmp_path):
+    tier = SQLiteCacheTier(str(tmp_path / "cache.db"), max_entries=2)
+    for index in range(4):
+        tier.put(f"key {index}", index)
+    tier.prune()
+    assert [tier.get(f"key {index}") for index in range(4)] == [None, None, 2, 3]
+
+
+def test_cache_key_is_order_insensitive_for_dicts():
+    assert cache_key({"a": 1, "b": 2}, "text") == cache_key({"b": 2, "a": 1}, "text")
+    assert cache_key("a", "b") != cache_key("ab")
@@ -0,0 +1,54 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from token_budget import DEFAULT_TOKEN_BUDGET, resolve_token_budget, trim_lines_to_budget, trim_messages_to_budget
+
+
+class WordCounter:
+    """One token per word, and no per-message overhead, so budgets are easy to reason about"""
+    def count_text(self, text):
+        return len(text.split())
+
+    def count_message(self, message):
+        return self.count_text(message.content)
+
+
+COUNTER = WordCounter()
+SYSTEM = SystemMessage(content="be brief")
+MESSAGES = [SYSTEM, HumanMessage(content="one two three"), AIMessage(content="four five"),
+            HumanMessage(content="six seven"), AIMessage(content="eight"), HumanMessage(content="nine ten")]
+
+
+def contents(messages):
+    return [m.content for m in messages]
+
+
+def test_messages_that_fit_exactly_are_kept():
+    # 2 for the system prompt, then 2 + 1 + 2 for the newest three messages
+    assert contents(trim_messages_to_budget(MESSAGES, 7, COUNTER)) == ["be brief", "six seven", "eight", "nine ten"]
+
+
+def test_one_token_short_drops_the_oldest_turn():
+    trimmed = trim_messages_to_budget(MESSAGES, 6, COUNTER)
+    # "eight" would open the window as an orphaned assistant reply, so it goes too
+    assert contents(trimmed) == ["be brief", "nine ten"]
+
+
+def test_whole_history_fits():
+    assert trim_messages_to_budget(MESSAGES, 12, COUNTER) == MESSAGES
+
+
+def test_newest_message_is_always_kept():
+    assert contents(trim_messages_to_budget(MESSAGES, 1, COUNTER)) == ["be brief", "nine ten"]
+
+
+def test_lines_trim_at_the_boundary():
+    lines = ["User: a b", "Assistant: c", "User: d e"]
+    # Each line costs its words plus one separator
+    assert trim_lines_to_budget(lines, 7, COUNTER) == lines[1:]
+    assert trim_lines_to_budget(lines, 6, COUNTER) == lines[2:]
+    assert trim_lines_to_budget(lines, 11, COUNTER) == lines
+
+
+def test_budget_comes_from_the_run_config():
+    assert resolve_token_budget({"configurable": {"token_budget": 100}}) == 100
+    assert resolve_token_budget({}) == DEFAULT_TOKEN_BUDGET
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lru_cache import LRUCache
+from register_model import ConnectionPool
+
+
+def model_fingerprint(llm):
+    """Stable description of a chat model's identity and sampling settings"""
+    if llm is None:
+        return None
+    return {
+        "class": type(llm).__name__,
+        "model": getattr(llm, "model_name", None) or getattr(llm, "model", None),
+        "temperature": getattr(llm, "temperature", None),
+    }
+
+
+def cache_key(*parts):
+    """SHA-256 over the JSON encoding of the key parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return " ".join((text or "").split())
+
+
+class SQLiteCacheTier:
+    """
+    Persistent key/value cache tier in SQLite, shared across processes and restarts.
+    Values must be JSON-serializable. Expired and overflowing rows are pruned
+    every ``prune_every`` writes.
+    """
+    def __init__(self, db_path, table="cache", ttl=None, max_entries=100000, prune_every=256):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid cache table name '{table}'.")
+        self.db_path = db_path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._pool = ConnectionPool(os.path.abspath(db_path))
+        self._lock = threading.Lock()
+        try:
+            with self._pool.connection() as conn, conn:
+                conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        key TEXT NOT NULL PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                ''')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table} (created_at)')
+        except sqlite3.Error as e:
+            raise ValueError(f"Error initializing cache table '{table}': {e}") from e
+
+    def get(self, key):
+        with self._pool.connection() as conn:
+            row = conn.execute(f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._pool.connection() as conn, conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)',
+                         (key, json.dumps(value, ensure_ascii=False), time.time()))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows and the oldest rows beyond ``max_entries``"""
+        with self._pool.connection() as conn, conn:
+            if self.ttl is not None:
+                conn.execute(f'DELETE FROM {self.table} WHERE created_at < ?', (time.time() - self.ttl,))
+            conn.execute(f'''
+                DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def clear(self):
+        with self._pool.connection() as conn, conn:
+            conn.execute(f'DELETE FROM {self.table}')
+
+
+class TieredCache:
+    """In-memory LRU/TTL cache with an optional persistent tier behind it"""
+    def __init__(self, maxsize=2048, ttl=3600, persistent=None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.persistent = persistent
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return value
+        if self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                # Promote so the next lookup is served from memory
+                self.memory.put(key, value)
+                with self._lock:
+                    self.persistent_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.persistent is not None:
+            self.persistent.put(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self.memory),
+            }
@@ -0,0 +1,116 @@
+import threading
+
+from langchain_core.messages import SystemMessage
+
+from lru_cache import LRUCache
+
+# Prompt budget used when the registry has none configured for a model
+DEFAULT_TOKEN_BUDGET = 8192
+# Rough per-message overhead for role markers and separators in chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken, caching the count for every message and text
+    so each one is tokenized only once over the life of a thread.
+
+    tiktoken's encodings approximate non-OpenAI tokenizers closely enough for
+    budgeting. If the encoding can't be loaded (e.g. offline without a cached
+    BPE file), counts fall back to a characters-per-token estimate.
+    """
+    def __init__(self, encoding_name="cl100k_base", maxsize=50000):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_loaded = False
+        self._counts = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        with self._lock:
+            if not self._encoding_loaded:
+                try:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception:
+                    self._encoding = None
+                self._encoding_loaded = True
+            return self._encoding
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        count = self._counts.get(text)
+        if count is None:
+            encoding = self._get_encoding()
+            if encoding is not None:
+                count = len(encoding.encode(text, disallowed_special=()))
+            else:
+                count = len(text) // 4 + 1
+            self._counts.put(text, count)
+        return count
+
+    def count_message(self, message):
+        content = message.content
+        if not isinstance(content, str):
+            content = "".join(block.get("text", "") if isinstance(block, dict) else str(block)
+                              for block in content)
+        # Messages with ids are cached by id so long contents aren't re-hashed each turn
+        key = (message.type, message.id) if message.id else None
+        if key is not None:
+            count = self._counts.get(key)
+            if count is not None:
+                return count
+        count = self.count_text(content) + MESSAGE_OVERHEAD_TOKENS
+        if key is not None:
+            self._counts.put(key, count)
+        return count
+
+    def stats(self):
+        return self._counts.stats()
+
+
+token_counter = TokenCounter()
+
+
+def resolve_token_budget(config, key="token_budget"):
+    """Read a token budget from config["configurable"], falling back to the default"""
+    budget = (config or {}).get("configurable", {}).get(key)
+    return budget or DEFAULT_TOKEN_BUDGET
+
+
+def trim_messages_to_budget(messages, budget, counter=token_counter):
+    """
+    Keep system messages and as many of the most recent other messages as fit
+    in ``budget`` tokens. The newest message is always kept.
+    """
+    system_messages = [m for m in messages if isinstance(m, SystemMessage)]
+    remaining = budget - sum(counter.count_message(m) for m in system_messages)
+    kept = []
+    for message in reversed(messages):
+        if isinstance(message, SystemMessage):
+            continue
+        cost = counter.count_message(message)
+        if kept and cost > remaining:
+            break
+        kept.append(message)
+        remaining -= cost
+    kept.reverse()
+    # Don't open the trimmed window with an orphaned assistant reply
+    while len(kept) > 1 and kept[0].type != "human":
+        kept.pop(0)
+    return system_messages + kept
+
+
+def trim_lines_to_budget(lines, budget, counter=token_counter):
+    """Keep the most recent history lines that fit in ``budget`` tokens"""
+    kept = []
+    remaining = budget
+    for line in reversed(lines):
+        cost = counter.count_text(line) + 1
+        if cost > remaining:
+            break
+        kept.append(line)
+        remaining -= cost
+    kept.reverse()
+    return kept